@@ -14,6 +14,7 @@ https://github.com/patvarilly/periodic_kdtree
 """
 
 # Python imports
+import collections
 import copy
 import itertools
 import logging
@@ -76,6 +77,20 @@ class Block(object):
         self._centerOfMass = np.zeros(3)
         self._maxAtomRadius = -1
         self._radius = None
+        # Contiguous array of the coordinates of all atoms (including masked ones) in fragment order. The
+        # coordinates of the fragments are views into this array so the block can be moved as a whole
+        self._coordsArray = None
+        self._fragmentRows = None  # First row in _coordsArray of each fragment
+        self._fragmentMasses = None  # Total mass of each fragment
+        # Rows of _coordsArray holding each atom in external indices, and arrays of the atom data that
+        # depend only on which atoms are in the block
+        self._extRows = None
+        self._radii = None
+        self._symbols = None
+        self._types = None
+        # Bond graph and the angles and dihedrals derived from it, calculated when needed
+        self._bondGraph = None
+        self._topology = None
         self._blockMass = 0
         self.id = id(self)
         self._deterministicState = 0  # For keeping track of things during testing
@@ -159,19 +174,31 @@ class Block(object):
     def body(self, idxAtom):
         return self._bodies[idxAtom]
 
+    def bodies(self):
+        """Return an array of the body of each atom in external indices"""
+        return np.array(self._bodies, dtype=np.int64)
+
     def charge(self, idxAtom):
         frag, idxData = self._dataMap[idxAtom]
         return frag.charge(idxData)
 
+    def charges(self):
+        """Return an array of the charges of all atoms in external indices"""
+        return self._gatherAtoms([f._charges for f in self.fragments])
+
     def coord(self, idxAtom, coord=None):
         """Get and set coordinate in external indices"""
-        frag, idxData = self._dataMap[idxAtom]
         if coord is not None:
+            frag, idxData = self._dataMap[idxAtom]
             if isinstance(coord, list):
                 coord = np.array(coord)
             frag.coord(idxData, coord)
         else:
-            return frag.coord(idxData)
+            return self._blockCoords()[self._atomRows()[idxAtom]]
+
+    def coords(self):
+        """Return an (nAtoms, 3) array of the coordinates of all atoms in external indices"""
+        return self._blockCoords()[self._atomRows()]
 
     def fragment(self, idxAtom):
         frag, idxData = self._dataMap[idxAtom]
@@ -190,59 +217,46 @@ class Block(object):
         frag, idxData = self._dataMap[idxAtom]
         return frag.mass(idxData)
 
+    def masses(self):
+        """Return an array of the masses of all atoms in external indices"""
+        return self._gatherAtoms([f._masses for f in self.fragments])
+
     def radius(self, idxAtom):
         frag, idxData = self._dataMap[idxAtom]
         return frag.radius(idxData)
 
+    def radii(self):
+        """Return an array of the radii of all atoms in external indices"""
+        self._atomRows()
+        return self._radii
+
     def symbol(self, idxAtom):
         frag, idxData = self._dataMap[idxAtom]
         return frag.symbol(idxData)
 
+    def symbols(self):
+        """Return an array of the symbols of all atoms in external indices"""
+        self._atomRows()
+        return self._symbols
+
     def type(self, idxAtom):
         frag, idxData = self._dataMap[idxAtom]
         return frag.type(idxData)
 
+    def types(self):
+        """Return an array of the atom types of all atoms in external indices"""
+        self._atomRows()
+        return self._types
+
+    def unBonded(self):
+        """Return a boolean array of the atoms in external indices that are marked as unbonded"""
+        return self._gatherAtoms([f.unBonded for f in self.fragments]).astype(bool)
+
     def anglesAndDihedrals(self):
-        uniqueAngles = set()
-        for atom1, atom2 in self._bonds:
-            for atom in self._bondedToAtom[atom1]:
-                if atom != atom2:
-                    if atom < atom2:
-                        uniqueAngles.add((atom, atom1, atom2))
-                    else:
-                        uniqueAngles.add((atom2, atom1, atom))
-            for atom in self._bondedToAtom[atom2]:
-                if atom != atom1:
-                    if atom > atom1:
-                        uniqueAngles.add((atom1, atom2, atom))
-                    else:
-                        uniqueAngles.add((atom, atom2, atom1))
-
-        angles = sorted(list(uniqueAngles))
-
-        uniquePropers = set()
-        for angle in angles:
-            for atom in self._bondedToAtom[angle[0]]:
-                if atom != angle[1]:
-                    if atom < angle[2]:
-                        uniquePropers.add((atom, angle[0], angle[1], angle[2]))
-                    else:
-                        uniquePropers.add((angle[2], angle[1], angle[0], atom))
-            for atom in self._bondedToAtom[angle[2]]:
-                if atom != angle[1]:
-                    if atom > angle[0]:
-                        uniquePropers.add((angle[0], angle[1], angle[2], atom))
-                    else:
-                        uniquePropers.add((atom, angle[2], angle[1], angle[0]))
-        propers = sorted(list(uniquePropers))
-
-        impropers = []
-        for atom in range(len(self._dataMap)):
-            bondedTo = self._bondedToAtom[atom]
-            if len(bondedTo) > 2:
-                for subset in itertools.combinations(bondedTo, 3):
-                    impropers.append((atom, subset[0], subset[1], subset[2]))
-        return angles, propers, impropers
+        """Return lists of the angles, proper and improper dihedrals as tuples of atom indices"""
+        return tuple(
+            [tuple(row) for row in indices.tolist()] for indices in self.topology()
+        )
 
     def atomEndGroups(self, idxAtom):
         """Return a list of the endGroup objects for this atom
@@ -257,6 +271,32 @@ class Block(object):
         """All bonds in external indices"""
         return self._bonds
 
+    def bondGraph(self):
+        """Return the bonds as a sparse adjacency in external indices (see xyz_core.bondGraph).
+
+        The graph is cached until the bonds of the block change."""
+        if getattr(self, "_bondGraph", None) is None:
+            self._bondGraph = xyz_core.bondGraph(self._bonds, len(self._dataMap))
+            for a in self._bondGraph:
+                a.flags.writeable = False
+        return self._bondGraph
+
+    def topology(self):
+        """Return arrays of the angles, proper and improper dihedrals of the block in external indices.
+
+        They are derived from the bondGraph (see xyz_core.bondTopology) and cached until the bonds of
+        the block change, so the arrays are read-only. A block of a single fragment with no masked cap or
+        uw atoms has the topology template of its fragmentType, which is shared rather than derived again.
+        """
+        if getattr(self, "_topology", None) is None:
+            if len(self.fragments) == 1 and not np.any(self.fragments[0].masked):
+                self._topology = self.fragments[0].topologyTemplate()
+            else:
+                self._topology = xyz_core.bondTopology(*self.bondGraph())
+            for a in self._topology:
+                a.flags.writeable = False
+        return self._topology
+
     def blockBonds(self):
         """External indices"""
         return [
@@ -268,15 +308,16 @@ class Block(object):
         """ Add newBlock to this one
         """
         assert bond.endGroup1.block() == self
-        # Tried optimising this by passing in the bond to update and only updating those fragments/
-        # endGroups that had changed but it rapidly got rather complicated so we keep to a simple
-        # update and add the data for the new block here
+        numFragments = len(self.fragments)
+        numFragmentBonds = len(self._bonds) - len(self._blockBonds)
         # Append fragments and bonds of other block to this one
         if not bond.isInternalBond():
             self.fragments += bond.endGroup2.block().fragments
             self._blockBonds += bond.endGroup2.block()._blockBonds
         self._blockBonds.append(bond)
-        return self._update()
+        if not self._updateBonded(bond, numFragments, numFragmentBonds):
+            self._update()
+        return
 
     def blockRadius(self):
         if self._changed:
@@ -284,17 +325,15 @@ class Block(object):
         return self._radius
 
     def _calcCenters(self):
-        sumG = np.zeros(3)
-        sumM = np.zeros(3)
-        totalMass = 0.0
-        for f in self.fragments:
-            mass = f.totalMass()
-            totalMass += mass
-            sumG += f.centroid()
-            sumM += mass * f.centroid()
-
-        self._centroid = sumG / len(self.fragments)
-        self._centerOfMass = sumM / totalMass
+        # The centroid is the mean of the fragment centroids and the center of mass weights the fragment
+        # centroids by the fragment masses
+        coords = self._blockCoords()
+        counts = np.diff(np.append(self._fragmentRows, len(coords)))
+        centroids = np.add.reduceat(coords, self._fragmentRows) / counts[:, np.newaxis]
+        self._centroid = np.sum(centroids, axis=0) / len(self.fragments)
+        self._centerOfMass = np.dot(self._fragmentMasses, centroids) / np.sum(
+            self._fragmentMasses
+        )
         return
 
     def _calcRadius(self):
@@ -302,17 +341,13 @@ class Block(object):
         two blocks are within touching distance
         Assumes centroid already calculated
         """
-        distances = []
-        self._maxAtomRadius = 0.0
-        for f in self.fragments:
-            for coord in f.iterCoord():
-                distances.append(xyz_core.distance(self._centroid, coord))
-                self._maxAtomRadius = max(f.maxAtomRadius(), self._maxAtomRadius)
-        assert distances
-        imax = np.argmax(distances)
-        dist = distances[imax]
+        coords = self.coords()
+        assert len(coords)
+        distances = xyz_core.distance(self._centroid, coords)
+        self._maxAtomRadius = max(f.maxAtomRadius() for f in self.fragments)
+        dist = np.max(distances)
         # Add on the radius of the largest atom
-        self._radius = dist + self.maxAtomRadius()
+        self._radius = dist + self._maxAtomRadius
         return
 
     def _calcProperties(self):
@@ -338,12 +373,133 @@ class Block(object):
             self._calcProperties()
         return self._centroid
 
+    def __getstate__(self):
+        """Drop the coordinate array and the cached topology and atom arrays when copying or pickling.
+
+        The fragments' coordinates would otherwise be copied separately from the array and no longer be
+        views into it, and the atom arrays would lose their read-only flag. They are rebuilt from the
+        fragments when they are next needed."""
+        d = dict(self.__dict__)
+        d["_coordsArray"] = None
+        d["_bondGraph"] = None
+        d["_topology"] = None
+        d["_extRows"] = None
+        return d
+
     def copy(self):
         """Return a copy of ourselves."""
         new = copy.deepcopy(self)
         new.id = id(new)
         return new
 
+    def newInstance(self):
+        """Return a new block from a prototype block with a single unbonded fragment.
+
+        The new block shares the data that doesn't change between blocks of the fragmentType with the
+        prototype, so only the fragment, the per-atom lists and the endGroup state are copied rather than
+        being rebuilt with _update (see Cell.getLibraryBlock).
+        """
+        assert (
+            len(self.fragments) == 1 and not self._blockBonds
+        ), "Not a prototype block"
+        fragment = self.fragments[0].copy()
+        new = Block.__new__(Block)
+        new.__dict__.update(self.__dict__)
+        new.fragments = [fragment]
+        fragment.block = new
+        new._blockBonds = []
+        new._dataMap = [(fragment, i) for _, i in self._dataMap]
+        new._bodies = list(self._bodies)
+        new._bonds = list(self._bonds)
+        new._bondsByFragmentType = list(self._bondsByFragmentType)
+        new._bondedToAtom = [set(bonded) for bonded in self._bondedToAtom]
+        new._fragmentTypeDict = dict(self._fragmentTypeDict)
+        new._resetEndGroups()
+        new._centroid = np.copy(self._centroid)
+        new._centerOfMass = np.copy(self._centerOfMass)
+        new._coordsArray = None
+        new.id = id(new)
+        new._deterministicState = 0
+        return new
+
+    def resetInstance(self, prototype):
+        """Return a block created with newInstance to the state of its prototype so that it can be reused.
+
+        The block must not have been bonded. The coordinates are reset in place and the block gets new endGroups
+        so that it can't be confused with the block it was before.
+        """
+        assert (
+            len(self.fragments) == 1 and not self._blockBonds
+        ), "Cannot reset a bonded block"
+        fragment = self.fragments[0]
+        fragment._endGroups = [
+            endGroup.copy(fragment) for endGroup in prototype.fragments[0].endGroups()
+        ]
+        self._resetEndGroups()
+        self._blockCoords()[:] = prototype._blockCoords()
+        self._fragmentsMoved()
+        self._changed = True
+        self._deterministicState = 0
+        return
+
+    def checkUpdate(self):
+        """Compare the data of the block with that from a full _update of a copy of it.
+
+        Returns:
+        A list of the names of the data that differ, which is empty if the block is consistent
+        """
+        other = copy.deepcopy(self)
+        other._update()
+
+        def fragmentIdx(block):
+            return dict((id(f), i) for i, f in enumerate(block.fragments))
+
+        def endGroupIdx(block):
+            idx = {}
+            for i, f in enumerate(block.fragments):
+                for j, eg in enumerate(f.endGroups()):
+                    idx[id(eg)] = (i, j)
+            return idx
+
+        def summary(block):
+            fidx = fragmentIdx(block)
+            eidx = endGroupIdx(block)
+            return {
+                "_dataMap": [(fidx[id(f)], i) for f, i in block._dataMap],
+                "_bodies": list(block._bodies),
+                "_bonds": list(block._bonds),
+                "_bondsByFragmentType": list(block._bondsByFragmentType),
+                "_bondedToAtom": list(block._bondedToAtom),
+                "_fragmentTypeDict": block._fragmentTypeDict,
+                "_numFreeEndGroups": block._numFreeEndGroups,
+                "_freeEndGroups": [
+                    (k, [eidx[id(eg)] for eg in v])
+                    for k, v in block._freeEndGroups.items()
+                ],
+                "_endGroupType2EndGroups": [
+                    (k, [eidx[id(eg)] for eg in v])
+                    for k, v in block._endGroupType2EndGroups.items()
+                ],
+                "blockIdx": [f.blockIdx for f in block.fragments],
+                "endGroups": [
+                    (
+                        eg.blockEndGroupIdx,
+                        eg.blockCapIdx,
+                        eg.blockDihedralIdx,
+                        eg.blockUwIdx,
+                    )
+                    for f in block.fragments
+                    for eg in f.endGroups()
+                ],
+            }
+
+        mine = summary(self)
+        theirs = summary(other)
+        errors = [k for k in sorted(mine) if mine[k] != theirs[k]]
+        if not np.isclose(self._blockMass, other._blockMass):
+            errors.append("_blockMass")
+        return errors
+
     def dataByFragment(self, fragmentType):
         """Return the data for a specific fragmentType within the block"""
 
@@ -380,80 +536,25 @@ class Block(object):
             assert root in [f1, f2], "Root must be attached to the bond"
         self._blockBonds.remove(bond)
 
-        # Create dictionary of which fragments are bonded to which fragments
-        bondedToFragment = {
-            f1: set(),
-            f2: set(),
-        }  # Need to add those from bond as might not be connected
-        for b in self._blockBonds:
-            if b.rootFragment not in bondedToFragment:
-                bondedToFragment[b.rootFragment] = set()
-            if b.targetFragment not in bondedToFragment:
-                bondedToFragment[b.targetFragment] = set()
-            bondedToFragment[b.rootFragment].add(b.targetFragment)
-            bondedToFragment[b.targetFragment].add(b.rootFragment)
-
-        def addFragments(startf, f1set):
-            # Trundle through the bond topology for f1 and set True for all fragments we reach
-            for f in bondedToFragment[startf]:
-                if f not in f1set and f != startf:
-                    f1set.add(f)
-                    f1set.update(addFragments(f, f1set))
-            return f1set
-
-        # Sets of which fragments can be reached from each fragment
-        # HACK - NEED TO ADD THE ROOT FRAGMENT IF IT'S NOT ALREADY IN THERE
-        # ALGORITHM NEEDS MORE WORK!
-        f1set = addFragments(f1, set([f1]))
-        f2set = addFragments(f2, set([f2]))
-        if bool(f1set.intersection(f2set)):
+        # The fragments that can still be reached from f1 - if that includes f2 the bond was in a ring
+        f1set = self._connectedFragments(f1, self._fragmentAdjacency())
+        if f2 in f1set:
             logger.info("deleteBond broke internal bond")
             # Fragments in common with both, so just delete the bond
             bond.separate()
             self._update()
             return None
 
-        # Bit cludgy - we need to make sure that the root fragment is always first in the list of fragments
-        # jmht - consider adding rootFragment attribute?
-        f1list = list(f1set)
-        f1list.remove(f1)
-        f1list.insert(0, f1)
-
-        f2list = list(f2set)
-        f2list.remove(f2)
-        f2list.insert(0, f2)
-
         # Breaking the bond splits the block in two, so we separate the two fragments, keep the largest
-        # for ourselves and return the new block. We set f1 and f1set to be the biggest
-        if root:
-            if root == f2:
-                # swap so the root fragment stays with us
-                tmp = f1list
-                f1list = f2list
-                f2list = tmp
-                tmp = f1
-                f1 = f2
-                f2 = tmp
-        else:
-            if len(f2list) > len(f1list):
-                tmp = f1list
-                f1list = f2list
-                f2list = tmp
-                tmp = f1
-                f1 = f2
-                f2 = tmp
-
-        # How to partition the bonds? - use lists as we want to preserve order if possible
-        f1bonds = []
-        f2bonds = []
-        for b in self._blockBonds:
-            if b.rootFragment in f1list and b.targetFragment in f1list:
-                f1bonds.append(b)
-            elif b.rootFragment in f2list and b.targetFragment in f2list:
-                f2bonds.append(b)
-            else:
-                raise RuntimeError("Bond crosses set: {0}".format(b))
+        # for ourselves and return the new block. The block was connected, so f2 reaches everything else.
+        f2set = set(f for f in self.fragments if f not in f1set)
+        if (root and root == f2) or (not root and len(f2set) > len(f1set)):
+            f1, f2 = f2, f1
+            f1set, f2set = f2set, f1set
+        f1list, f1bonds = self._fragmentPartition(f1, f1set)
+        f2list, f2bonds = self._fragmentPartition(f2, f2set)
         bond.separate()
+
         # Create a new block with the smaller fragments
         newBlock = Block()
         newBlock.fragments = f2list
@@ -486,25 +587,68 @@ class Block(object):
         ]
         assert len(dbonds), "Fragment is not involved in any bonds!"
 
-        # Loop through deleting all bonds and returning any blocks created
-        # The fragment we are deleting will always stay within this block as we use the root= keyword
+        # Remove all the bonds at once - each group of fragments still connected without the fragment
+        # becomes a new block. The fragment itself is left on its own in this block.
+        dset = set(dbonds)
+        self._blockBonds = [b for b in self._blockBonds if b not in dset]
+        for bond in dbonds:
+            bond.separate()
+        adjacency = self._fragmentAdjacency()
         blocks = []
+        assigned = set([frag])
         for bond in dbonds:
-            block = self.deleteBond(bond, root=frag)
-            if block:
+            for f in [bond.rootFragment, bond.targetFragment]:
+                if f in assigned:
+                    continue
+                fset = self._connectedFragments(f, adjacency)
+                assigned.update(fset)
+                block = Block()
+                block.fragments, block._blockBonds = self._fragmentPartition(f, fset)
+                block._update()
                 blocks.append(block)
 
-        # Now we need to delete the fragment from ourself and update
-        if len(self.fragments) > 1:
-            self.fragments.remove(frag)
-            self._update()
-            blocks.append(self)
-        else:
-            assert frag in self.fragments
-            # The only remainig block was the one to delete so we don't do anything
-
+        self.fragments = [frag]
+        self._blockBonds = []
+        self._update()
         return blocks
 
+    def _fragmentAdjacency(self):
+        """Return a dict mapping each fragment to the set of fragments it is bonded to by the blockBonds"""
+        adjacency = collections.defaultdict(set)
+        for b in self._blockBonds:
+            adjacency[b.rootFragment].add(b.targetFragment)
+            adjacency[b.targetFragment].add(b.rootFragment)
+        return adjacency
+
+    @staticmethod
+    def _connectedFragments(start, adjacency):
+        """Return the set of fragments that can be reached from start through the adjacency dict.
+        This is a breadth-first search so it can't run out of stack on long chains of fragments.
+        """
+        fset = set([start])
+        queue = collections.deque([start])
+        while queue:
+            for f in adjacency.get(queue.popleft(), ()):
+                if f not in fset:
+                    fset.add(f)
+                    queue.append(f)
+        return fset
+
+    def _fragmentPartition(self, first, fset):
+        """Return the fragments in fset and the blockBonds between them for a block split from this one.
+
+        Args:
+        first: the fragment to put first in the list of fragments
+        fset: the set of fragments for the block
+
+        Returns:
+        the list of fragments in our order after first, and the list of blockBonds in our order
+        """
+        fragments = [first]
+        fragments += [f for f in self.fragments if f in fset and f is not first]
+        bonds = [b for b in self._blockBonds if b.rootFragment in fset]
+        return fragments, bonds
+
     def dihedrals(self, atom1Idx, atom2Idx, bondOnly=False):
         """Return a list of all the dihedrals around these two bonded atoms
         input & output in internacl coodrdinates
@@ -651,13 +795,29 @@ class Block(object):
             return True
         return False
 
+    def isEndGroupArray(self, idxAtoms, caps=False):
+        """Return a boolean array indicating which of the atoms in the idxAtoms array are free endGroups
+
+        Args:
+        caps - also flag the cap atoms of the free endGroups
+        """
+        atoms = list(self._freeEndGroups.keys())
+        if caps:
+            atoms += [
+                eg.blockCapIdx for egs in self._freeEndGroups.values() for eg in egs
+            ]
+        return np.isin(idxAtoms, atoms)
+
     def iterCoord(self):
         """Generator to return the coordinates"""
-        for i in range(len(self._dataMap)):
-            yield self.coord(i)
+        coords = self._blockCoords()
+        for row in self._atomRows():
+            yield coords[row]
         return
 
     def maxAtomRadius(self):
+        if self._changed:
+            self._calcProperties()
         assert self._maxAtomRadius > 0
         return self._maxAtomRadius
 
@@ -785,8 +945,7 @@ class Block(object):
         if center is None:
             center = np.array([0, 0, 0])
         rotationMatrix = xyz_core.rotation_matrix(axis, angle)
-        for f in self.fragments:
-            f.rotate(rotationMatrix, center)
+        self._rotateCoords(rotationMatrix, center)
         return
 
     def rotateT(self, axis, angle, center=None):
@@ -795,11 +954,25 @@ class Block(object):
         origin = np.array([0, 0, 0])
         self.translateCentroid(origin)
         rotationMatrix = xyz_core.rotation_matrix(axis, angle)
-        for f in self.fragments:
-            f.rotate(rotationMatrix, origin)
+        self._rotateCoords(rotationMatrix, origin)
         self.translateCentroid(position)
         return
 
+    def _rotateCoords(self, rotationMatrix, center):
+        """Rotate all the coordinates in place about center"""
+        coords = self._blockCoords()
+        coords[:] = np.dot(coords - center, rotationMatrix.T) + center
+        self._fragmentsMoved()
+        return
+
+    def setCoords(self, coords):
+        """Set the coordinates of all atoms from an (nAtoms, 3) array in external indices"""
+        assert len(coords) == self.numAtoms(), "setCoords needs a coordinate for every atom"
+        self._blockCoords()[self._atomRows()] = coords
+        self._fragmentsMoved()
+        self._changed = True
+        return
+
     def solvent(self):
         return len(self.fragments) == 1 and self.fragments[0].solvent is True
 
@@ -829,7 +1002,7 @@ class Block(object):
 
             # We can definitely return something so pick a random fragment type and get a random endGroup
             if random:
-                ftype = _random.choice(list(common))
+                ftype = _random.choice(sorted(common))
                 endGroup = _random.choice(self.freeEndGroups(endGroupTypes=[ftype]))
             else:
                 i = self._deterministicState % len(common)
@@ -849,9 +1022,9 @@ class Block(object):
         if isinstance(tvector, list):
             tvector = np.array(tvector)
 
-        # Loop through each fragment and translate each in turn
-        for f in self.fragments:
-            f.translate(tvector)
+        coords = self._blockCoords()
+        coords += tvector
+        self._fragmentsMoved()
         self._changed = True
         return
 
@@ -868,33 +1041,15 @@ class Block(object):
         # overall block atom index to the fragment and fragment atom index
         self._dataMap = []
         self._bodies = []
+        self._coordsArray = None
+        self._extRows = None
         self._blockMass = 0
         self._fragmentTypeDict = {}
         bodyCount = -1
         lastBody = 0
         for fragment in self.fragments:
-            # Set the block
-            fragment.block = self
-            # Increment body count for each fragment
-            bodyCount += 1
-            # Count the number of each type of fragment in the block (see Analyse)
-            t = fragment.fragmentType
-            if t not in self._fragmentTypeDict:
-                self._fragmentTypeDict[t] = 1
-            else:
-                self._fragmentTypeDict[t] += 1
-            fragment.blockIdx = len(
-                self._dataMap
-            )  # Mark where the data starts in the block
-            for i in range(fragment.numAtoms()):
-                self._dataMap.append((fragment, i))
-                # Bring up the bodies
-                b = fragment.body(i)
-                if b != lastBody:
-                    bodyCount += 1
-                    lastBody = b
-                self._bodies.append(bodyCount)
-                self._blockMass += fragment.mass(i)
+            self._countFragment(fragment)
+            bodyCount, lastBody = self._appendFragmentData(fragment, bodyCount, lastBody)
         # Have dataMap so now update the endGroup information
         self._numFreeEndGroups = 0
         self._freeEndGroups = {}
@@ -906,42 +1061,21 @@ class Block(object):
                 # Set the block index - we sort out the others after we've done bonding
                 endGroup.updateEndGroupIndex()
                 if endGroup.free():
-                    # Add to the list of all free endGroups
-                    try:
-                        self._freeEndGroups[endGroup.blockEndGroupIdx].append(endGroup)
-                    except KeyError:
-                        self._freeEndGroups[endGroup.blockEndGroupIdx] = [endGroup]
-                    self._numFreeEndGroups += 1
-                    # Now add to the type list
-                    if endGroup.type() not in self._endGroupType2EndGroups:
-                        self._endGroupType2EndGroups[endGroup.type()] = []
-                    self._endGroupType2EndGroups[endGroup.type()].append(endGroup)
+                    self._addFreeEndGroup(endGroup)
         # Now need to create the list of all bonds throughout the block
         self._bonds = []
         self._bondsByFragmentType = []
+        self._bondGraph = None
+        self._topology = None
         # First all bonds within the fragments
         for fragment in self.fragments:
-            for b1, b2 in fragment.bonds():
-                # Convert to block indices
-                b1 = b1 + fragment.blockIdx
-                b2 = b2 + fragment.blockIdx
-                self._bonds.append((b1, b2))
-                self._bondsByFragmentType.append((fragment.fragmentType, (b1, b2)))
+            self._appendFragmentBonds(fragment)
         # Then all bonds between fragments
-        cap2EndGroup = {}
         for b in self._blockBonds:
             self._bonds.append(
                 (b.endGroup1.blockEndGroupIdx, b.endGroup2.blockEndGroupIdx)
             )
-            # Need to map cap atoms to their bonded counterparts so we can look these up when we
-            # fix the endGroup indices - we map the fragment, fragmentIndex to the corresponding block index
-            # This is somewhat untidy as we use the internal fragment index here - which really should be hidden
-            cap2EndGroup[
-                (b.endGroup1.fragment, b.endGroup1.fragmentCapIdx)
-            ] = b.endGroup2.blockEndGroupIdx
-            cap2EndGroup[
-                (b.endGroup2.fragment, b.endGroup2.fragmentCapIdx)
-            ] = b.endGroup1.blockEndGroupIdx
+        cap2EndGroup = self._cap2EndGroup(self._blockBonds)
         # Now create the list of which atoms are bonded to which
         self._bondedToAtom = []
         for i in range(len(self._dataMap)):
@@ -957,6 +1091,346 @@ class Block(object):
         self._calcProperties()
         return
 
+    def _updateBonded(self, bond, numFragments, numFragmentBonds):
+        """Update the block data after a bond has been made without rebuilding it from every fragment.
+
+        Making the bond masks the cap atoms of the two endGroups, so the data for the bonded fragments in this
+        block is rebuilt and the indices of all atoms after the first masked atom are shifted down. The data
+        for any fragments that were added from the other block are then appended.
+
+        Args:
+        bond - the bond that has just been made
+        numFragments - the number of fragments in the block before the bond was made
+        numFragmentBonds - the number of bonds within fragments before the bond was made
+
+        Returns:
+        False if the data could not be updated, in which case the block needs a full _update
+        """
+        oldSize = len(self._dataMap)
+        oldFragments = self.fragments[:numFragments]
+        newFragments = self.fragments[numFragments:]
+        # Find the atoms that were masked in the bonded fragments that were already in this block
+        changed = []
+        removed = []
+        for endGroup in (bond.endGroup1, bond.endGroup2):
+            fragment = endGroup.fragment
+            if fragment.block is not self:
+                continue
+            masked = [
+                i for i in (endGroup.fragmentCapIdx, endGroup.fragmentUwIdx) if i != -1
+            ]
+            wasUnmasked = ~np.array(fragment.masked, dtype=bool)
+            wasUnmasked[masked] = True
+            i = oldFragments.index(fragment)
+            if i + 1 < numFragments:
+                end = oldFragments[i + 1].blockIdx
+            else:
+                end = oldSize
+            if fragment.blockIdx + np.count_nonzero(wasUnmasked) != end:
+                # Other atoms have changed so we can't work out where the old atoms were
+                return False
+            removed.extend(fragment.blockIdx + np.cumsum(wasUnmasked)[masked] - 1)
+            changed.append((fragment.blockIdx, end, fragment, wasUnmasked, masked))
+        assert changed, "Bond does not involve a fragment in this block"
+        changed.sort(key=lambda c: c[0])
+        removed = np.unique(np.array(removed, dtype=np.int64))
+        first = int(removed[0])
+        isRemoved = np.zeros(oldSize, dtype=bool)
+        isRemoved[removed] = True
+        remap = np.arange(oldSize) - np.cumsum(isRemoved)
+        remap[removed] = -1
+        remapArray = remap
+        remap = remap.tolist()
+
+        # Rebuild the data for the changed fragments and shift the fragments after them
+        dataMap = self._dataMap
+        bodies = self._bodies
+        self._dataMap = []
+        self._bodies = []
+        self._extRows = None
+        if len(self.fragments) != numFragments:
+            self._coordsArray = None
+        prev = 0
+        for begin, end, fragment, wasUnmasked, masked in changed:
+            self._dataMap += dataMap[prev:begin]
+            self._bodies += bodies[prev:begin]
+            self._blockMass -= np.sum(fragment._masses[wasUnmasked])
+            bodyCount, lastBody = self._appendFragmentData(fragment, *self._bodyState())
+            # The bodies of the following atoms only stay the same if we end in the same state
+            lastInternal = np.flatnonzero(wasUnmasked)[-1]
+            if bodyCount != bodies[end - 1] or lastBody != fragment._bodies[lastInternal]:
+                return False
+            prev = end
+        self._dataMap += dataMap[prev:]
+        self._bodies += bodies[prev:]
+        # Fragments from the first changed one onwards have moved, as have the endGroups in them
+        start = changed[0][0]
+        tailFragments = oldFragments[oldFragments.index(changed[0][2]) :]
+        rebuilt = set(c[2] for c in changed)
+        for fragment in tailFragments:
+            if fragment not in rebuilt:
+                fragment.blockIdx = remap[fragment.blockIdx]
+        for fragment in newFragments:
+            self._countFragment(fragment)
+            self._appendFragmentData(fragment, *self._bodyState())
+        rebuilt.update(newFragments)
+        tailFragments += newFragments
+
+        # Remove the endGroups of the moved fragments from the lists of free endGroups. These are in the order
+        # of the fragments so only the entries at the end of the lists need removing.
+        self._freeEndGroups = dict(
+            itertools.takewhile(lambda i: i[0] < start, self._freeEndGroups.items())
+        )
+        for endGroupType in list(self._endGroupType2EndGroups.keys()):
+            endGroups = self._endGroupType2EndGroups[endGroupType]
+            while endGroups and endGroups[-1].blockEndGroupIdx >= start:
+                endGroups.pop()
+            if not endGroups:
+                del self._endGroupType2EndGroups[endGroupType]
+        self._numFreeEndGroups = sum(len(egs) for egs in self._freeEndGroups.values())
+        # The atoms before the moved ones that are bonded to them, whose fragments have endGroups that are
+        # defined by the moved atoms
+        crossed = []
+        for b, (b1, b2) in zip(self._blockBonds, self._bonds[numFragmentBonds:]):
+            if b1 < start <= b2:
+                crossed.append((b1, b.endGroup1.fragment))
+            elif b2 < start <= b1:
+                crossed.append((b2, b.endGroup2.fragment))
+        for fragment in set(f for _, f in crossed):
+            for endGroup in fragment.endGroups():
+                if not self._shiftEndGroup(endGroup, remap, first):
+                    return False
+
+        for fragment in tailFragments:
+            for endGroup in fragment.endGroups():
+                endGroup.updateEndGroupIndex()
+        cap2EndGroup = self._cap2EndGroup(
+            [
+                b
+                for b in self._blockBonds
+                if b.endGroup1.fragment in rebuilt or b.endGroup2.fragment in rebuilt
+            ]
+        )
+        for fragment in tailFragments:
+            for endGroup in fragment.endGroups():
+                if fragment in rebuilt:
+                    endGroup.updateAncillaryIndices(cap2EndGroup)
+                elif not self._shiftEndGroup(endGroup, remap, first):
+                    return False
+                if endGroup.free():
+                    self._addFreeEndGroup(endGroup)
+
+        # Fragment bonds are in the order of the fragments so only those of the moved fragments change. Find
+        # where they start with a binary search.
+        bonds = self._bonds
+        bondsByFragmentType = self._bondsByFragmentType
+        n0 = 0
+        n1 = numFragmentBonds
+        while n0 < n1:
+            mid = (n0 + n1) // 2
+            if min(bonds[mid]) < start:
+                n0 = mid + 1
+            else:
+                n1 = mid
+        fragmentBonds = np.array(bonds[n0:numFragmentBonds], dtype=np.int64)
+        remapped = remapArray[fragmentBonds.reshape(-1, 2)]
+        keep = np.all(remapped >= 0, axis=1)
+        tail = [tuple(b) for b in remapped[keep].tolist()]
+        self._bonds = bonds[:n0] + tail
+        self._bondGraph = None
+        self._topology = None
+        self._bondsByFragmentType = bondsByFragmentType[:n0] + [
+            (ftype, b)
+            for (ftype, _), b in zip(
+                itertools.compress(bondsByFragmentType[n0:], keep.tolist()), tail
+            )
+        ]
+        for fragment in newFragments:
+            self._appendFragmentBonds(fragment)
+        numNewFragmentBonds = len(self._bonds)
+        for b in self._blockBonds:
+            self._bonds.append(
+                (b.endGroup1.blockEndGroupIdx, b.endGroup2.blockEndGroupIdx)
+            )
+
+        # Shift the bonded atoms. Atoms before the moved ones only change if they are bonded to them.
+        bondedToAtom = self._bondedToAtom
+        self._bondedToAtom = bondedToAtom[:start]
+        shift = remap.__getitem__
+        for a1, _ in crossed:
+            self._bondedToAtom[a1] = set(map(shift, bondedToAtom[a1]))
+        for i in range(start, oldSize):
+            if remap[i] != -1:
+                bonded = set(map(shift, bondedToAtom[i]))
+                bonded.discard(-1)
+                self._bondedToAtom.append(bonded)
+        for i in range(len(self._bondedToAtom), len(self._dataMap)):
+            self._bondedToAtom.append(set())
+        numOldBlockBonds = len(bonds) - numFragmentBonds
+        newBonds = (
+            self._bonds[n0 + len(tail) : numNewFragmentBonds]
+            + self._bonds[numNewFragmentBonds + numOldBlockBonds :]
+        )
+        for b1, b2 in newBonds:
+            self._bondedToAtom[b1].add(b2)
+            self._bondedToAtom[b2].add(b1)
+        # The centroid and radius are recalculated when they are next needed
+        self._changed = True
+        return True
+
+    def _addFreeEndGroup(self, endGroup):
+        """Add endGroup to the lists of free endGroups"""
+        try:
+            self._freeEndGroups[endGroup.blockEndGroupIdx].append(endGroup)
+        except KeyError:
+            self._freeEndGroups[endGroup.blockEndGroupIdx] = [endGroup]
+        self._numFreeEndGroups += 1
+        # Now add to the type list
+        if endGroup.type() not in self._endGroupType2EndGroups:
+            self._endGroupType2EndGroups[endGroup.type()] = []
+        self._endGroupType2EndGroups[endGroup.type()].append(endGroup)
+        return
+
+    def _resetEndGroups(self):
+        """Rebuild the free endGroup data of a block with a single unbonded fragment"""
+        self._numFreeEndGroups = 0
+        self._freeEndGroups = {}
+        self._endGroupType2EndGroups = {}
+        for endGroup in self.fragments[0].endGroups():
+            if endGroup.free():
+                self._addFreeEndGroup(endGroup)
+        return
+
+    def _shiftEndGroup(self, endGroup, remap, first):
+        """Shift the block indices of the ancillary atoms of endGroup that are at or after first.
+
+        Returns:
+        False if one of the atoms has been removed
+        """
+        if endGroup.blockCapIdx >= first:
+            endGroup.blockCapIdx = remap[endGroup.blockCapIdx]
+            if endGroup.blockCapIdx == -1:
+                return False
+        if endGroup.fragmentDihedralIdx != -1 and endGroup.blockDihedralIdx >= first:
+            endGroup.blockDihedralIdx = remap[endGroup.blockDihedralIdx]
+            if endGroup.blockDihedralIdx == -1:
+                return False
+        if (
+            endGroup.fragmentUwIdx != -1
+            and not endGroup.fragment.masked[endGroup.fragmentUwIdx]
+            and endGroup.blockUwIdx >= first
+        ):
+            endGroup.blockUwIdx = remap[endGroup.blockUwIdx]
+            if endGroup.blockUwIdx == -1:
+                return False
+        return True
+
+    def _appendFragmentBonds(self, fragment):
+        """Add the bonds within fragment to the list of bonds"""
+        for b1, b2 in fragment.bonds():
+            # Convert to block indices
+            b1 = b1 + fragment.blockIdx
+            b2 = b2 + fragment.blockIdx
+            self._bonds.append((b1, b2))
+            self._bondsByFragmentType.append((fragment.fragmentType, (b1, b2)))
+        return
+
+    def _appendFragmentData(self, fragment, bodyCount, lastBody):
+        """Add the atoms of fragment to the end of the block data.
+
+        Args:
+        bodyCount - the body of the last atom in the block
+        lastBody - the fragment body of the last atom in the block
+
+        Returns:
+        the updated bodyCount and lastBody
+        """
+        # Set the block
+        fragment.block = self
+        # Increment body count for each fragment
+        bodyCount += 1
+        fragment.blockIdx = len(self._dataMap)  # Mark where the data starts in the block
+        for i in range(fragment.numAtoms()):
+            self._dataMap.append((fragment, i))
+            # Bring up the bodies
+            b = fragment.body(i)
+            if b != lastBody:
+                bodyCount += 1
+                lastBody = b
+            self._bodies.append(bodyCount)
+            self._blockMass += fragment.mass(i)
+        return bodyCount, lastBody
+
+    def _atomRows(self):
+        """Return the rows of the coordinate array holding each atom in external indices.
+
+        The radii, symbols and types of the atoms are gathered at the same time. The arrays are shared with
+        the blocks created by newInstance, so they are read-only."""
+        if getattr(self, "_extRows", None) is not None:
+            return self._extRows
+        masked = np.concatenate([f.masked for f in self.fragments]).astype(bool)
+        self._extRows = np.flatnonzero(~masked)
+        assert len(self._extRows) == len(self._dataMap), "Atom rows do not match the dataMap"
+        self._radii = self._gatherAtoms([f._radii for f in self.fragments])
+        self._symbols = self._gatherAtoms([f._symbols for f in self.fragments])
+        self._types = self._gatherAtoms([f._atomTypes for f in self.fragments])
+        for a in (self._extRows, self._radii, self._symbols, self._types):
+            a.flags.writeable = False
+        return self._extRows
+
+    def _gatherAtoms(self, data):
+        """Return the per-atom data of the fragments (including masked atoms) in external indices"""
+        return np.concatenate(data)[self._atomRows()]
+
+    def _blockCoords(self):
+        """Return the contiguous array of all coordinates, building it if the fragments have changed"""
+        if getattr(self, "_coordsArray", None) is not None:
+            return self._coordsArray
+        sizes = [len(fragment._coords) for fragment in self.fragments]
+        self._coordsArray = np.empty((sum(sizes), 3))
+        self._fragmentRows = np.cumsum([0] + sizes[:-1])
+        for fragment, start, size in zip(self.fragments, self._fragmentRows, sizes):
+            fragment.shareCoords(self._coordsArray[start : start + size])
+        self._fragmentMasses = np.array([f.totalMass() for f in self.fragments])
+        return self._coordsArray
+
+    def _bodyState(self):
+        """Return the bodyCount and lastBody used by _appendFragmentData for the end of the block data"""
+        if not self._dataMap:
+            return -1, 0
+        fragment, i = self._dataMap[-1]
+        return self._bodies[-1], fragment.body(i)
+
+    def _fragmentsMoved(self):
+        """Flag that the fragment coordinates have been changed through the block coordinate array"""
+        for fragment in self.fragments:
+            fragment._changed = True
+        return
+
+    def _cap2EndGroup(self, bonds):
+        """Map the cap atoms of the endGroups in bonds to their bonded counterparts so we can look these up when
+        we fix the endGroup indices - we map the fragment, fragmentIndex to the corresponding block index.
+        This is somewhat untidy as we use the internal fragment index here - which really should be hidden
+        """
+        cap2EndGroup = {}
+        for b in bonds:
+            cap2EndGroup[
+                (b.endGroup1.fragment, b.endGroup1.fragmentCapIdx)
+            ] = b.endGroup2.blockEndGroupIdx
+            cap2EndGroup[
+                (b.endGroup2.fragment, b.endGroup2.fragmentCapIdx)
+            ] = b.endGroup1.blockEndGroupIdx
+        return cap2EndGroup
+
+    def _countFragment(self, fragment):
+        """Count the number of each type of fragment in the block (see Analyse)"""
+        t = fragment.fragmentType
+        if t not in self._fragmentTypeDict:
+            self._fragmentTypeDict[t] = 1
+        else:
+            self._fragmentTypeDict[t] += 1
+        return
+
     def writeCml(self, cmlFilename, cell=None):
         atomTypes = []
         coords = []
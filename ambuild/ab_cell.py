@@ -21,6 +21,7 @@ from ambuild import ab_block
 from ambuild import ab_rigidparticle
 from ambuild import ab_bond
 from ambuild import ab_celldata
+from ambuild import ab_celllist
 from ambuild import ab_endgroup
 from ambuild import ab_fragment
 from ambuild import ab_subunit
@@ -31,6 +32,25 @@ from ambuild import xyz_util
 
 BONDTYPESEP = "-"  # Character for separating bonds
 ENDGROUPSEP = ":"  # Character for separating endGroups in bonds
+# Size of the boxes of the grid of block bounding spheres in multiples of the atom boxSize
+BLOCK_INDEX_BOXES = 4
+# The maximum bond length in Angstroms that zipBlocks searches for free endGroups within (plus the bondMargin)
+MAX_BOND_LENGTH = 2.5
+# Blocks with fewer atoms than this skip the bounding sphere check in closeAtoms
+BROAD_PHASE_MIN_ATOMS = 50
+# The number of discarded library blocks of each fragmentType that are kept for reuse by getLibraryBlock
+LIBRARY_POOL_SIZE = 8
+# The operations whose neighbour search backend can be selected with setNeighbourBackend
+NEIGHBOUR_OPERATIONS = ["closeAtoms", "screenPlacements", "bondClash", "zipBlocks"]
+# Layout of the array of close contacts returned by closeAtoms
+CONTACT_DTYPE = np.dtype(
+    [
+        ("idxAtom1", np.int64),
+        ("idxBlock2", np.int64),
+        ("idxAtom2", np.int64),
+        ("distance", np.float64),
+    ]
+)
 
 logger = logging.getLogger(__name__)
 
@@ -86,18 +106,28 @@ class Cell:
         self.bondAngleMargin = math.radians(bondAngleMargin)
         self.targetDensity = 10
         self.targetEndGroups = 100  # number of free endgroups left
-        # Dict mapping box key to a list of tuples defining the atoms in that box
-        self.box1 = {}
-        # Dict mapping key to list of boxes surrounding the keyed box
-        self.box3 = {}
+        # Spatial hash of all the atoms in the cell - created when the box size is known
+        self.cellList = None
+        # Spatial hash of all the free endGroups in the cell - created with the cellList
+        self.endGroupIndex = None
+        # Spatial hash of the bounding spheres of the blocks - created with the cellList
+        self.blockIndex = None
+        # The blocks with free endGroups of each endGroup type
+        self.endGroupRegistry = ab_celllist.EndGroupTypeRegistry()
+        # Table of all the endGroups of the blocks
+        self.endGroupTable = ab_celllist.EndGroupTable()
+        # The neighbour search backend used by each operation (see setNeighbourBackend)
+        self.neighbourBackends = dict.fromkeys(NEIGHBOUR_OPERATIONS, ab_celllist.CELLS)
         # max atom radius - used to calculate box size
         self.boxSize = None
         self.maxAtomRadius = -1
         self.rCut = 5.0
-        # number of boxes in A,B,C axes - used for calculating PBC
+        # number of boxes in A,B,C axes of the legacy box grid (the cellList has its own, see updateCellSize)
         self.numBoxes = [None, None, None]
         self._fragmentLibrary = {}  # fragmentType -> parentFragment
         self._endGroup2LibraryFragment = {}  # endGroup type -> parentFragment
+        self._libraryBlocks = {}  # fragmentType -> prototype block that library blocks are created from
+        self._libraryBlockPool = {}  # fragmentType -> discarded library blocks that can be reused
         self.bondTypes = []
         self._bondTable = {}  # endGroup type -> set of endGroups it can bond to
         # dictionary mapping id of the block to the block - can't use a list and indices
@@ -106,6 +136,8 @@ class Cell:
         self.lastAdded = None  # Tracks the id of the last block added to the cell
         self.newBonds = []  # Tracks recently added bonds
         self.mdEngineCls = None
+        self.mdSession = False  # Whether to keep the MD engine and simulation alive between runs
+        self._mdEngine = None
         self._possibleBonds = []  # Holds possible bond after checkMove is run
         # Logging functions
         self.logfile = None
@@ -145,22 +177,11 @@ class Cell:
         if idxBlock is None:
             idxBlock = block.id
         self.blocks[idxBlock] = block
-
-        # Each atom has its own cell - X atoms remain as Nones
-        block.atomCell = [None] * block.numAtoms()
-
-        # print "nbox ",self.numBoxA,self.numBoxB,self.numBoxC
-        for idxCoord, coord in enumerate(block.iterCoord()):
-            key = self._getBox(coord)
-            block.atomCell[idxCoord] = key
-            try:
-                # Add the atom to the cell
-                self.box1[key].append((idxBlock, idxCoord))
-            except KeyError:
-                # Add the cell to the list and then add the atom
-                self.box1[key] = [(idxBlock, idxCoord)]
-                # Map the cells surrounding this one
-                self.box3[key] = self.haloCells(key)
+        self.cellList.add(idxBlock, block.coords(), radii=block.radii())
+        self.endGroupIndex.add(idxBlock, block)
+        self.blockIndex.add(idxBlock, block)
+        self.endGroupRegistry.add(idxBlock, block.freeEndGroupTypes())
+        self.endGroupTable.add(idxBlock, block)
         self.lastAdded = idxBlock
         return idxBlock
 
@@ -262,11 +283,16 @@ class Cell:
         """
         return xyz_core.angle(c1, c2, c3, dim=self.dim, pbc=self.pbc)
 
-    def attachBlock(self, growEndGroup, staticEndGroup, dihedral=None):
+    def attachBlock(
+        self, growEndGroup, staticEndGroup, dihedral=None, batchRotations=False
+    ):
         """
         Position growBlock so it can bond to blockS, using the given _endGroups
 
         Arguments:
+        batchRotations - generate all the orientations about the bond at once and screen them against the
+                         cell in a single pass, so that only the orientations that could fit are added to the
+                         cell and checked (gives the same result as trying them one at a time)
 
         We take responsibility for adding and removing the growBlock from the cell on
         success or failure
@@ -278,6 +304,13 @@ class Cell:
 
         staticBlock.positionGrowBlock(staticEndGroup, growEndGroup, dihedral=dihedral)
 
+        if batchRotations and not dihedral:
+            blockEndGroup = growBlock.coord(growEndGroup.endGroupIdx())
+            center = staticBlock.coord(staticEndGroup.endGroupIdx())
+            return self._attachBlockRotations(
+                growBlock, center - blockEndGroup, center, math.pi / 9
+            )
+
         # Now add growBlock to the cell so we can check for clashes
         blockId = self.addBlock(growBlock)
         # logger.debug("GOT {0} {1}".format(staticEndGroup, growEndGroup))
@@ -322,6 +355,55 @@ class Cell:
         self.delBlock(blockId)
         return False
 
+    def _attachBlockRotations(self, growBlock, axis, center, step):
+        """Try growBlock in its current orientation and rotated about axis in increments of step.
+
+        The rotations are applied cumulatively in the same way as attachBlock, but the coordinates of all the
+        orientations are generated as a single (nRot, nAtoms, 3) array and screened together, so that only
+        the orientations that could fit are added to the cell. The first one that bonds is kept.
+        """
+        angles, candidates = self._rotationCandidates(growBlock, axis, center, step)
+        possible = self._screenPlacements(growBlock, candidates)
+        logger.debug(
+            "attachBlock screened {0} of {1} orientations".format(
+                np.count_nonzero(possible), len(angles)
+            )
+        )
+        return self._tryRotations(growBlock, axis, center, angles, possible)
+
+    def _rotationCandidates(self, growBlock, axis, center, step):
+        """Return the angles and an (nRot, nAtoms, 3) array of the orientations _attachBlockRotations tries.
+
+        If step is None only the current orientation is returned.
+        """
+        angles = [0.0]
+        if step is not None:
+            angles += list(ab_util.frange(step, math.pi * 2, step))
+        candidates = np.empty((len(angles), growBlock.numAtoms(), 3))
+        candidates[0] = growBlock.coords()
+        for i in range(1, len(angles)):
+            rotationMatrix = xyz_core.rotation_matrix(axis, angles[i])
+            candidates[i] = np.dot(candidates[i - 1] - center, rotationMatrix.T) + center
+        return angles, candidates
+
+    def _tryRotations(self, growBlock, axis, center, angles, possible):
+        """Add growBlock to the cell in each possible orientation from _rotationCandidates in turn.
+
+        Returns True once an orientation passes checkMove and bonds, leaving the block in the cell.
+        """
+        current = 0
+        for i in np.flatnonzero(possible):
+            # Bring the block to this orientation
+            for angle in angles[current + 1 : i + 1]:
+                growBlock.rotate(axis, angle, center=center)
+            current = i
+            blockId = self.addBlock(growBlock)
+            if self.checkMove(blockId) and self.processBonds() > 0:
+                logger.debug("attachBlock rotation {0} worked".format(i))
+                return True
+            self.delBlock(blockId)
+        return False
+
     def bondAllowed(self, endGroup1, endGroup2):
         """Check if the given bond is permitted from the types of the two fragments
         """
@@ -347,7 +429,7 @@ class Cell:
         logger.debug("cell bondBlock: {0}".format(bond))
         # logger.debug("before bond: {0} - {1}".format( bond.idxBlock1, bond.block1._bondObjects) )
         selfBond = True  # HACK
-        # We need to remove the block even if we are bonding to self as we need to recalculate the atomCell list
+        # We need to remove the block even if we are bonding to self as we need to rebin its atoms in the cellList
         if bond.isInternalBond() and not selfBond:
             logger.info("bondBlock skipped self-bonded Block")
             return False
@@ -363,69 +445,87 @@ class Cell:
     def bondClash(self, bond, clashDist):
         """Check if any atoms are clashDist from bond.
         """
-        if clashDist > self.boxSize:
-            raise RuntimeError(
-                "clashDist needs to be less than the boxSize: {0}".format(self.boxSize)
-            )
-        # Create bond coordinates method
-        idxAtom1 = bond.endGroup1.endGroupIdx()
-        idxCap1 = bond.endGroup1.capIdx()
-        idxAtom2 = bond.endGroup2.endGroupIdx()
-        idxCap2 = bond.endGroup2.capIdx()
-        p1 = bond.endGroup1.block().coord(idxAtom1)
-        p2 = bond.endGroup2.block().coord(idxAtom2)
-        idxBlock1 = bond.endGroup1.block().id
-        idxBlock2 = bond.endGroup2.block().id
-
-        # Get a list of the cells the bond passes through (excluding endpoints)
-        cells = self._intersectedCells(p1, p2)
-        # Now build up a list of the cells surrounding the cells on the bond vector
-        allcells = set(cells)
-        for cell in cells:
-            try:
-                surround = self.box3[cell]
-            except KeyError:
-                continue
-            allcells.update(surround)
+        return bool(self.bondClashes([bond], clashDist)[0])
 
-        # loop through all the atoms in the cells
-        # & check if any are too close to the bond vector
-        for cell in list(allcells):
-            try:
-                atomList = self.box1[cell]
-            except KeyError:
-                continue
-            for (idxBlock3, idxAtom3) in atomList:
-                # Dont' check the bond atoms or the cap atoms
-                if (
-                    idxBlock3 == idxBlock1
-                    and idxAtom3 == idxAtom1
-                    or idxBlock3 == idxBlock2
-                    and idxAtom3 == idxAtom2
-                    or idxBlock3 == idxBlock1
-                    and idxAtom3 == idxCap1
-                    or idxBlock3 == idxBlock2
-                    and idxAtom3 == idxCap2
-                ):
-                    continue
-                block3 = self.blocks[idxBlock3]
-                if block3.solvent():
-                    continue
-                p3 = block3.coord(idxAtom3)
-                # Distance of a point from a line:
-                #  http://mathworld.wolfram.com/Point-LineDistance3-Dimensional.html
-                # http://stackoverflow.com/questions/849211/shortest-distance-between-a-point-and-a-line-segment
-
-                # First need to find whether the point is inside the segment
-                p3p1 = self.vecDiff(p3, p1)
-                p3p2 = self.vecDiff(p3, p2)
-                p2p1 = self.vecDiff(p2, p1)
-                t = np.dot((p3p1), (p2p1)) / np.square(np.linalg.norm(p2p1))
-                if 0 < t < 1:
-                    dist = np.linalg.norm(np.cross(p3p1, p3p2)) / np.linalg.norm(p2p1)
-                    if dist < clashDist:
-                        return True
-        return False
+    def bondClashes(self, bonds, clashDist, pool=None):
+        """Check if any atoms are within clashDist of each of the bonds.
+
+        Every bond is treated as a capsule of radius clashDist around the segment joining the two endGroup atoms.
+        The atoms that could fall inside any capsule are found by searching around the bond midpoints and
+        the point-to-segment distances for all the bonds are calculated in one pass. Atoms that project onto
+        the bond axis beyond either end of the bond are not counted as clashing. The bonding atoms and their
+        caps, and any solvent atoms, are ignored.
+
+        Args:
+        bonds: a list of ab_bond.Bond objects
+        clashDist: the perpendicular distance from the bond axis within which an atom clashes
+        pool: an optional ab_celllist.CellListPool across which the search around the bonds is split
+
+        Returns:
+        A numpy array of bools that is True for every bond that clashes with an atom
+        """
+        nbonds = len(bonds)
+        clashes = np.zeros(nbonds, dtype=bool)
+        if not nbonds:
+            return clashes
+        idxBlocks1 = np.array([b.endGroup1.block().id for b in bonds], dtype=np.int64)
+        idxBlocks2 = np.array([b.endGroup2.block().id for b in bonds], dtype=np.int64)
+        # The atoms that aren't checked for each bond - the bonding atoms and their caps
+        ignore = np.array(
+            [
+                (
+                    b.endGroup1.endGroupIdx(),
+                    b.endGroup1.capIdx(),
+                    b.endGroup2.endGroupIdx(),
+                    b.endGroup2.capIdx(),
+                )
+                for b in bonds
+            ],
+            dtype=np.int64,
+        )
+        p1 = np.array(
+            [b.endGroup1.block().coord(i) for b, i in zip(bonds, ignore[:, 0])]
+        )
+        p2 = np.array(
+            [b.endGroup2.block().coord(i) for b, i in zip(bonds, ignore[:, 2])]
+        )
+        p2p1 = self.vecDiff(p2, p1).reshape(-1, 3)
+        lengths = np.linalg.norm(p2p1, axis=1)
+
+        # Any atom in a capsule is within half the bond length plus clashDist of the bond midpoint
+        cl = self.cellList
+        midpoints = p1 + p2p1 / 2.0
+        cutoffs = lengths / 2.0 + clashDist
+        backend = self.neighbourBackends["bondClash"]
+        if pool is None:
+            idxBonds, slots, _ = cl.within(midpoints, cutoffs, backend=backend)
+        else:
+            idxBonds, slots, _ = pool.within(cl, midpoints, cutoffs, backend=backend)
+
+        keys = cl.blockKeys(slots)
+        atoms = cl.atomIdx[slots]
+        mask = ~(
+            ((keys == idxBlocks1[idxBonds]) & (atoms == ignore[idxBonds, 0]))
+            | ((keys == idxBlocks1[idxBonds]) & (atoms == ignore[idxBonds, 1]))
+            | ((keys == idxBlocks2[idxBonds]) & (atoms == ignore[idxBonds, 2]))
+            | ((keys == idxBlocks2[idxBonds]) & (atoms == ignore[idxBonds, 3]))
+        )
+        solvent = [k for k, b in self.blocks.items() if b.solvent()]
+        if solvent:
+            mask &= ~np.isin(keys, solvent)
+        idxBonds, slots = idxBonds[mask], slots[mask]
+
+        # Distance of a point from a line segment:
+        # http://mathworld.wolfram.com/Point-LineDistance3-Dimensional.html
+        p3p1 = self.vecDiff(cl.coords[slots], p1[idxBonds]).reshape(-1, 3)
+        p2p1 = p2p1[idxBonds]
+        lsq = np.square(lengths[idxBonds])
+        t = np.einsum("ij,ij->i", p3p1, p2p1) / lsq
+        inside = (t > 0) & (t < 1)
+        cross = np.cross(p3p1[inside], p2p1[inside])
+        dist = np.linalg.norm(cross, axis=1) / np.sqrt(lsq[inside])
+        clashes[idxBonds[inside][dist < clashDist]] = True
+        return clashes
 
     def _cat1Paf2(self, bond, fragmentTypes):
         """A CAT bonded to two PAF goups"""
@@ -721,87 +821,220 @@ class Cell:
         bondMargin,
         bondAngleMargin,
     ):
-        # The check should have been made before this is called on whether the two atoms are endGroup
-        # Check length
-        bond_length = xyz_util.bondLength(
-            addBlock.symbol(idxAddAtom), staticBlock.symbol(idxStaticAtom)
+        """See if the two endGroup atoms can bond and add the bond to self._possibleBonds if they can.
+
+        The check should have been made before this is called on whether the two atoms are endGroups.
+        """
+        return bool(
+            self._screenBonds(
+                [staticBlock],
+                [idxStaticAtom],
+                [addBlock],
+                [idxAddAtom],
+                [distance],
+                bondMargin,
+                bondAngleMargin,
+            )[0]
+        )
+
+    def _screenBonds(
+        self,
+        staticBlocks,
+        idxStaticAtoms,
+        addBlocks,
+        idxAddAtoms,
+        distances,
+        bondMargin,
+        bondAngleMargin,
+        match=False,
+    ):
+        """Run canBond over arrays of candidate pairs of endGroup atoms.
+
+        The bond lengths are looked up once for each pair of symbols and the distances and angles of all
+        the candidates are screened with screenBondGeometry, so only the candidates with an acceptable
+        geometry are checked against the bonding rules. Any bonds are added to self._possibleBonds in the
+        order canBond would have added them, or with match the set of bonds is chosen by _matchBonds.
+
+        Args:
+        staticBlocks, addBlocks: lists of the blocks of the two atoms of each pair
+        idxStaticAtoms, idxAddAtoms: arrays of the indices of the two atoms in their blocks
+        distances: array of the distances between the two atoms
+        bondMargin, bondAngleMargin: see canBond
+        match: choose the bonds with the best geometry that keep within the maxBond limits
+
+        Returns:
+        A boolean array that is True for the pairs that can bond
+        """
+        canBond = np.zeros(len(distances), dtype=bool)
+        if not len(distances):
+            return canBond
+        idxStaticAtoms = np.asarray(idxStaticAtoms).tolist()
+        idxAddAtoms = np.asarray(idxAddAtoms).tolist()
+        # Bond length table for each pair of symbols
+        staticSymbols = np.array(
+            [b.symbol(i) for b, i in zip(staticBlocks, idxStaticAtoms)]
         )
-        if bond_length < 0:
-            raise RuntimeError(
-                "Missing bond distance for: {0}-{1}".format(
-                    addBlock.symbol(idxAddAtom), staticBlock.symbol(idxStaticAtom)
+        addSymbols = np.array([b.symbol(i) for b, i in zip(addBlocks, idxAddAtoms)])
+        symbols, inverse = np.unique(
+            np.concatenate((addSymbols, staticSymbols)), return_inverse=True
+        )
+        codes = inverse[: len(addSymbols)] * len(symbols) + inverse[len(addSymbols) :]
+        uniqueCodes, codeInverse = np.unique(codes, return_inverse=True)
+        uniqueLengths = np.empty(len(uniqueCodes))
+        for i, code in enumerate(uniqueCodes):
+            addSymbol = symbols[code // len(symbols)]
+            staticSymbol = symbols[code % len(symbols)]
+            uniqueLengths[i] = xyz_util.bondLength(addSymbol, staticSymbol)
+            if uniqueLengths[i] < 0:
+                raise RuntimeError(
+                    "Missing bond distance for: {0}-{1}".format(addSymbol, staticSymbol)
                 )
-            )
-        # See if the distance between them is acceptable
-        # print "CHECKING BOND ATOMS ",bond_length,self.distance( addCoord, staticCoord )
-        if not (
-            max(0.1, bond_length - bondMargin) < distance < bond_length + bondMargin
-        ):
-            logger.debug("Cannot bond due to distance: {0}".format(distance))
-            return False
-        # Now loop over all endGroups seeing if any of the angles are satisfied
-        for staticEndGroup in staticBlock.atomEndGroups(idxStaticAtom):
-            for addEndGroup in addBlock.atomEndGroups(idxAddAtom):
-                # EndGroups in the same fragment can never bond
-                if staticEndGroup.fragment == addEndGroup.fragment:
-                    break
-                assert staticEndGroup.free() and addEndGroup.free()
-                # We need to check that we've not already added these endGroups as possible bonds
-                if self._endGroupsInPossibleBonds([staticEndGroup, addEndGroup]):
-                    continue
-                if not self.bondAllowed(staticEndGroup, addEndGroup):
-                    logger.debug(
-                        "Bond disallowed by bonding rules: {0} : {1}".format(
-                            staticEndGroup, addEndGroup
-                        )
-                    )
-                    continue
-                # print "Possible bond for {0} {1} {2} dist {3}".format( idxAddAtom,
-                #                                                       idxStaticBlock,
-                #                                                       idxStaticAtom,
-                #                                                       self.distance( addCoord, staticCoord ) )
-                addCoord = addBlock.coord(idxAddAtom)
-                staticCoord = staticBlock.coord(idxStaticAtom)
-                addCapAtom = addBlock.coord(addEndGroup.capIdx())
-                angle1 = self.angle(addCapAtom, addCoord, staticCoord)
-                staticCapAtom = staticBlock.coord(staticEndGroup.capIdx())
-                angle2 = self.angle(staticCapAtom, staticCoord, addCoord)
-
-                # print "CHECKING ANGLE BETWEEN: {0} | {1} | {2}".format( angleAtom, addCoord, staticCoord )
-                # print "{} < {} < {}".format( (self.bondAngle-bondAngleMargin) * util.RADIANS2DEGREES,
-                #                             angle * util.RADIANS2DEGREES,
-                #                             (self.bondAngle+bondAngleMargin) * util.RADIANS2DEGREES  )
-
-                # Check if atoms are in line (zero degrees) within margin
-                if not (
-                    (
-                        0.0 - bondAngleMargin < angle1 < 0.0 + bondAngleMargin
-                        and 0.0 - bondAngleMargin < angle2 < 0.0 + bondAngleMargin
-                    )
-                ):
-                    logger.debug(
-                        "Cannot bond due to angles: {0} : {1}".format(
-                            math.degrees(angle1), math.degrees(angle2)
-                        )
-                    )
-                    continue
+        bondLengths = uniqueLengths[codeInverse.reshape(-1)]
+        distances = np.asarray(distances)
+        inRange = (np.maximum(0.1, bondLengths - bondMargin) < distances) & (
+            distances < bondLengths + bondMargin
+        )
+        # Expand the pairs of atoms to all the pairs of their endGroups
+        candidates = []  # (idxPair, staticEndGroup, addEndGroup)
+        for idxPair in np.flatnonzero(inRange).tolist():
+            staticBlock, idxStaticAtom = staticBlocks[idxPair], idxStaticAtoms[idxPair]
+            addBlock, idxAddAtom = addBlocks[idxPair], idxAddAtoms[idxPair]
+            for staticEndGroup in staticBlock.atomEndGroups(idxStaticAtom):
+                for addEndGroup in addBlock.atomEndGroups(idxAddAtom):
+                    # EndGroups in the same fragment can never bond
+                    if staticEndGroup.fragment == addEndGroup.fragment:
+                        break
+                    candidates.append((idxPair, staticEndGroup, addEndGroup))
+        if not candidates:
+            return canBond
+        staticCoords = np.array(
+            [staticBlocks[i].coord(idxStaticAtoms[i]) for i, _, _ in candidates]
+        )
+        staticCaps = np.array(
+            [staticBlocks[i].coord(s.capIdx()) for i, s, _ in candidates]
+        )
+        addCoords = np.array(
+            [addBlocks[i].coord(idxAddAtoms[i]) for i, _, _ in candidates]
+        )
+        addCaps = np.array([addBlocks[i].coord(a.capIdx()) for i, _, a in candidates])
+        geometryOk, scores = bondGeometry(
+            staticCoords,
+            staticCaps,
+            addCoords,
+            addCaps,
+            bondLengths[[i for i, _, _ in candidates]],
+            bondMargin,
+            bondAngleMargin,
+            self.dim,
+            self.pbc,
+        )
+        # Now apply the rules to the survivors
+        allowed = []
+        for j in np.flatnonzero(geometryOk).tolist():
+            _, staticEndGroup, addEndGroup = candidates[j]
+            assert staticEndGroup.free() and addEndGroup.free()
+            if self.bondAllowed(staticEndGroup, addEndGroup):
+                allowed.append(j)
+            else:
                 logger.debug(
-                    "Acceptable bond with angles: {0} : {1} | distance {2}".format(
-                        math.degrees(angle1), math.degrees(angle2), distance
+                    "Bond disallowed by bonding rules: {0} : {1}".format(
+                        staticEndGroup, addEndGroup
                     )
                 )
-                # Create bond object and set the parameters
-                bond = ab_bond.Bond(staticEndGroup, addEndGroup)
-                self._possibleBonds.append(bond)
-                logger.debug(
-                    "canBond returning True with bonds: {0}".format(
-                        [str(b) for b in self._possibleBonds]
+        if match:
+            chosen = self._matchBonds([candidates[j] for j in allowed], scores[allowed])
+            allowed = [allowed[i] for i in chosen]
+        # Take the first acceptable bond for each pair of atoms
+        taken = set()
+        for b in self._possibleBonds:
+            taken.update([b.endGroup1, b.endGroup2])
+        for j in allowed:
+            idxPair, staticEndGroup, addEndGroup = candidates[j]
+            if canBond[idxPair]:
+                continue
+            # We need to check that we've not already added these endGroups as possible bonds
+            if staticEndGroup in taken or addEndGroup in taken:
+                continue
+            self._possibleBonds.append(ab_bond.Bond(staticEndGroup, addEndGroup))
+            taken.update([staticEndGroup, addEndGroup])
+            canBond[idxPair] = True
+        return canBond
+
+    def _matchBonds(self, candidates, scores):
+        """Pick a conflict-free set of bonds from the candidates, taking the best scoring first.
+
+        The candidates are the edges of a graph between the free endGroups, weighted by how far each bond
+        is from the ideal geometry. A bond is skipped if either endGroup, or the pair of atoms, is already
+        in a chosen bond, or if it would take a fragment past the setMaxBond limit for its endGroup type.
+        As the limits are counted as the bonds are chosen, processBonds doesn't then have to throw away
+        bonds that were blocked by an earlier one.
+
+        Args:
+        candidates: list of (idxPair, staticEndGroup, addEndGroup) tuples
+        scores: array of the score of each candidate (lower is better)
+
+        Returns:
+        A list of the indices of the chosen candidates, best first
+        """
+        chosen = []
+        taken = set()
+        pairs = set()
+        available = {}  # (fragment, endGroupType) -> bonds left, or None if unlimited
+        for j in np.argsort(scores, kind="mergesort").tolist():
+            idxPair, staticEndGroup, addEndGroup = candidates[j]
+            if idxPair in pairs or staticEndGroup in taken or addEndGroup in taken:
+                continue
+            limits = [(eg.fragment, eg.type()) for eg in (staticEndGroup, addEndGroup)]
+            for fragment, endGroupType in limits:
+                if (fragment, endGroupType) not in available:
+                    available[(fragment, endGroupType)] = fragment.bondsAvailable(
+                        endGroupType
                     )
-                )
-                return True
+            if any(available[k] is not None and available[k] < 1 for k in limits):
+                continue
+            for k in limits:
+                if available[k] is not None:
+                    available[k] -= 1
+            chosen.append(j)
+            taken.update([staticEndGroup, addEndGroup])
+            pairs.add(idxPair)
+        return chosen
+
+    def screenBondGeometry(
+        self,
+        staticCoords,
+        staticCaps,
+        addCoords,
+        addCaps,
+        bondLengths,
+        bondMargin,
+        bondAngleMargin,
+    ):
+        """Return a boolean mask of the candidate bonds that have an acceptable length and angles.
 
-        logger.debug("canBond returning False")
-        return False
+        This applies the geometric tests of canBond to all the candidates in one pass.
+
+        Args:
+        staticCoords, addCoords: (n, 3) arrays of the coordinates of the two endGroup atoms
+        staticCaps, addCaps: (n, 3) arrays of the coordinates of the cap atoms of the two endGroups
+        bondLengths: (n,) array of the ideal length of each bond
+        bondMargin: the tolerance on the bond length
+        bondAngleMargin: the tolerance [radians] on the angles between each cap, its endGroup and the other endGroup
+
+        Returns:
+        An (n,) boolean array
+        """
+        return bondGeometry(
+            staticCoords,
+            staticCaps,
+            addCoords,
+            addCaps,
+            bondLengths,
+            bondMargin,
+            bondAngleMargin,
+            self.dim,
+            self.pbc,
+        )[0]
 
     def capBlocks(self, fragmentType=None, filename=None):
         # Create the cap block
@@ -855,50 +1088,53 @@ class Cell:
         """
         close, wallClashes = self.closeAtoms(
             idxAddBlock, walls=self.walls
-        )  # Get a list of the close atoms
+        )  # Get an array of the close atoms
         if wallClashes:
             logger.debug("_checkMove got clash with wall")
             return 1
-        if len(close) is 0:
+        if len(close) == 0:
             logger.debug("_checkMove no close contacts")
             return 0
         addBlock = self.blocks[idxAddBlock]
-        clashAtoms = []
         self._possibleBonds = []
-        for (idxAddAtom, staticBlock, idxStaticAtom, distance) in close:
-            #             logger.debug("CHECKING  ATOMS {}:{} {} -> {}:{} {}= {}".format( idxAddBlock,
-            #                                                               idxAddAtom,
-            #                                                               addBlock.symbol(idxAddAtom),
-            #                                                               staticBlock.id,
-            #                                                               idxStaticAtom,
-            #                                                               staticBlock.symbol( idxStaticAtom ),
-            #                                                               distance ))
-            if not (
-                addBlock.isEndGroup(idxAddAtom)
-                and staticBlock.isEndGroup(idxStaticAtom)
-                and self.canBond(
-                    staticBlock,
-                    idxStaticAtom,
-                    addBlock,
-                    idxAddAtom,
-                    distance,
-                    self.bondMargin,
-                    self.bondAngleMargin,
-                )
-            ):
-                # No bond so just check if the two atoms are close enough for a clash
-                d = (
-                    addBlock.radius(idxAddAtom)
-                    + staticBlock.radius(idxStaticAtom)
-                    + self.atomMargin
-                )
-                if distance <= d:
-                    # logger.debug("CLASH {}{}->{}{} = {} > {}".format( addBlock.type(idxAddAtom), addBlock.coord(idxAddAtom),\
-                    #                                           staticBlock.type(idxStaticAtom), staticBlock.coord(idxStaticAtom), \
-                    #                                       d, distance  ))
-                    clashAtoms.append(
-                        (staticBlock, idxStaticAtom, addBlock, idxAddAtom)
-                    )
+        idxAddAtoms = close["idxAtom1"]
+        idxStaticBlocks = close["idxBlock2"]
+        idxStaticAtoms = close["idxAtom2"]
+        distances = close["distance"]
+
+        # Look up the properties of the static atoms a block at a time
+        staticRadii = np.empty(len(close))
+        staticEndGroup = np.empty(len(close), dtype=bool)
+        for idxStaticBlock in np.unique(idxStaticBlocks):
+            mask = idxStaticBlocks == idxStaticBlock
+            staticBlock = self.blocks[idxStaticBlock]
+            staticRadii[mask] = staticBlock.radii()[idxStaticAtoms[mask]]
+            staticEndGroup[mask] = staticBlock.isEndGroupArray(idxStaticAtoms[mask])
+        clashing = distances <= (
+            addBlock.radii()[idxAddAtoms] + staticRadii + self.atomMargin
+        )
+
+        # Only pairs of endGroups can bond - those that do can't clash
+        bonding = addBlock.isEndGroupArray(idxAddAtoms) & staticEndGroup
+        candidates = np.flatnonzero(bonding)
+        bonding[candidates] = self._screenBonds(
+            [self.blocks[i] for i in idxStaticBlocks[candidates].tolist()],
+            idxStaticAtoms[candidates],
+            [addBlock] * len(candidates),
+            idxAddAtoms[candidates],
+            distances[candidates],
+            self.bondMargin,
+            self.bondAngleMargin,
+        )
+        clashAtoms = [
+            (
+                self.blocks[idxStaticBlocks[i]],
+                int(idxStaticAtoms[i]),
+                addBlock,
+                int(idxAddAtoms[i]),
+            )
+            for i in np.flatnonzero(clashing & ~bonding)
+        ]
 
         # Now have list of possible bonds and clashes
         # Nothing so return True
@@ -970,8 +1206,19 @@ class Cell:
     def clear(self):
         """Empty the cell of blocks and reset any data structures"""
         # Remove all blocks from their cells
-        self.box1 = {}
-        self.box3 = {}
+        self.cellList = None
+        self.endGroupIndex = None
+        self.blockIndex = None
+        self.endGroupRegistry = ab_celllist.EndGroupTypeRegistry()
+        self.endGroupTable = ab_celllist.EndGroupTable()
+        if self.boxSize is not None and self.boxSize > 0:
+            self.cellList = ab_celllist.CellList(self.boxSize, self.dim, self.pbc)
+            self.endGroupIndex = ab_celllist.EndGroupIndex(
+                self.boxSize, self.dim, self.pbc
+            )
+            self.blockIndex = ab_celllist.BlockSphereIndex(
+                self.boxSize * BLOCK_INDEX_BOXES, self.dim, self.pbc
+            )
         self.blocks.clear()  # Delete block list
         return
 
@@ -979,84 +1226,74 @@ class Cell:
         """
         Find all atoms that are close to the atoms in the given block.
 
-        This version is optimised to use numpy to do the PBC distance calculations, so builds up a vector of points and then
-        calculates the distances in one go with the distanceV function
+        The bounding sphere of the block is first checked against the walls and, for large blocks, the bounding
+        spheres of the other blocks, so a block that is clear of everything needs no per-atom work. The close atoms
+        are then found with the neighbourBackends["closeAtoms"] search of the cellList, so no per-contact python
+        objects are created.
 
         Args:
         idxBlock1: index of the block in self.blocks
 
         Returns:
         A tuple with:
-        * a list of tuples: (thisAtomIndex, otherBlockIndex, otherAtomIndex, distance) or None if there we no close contacts
-          or a clash with the wall
+        * a CONTACT_DTYPE array with fields (idxAtom1, idxBlock2, idxAtom2, distance) or None if there is a
+          clash with the wall
         * True/False if there is a clash with the wall
         """
-        # Build up list of the coordinates and an initial contacts array
-        c1 = []
-        c2 = []
-        allContacts = []
-        count = 0
         block1 = self.blocks[idxBlock1]
-        wallCheck = False if walls is None else any(walls)
-        for idxAtom1, coord1 in enumerate(block1.iterCoord()):
-
-            # First check if the atom is close to a wall
-            if wallCheck:
-                radius = block1.radius(idxAtom1) + self.wallRadius + self.atomMargin
-                if (
-                    walls[0]
-                    and (coord1[0] < radius or coord1[0] > self.dim[0] - radius)
-                    or walls[1]
-                    and (coord1[1] < radius or coord1[1] > self.dim[1] - radius)
-                    or walls[2]
-                    and (coord1[2] < radius or coord1[2] > self.dim[2] - radius)
+        coords = block1.coords()
+        centroid = block1.centroid()
+        radius = block1.blockRadius()
+        if walls is not None and any(walls):
+            # First check if any atom is close to a wall
+            wallMargin = self.wallRadius + self.atomMargin
+            radii = None
+            for axis, wall in enumerate(walls):
+                if not wall:
+                    continue
+                # The centroid lies within the atoms, so if it is too close to a wall an atom must be too
+                c = centroid[axis]
+                if c < wallMargin or c > self.dim[axis] - wallMargin:
+                    return None, True
+                # If the bounding sphere is clear of the wall so are all the atoms
+                if c - radius >= wallMargin and c + radius <= self.dim[axis] - wallMargin:
+                    continue
+                if radii is None:
+                    radii = block1.radii() + wallMargin
+                if np.any(
+                    (coords[:, axis] < radii) | (coords[:, axis] > self.dim[axis] - radii)
                 ):
                     # Got a clash with a wall, so we can stop all other checks
                     return None, True
 
-            # Get the box this atom is in
-            key = block1.atomCell[idxAtom1]
-            # Skip checking dummy atoms
-            if key is None:
-                continue
-            # For each box loop through all its atoms chekcking for clashes
-            surrounding = self.box3[key]
-            for sbox in surrounding:
-                # For each box, get the list of the atoms as (block,coord1) tuples
-                # Check if we have a box with anything in it
-                try:
-                    alist = self.box1[sbox]
-                except KeyError:
-                    continue
-                for (idxBlock2, idxAtom2) in alist:
-                    # Check we are not checking ourself - need to check block index too!
-                    if idxBlock1 == idxBlock2:
-                        continue
-                    block2 = self.blocks[idxBlock2]
-                    c1.append(coord1)
-                    c2.append(block2.coord(idxAtom2))
-                    allContacts.append((idxAtom1, block2, idxAtom2))
-                    count += 1
-        # Have list so now calculate distances
-        if count == 0:
-            return [], False
-        # Calculate array of distances for all coordinates
-        distances = self.distance(np.array(c1), np.array(c2))
-        # prune contacts array according to distances
-        return (
-            [
-                (c[0], c[1], c[2], distances[i])
-                for i, c in enumerate(allContacts)
-                if distances[i] < self.boxSize
-            ],
-            False,
+        # Only search for the atoms if the block could be within boxSize of another block. Checking the bounding
+        # spheres costs about as much as searching for a few tens of atoms so is skipped for small blocks.
+        if len(coords) >= BROAD_PHASE_MIN_ATOMS and not self._nearBlocks(
+            [centroid], [radius], self.boxSize, exclude=idxBlock1
+        )[0]:
+            return np.empty(0, dtype=CONTACT_DTYPE), False
+        idxAtoms1, slots, distances = self.cellList.within(
+            coords,
+            self.boxSize,
+            exclude=idxBlock1,
+            backend=self.neighbourBackends["closeAtoms"],
         )
+        # prune contacts array according to distances
+        close = distances < self.boxSize
+        slots = slots[close]
+        contacts = np.empty(len(slots), dtype=CONTACT_DTYPE)
+        contacts["idxAtom1"] = idxAtoms1[close]
+        contacts["idxBlock2"] = self.cellList.blockKeys(slots)
+        contacts["idxAtom2"] = self.cellList.atomIdx[slots]
+        contacts["distance"] = distances[close]
+        return contacts, False
 
     def cellEndGroupPair(self, cellEndGroups=None):
         """Return two free endGroups from two different blocks in the cell"""
         # Get a list of available free endGroups in the cell
-        endGroupTypes2Block = self.endGroupTypes2Block()
-        if len(endGroupTypes2Block.keys()) == 0:
+        registry = self.endGroupRegistry
+        allTypes = registry.types()
+        if len(allTypes) == 0:
             logger.critical(
                 "cellEndGroupPair: No available endGroups for: {0}".format(
                     cellEndGroups
@@ -1065,39 +1302,27 @@ class Cell:
             return None, None
         # If the user supplied a list of cellEndGroups we use this to determine what can bond -
         # other wise we use all available endGroups
-        allTypes = endGroupTypes2Block.keys()  # just for informing the user
         if cellEndGroups is not None:
             if isinstance(cellEndGroups, str):
                 cellEndGroups = [cellEndGroups]
-            cellEndGroups = set(cellEndGroups)
+            cellEndGroups = set(cellEndGroups).intersection(allTypes)
         else:
-            cellEndGroups = set(endGroupTypes2Block.keys())
+            cellEndGroups = set(allTypes)
         # We create a dictionary mapping which cell endGroups can bond to which
         # This is basically a truncated _bondTable with any endGroups removed that aren't present
-        cell2cell = copy.copy(self._bondTable)
-        for eg in self._bondTable:
-            if eg not in cellEndGroups:
-                # First remove all references in the keys
-                del cell2cell[eg]
-            else:
-                # The key is valid so remove any missing endGroups from the values
-                ceg = cellEndGroups.intersection(cell2cell[eg])
-                # Need to check there are some other types that this can bond to, but also there is at least
-                # one other block if both are of the same type
-                # NB the strange next/iter thing is the only way to get an item from the set
-                if len(ceg) == 0 or (
-                    len(ceg) == 1
-                    and eg == next(iter(ceg))
-                    and len(endGroupTypes2Block[eg]) < 2
-                ):
-                    # No valid blocks that could bond with this endGroup so delete the entire key
-                    del cell2cell[eg]
-                else:
-                    cell2cell[eg] = ceg
+        cell2cell = collections.OrderedDict()
+        for eg in allTypes:
+            if eg not in cellEndGroups or eg not in self._bondTable:
+                continue
+            ceg = cellEndGroups.intersection(self._bondTable[eg])
+            # Need to check there are some other types that this can bond to, but also there is at least
+            # one other block if both are of the same type
+            if ceg and not (ceg == set([eg]) and registry.count(eg) < 2):
+                cell2cell[eg] = sorted(ceg)
         if len(cell2cell.keys()) == 0:
             logger.critical(
-                "cellEndGroupPair: No endGroups of types {0} are available to bond from {1}".format(
-                    cellEndGroups, allTypes
+                "cellEndGroupPair: No endGroups of types {0} are available to bond from the free endGroups: {1}".format(
+                    cellEndGroups, dict(self.freeEndGroupCounts())
                 )
             )
             return None, None
@@ -1108,28 +1333,20 @@ class Cell:
         )
         # Select a random block/endGroup from the list
         eg1Type = _random.choice(list(cell2cell.keys()))
-        block1 = _random.choice(list(endGroupTypes2Block[eg1Type]))
-        endGroup1 = block1.selectEndGroup(endGroupTypes=[eg1Type])
+        idxBlock1 = registry.sample(eg1Type)
+        endGroup1 = self.blocks[idxBlock1].selectEndGroup(endGroupTypes=[eg1Type])
         # Pick a random endGroup type that can bond to this
-        eg2Type = _random.sample(cell2cell[eg1Type], 1)[0]
-        # Select a random block/endGroup of that type
-        # (REM: need to remove the first block from the list of possibles hence the difference thing
-        # XXX Also need to convert to list as sets don't support random.choice
-        # Using choice and list as sample was giving error "ValueError: sample larger than population"
-        # block2 = random.sample( endGroupTypes2Block[ eg2Type ].difference(set([block1])), 1 )[0]
-        try:
-            block2 = _random.choice(
-                list(endGroupTypes2Block[eg2Type].difference(set([block1])))
-            )
-            # This will trigger an IndexError if there isn't a free block of the given type
-        except IndexError:
+        eg2Type = _random.choice(cell2cell[eg1Type])
+        # Select a random block/endGroup of that type that isn't the first block
+        idxBlock2 = registry.sample(eg2Type, exclude=idxBlock1)
+        if idxBlock2 is None:
             logger.critical(
-                "cellEndGroupPair: No 2nd block available for cellEndGroups".format(
+                "cellEndGroupPair: No 2nd block available for cellEndGroups: {0}".format(
                     cellEndGroups
                 )
             )
             return None, None
-        endGroup2 = block2.selectEndGroup(endGroupTypes=[eg2Type])
+        endGroup2 = self.blocks[idxBlock2].selectEndGroup(endGroupTypes=[eg2Type])
 
         logger.debug(
             "cellEndGroupPair returning: {0} {1}".format(
@@ -1163,147 +1380,121 @@ class Cell:
             assert (
                 fragmentType in self.fragmentTypes()
             ), "FragmentType {0} not in cell!".format(fragmentType)
+            coords = []
+            symbols = []
+            bonds = []
             atomIdx = 0
             for b in self.blocks.values():
-                coords, symbols, bonds = b.dataByFragment(fragmentType)
-                d.coords += coords
-                d.symbols += symbols
-                d.bonds += [(b1 + atomIdx, b2 + atomIdx) for (b1, b2) in bonds]
-                atomIdx += len(coords)
+                bcoords, bsymbols, bbonds = b.dataByFragment(fragmentType)
+                coords += bcoords
+                symbols += bsymbols
+                bonds += [(b1 + atomIdx, b2 + atomIdx) for (b1, b2) in bbonds]
+                atomIdx += len(bcoords)
+            d.natoms = atomIdx
+            d.coords = np.array(coords, dtype=np.float64).reshape(-1, 3)
+            d.symbols = np.array(symbols, dtype=str)
+            d.bonds = np.array(bonds, dtype=np.int64).reshape(-1, 2)
             return d
-        atomIdx = 0
-        bodyIdx = 0
-        for block in self.blocks.values():
-            # Do bonds first as counting starts from atomIdx and goes up through the blocks
+        blocks = list(self.blocks.values())
+        if not blocks:
+            return d
+        numAtoms = [block.numAtoms() for block in blocks]
+        d.natoms = sum(numAtoms)
+        d.blockOffsets = np.cumsum([0] + numAtoms)
+        d.setAtomTypes(np.concatenate([block.types() for block in blocks]))
+        # Collect the topology of each block and shift it to the cell atom indices
+        TOPOLOGY = ["bonds", "angles", "propers", "impropers"]
+        topology = dict((k, []) for k in TOPOLOGY)
+        for block, atomIdx in zip(blocks, d.blockOffsets):
             if not rigidBody:
                 # add all bonds, angles and dihederals throughout the whole block
-                d.bonds += [(a1 + atomIdx, a2 + atomIdx) for a1, a2 in block.bonds()]
-                d.bondLabels += [
-                    "{0}-{1}".format(block.type(a1), block.type(a2))
-                    for a1, a2 in block.bonds()
-                ]
-                angles, propers, impropers = block.anglesAndDihedrals()
-                d.angles += [
-                    (a1 + atomIdx, a2 + atomIdx, a3 + atomIdx) for a1, a2, a3 in angles
-                ]
-                d.angleLabels += [
-                    "{0}-{1}-{2}".format(block.type(a1), block.type(a2), block.type(a3))
-                    for a1, a2, a3 in angles
-                ]
-                d.propers += [
-                    (a1 + atomIdx, a2 + atomIdx, a3 + atomIdx, a4 + atomIdx)
-                    for a1, a2, a3, a4 in propers
-                ]
-                d.properLabels += [
-                    "{0}-{1}-{2}-{3}".format(
-                        block.type(a1), block.type(a2), block.type(a3), block.type(a4)
-                    )
-                    for a1, a2, a3, a4 in propers
-                ]
-                d.impropers += [
-                    (a1 + atomIdx, a2 + atomIdx, a3 + atomIdx, a4 + atomIdx)
-                    for a1, a2, a3, a4 in impropers
-                ]
-                d.improperLabels += [
-                    "{0}-{1}-{2}-{3}".format(
-                        block.type(a1), block.type(a2), block.type(a3), block.type(a4)
-                    )
-                    for a1, a2, a3, a4 in impropers
-                ]
+                angles, propers, impropers = block.topology()
+                blockTopology = [block.bonds(), angles, propers, impropers]
             else:
-                # Just add the bonds between blocks. Also add angles for all atoms connected to the bonds
-                # we do this so that we can exclude them from VdW interactions in MD codes
-                for b1, b2 in block.blockBonds():
-                    # The bonds themselves
-                    d.bonds.append((b1 + atomIdx, b2 + atomIdx))
-                    d.bondLabels.append(
-                        "{0}-{1}".format(block.type(b1), block.type(b2))
-                    )
-                    _angles = set()
-                    # Atoms connected to the endGroup that we need to specify as connected so we add as angles
-                    for batom in block.atomBonded1(b1):
-                        # The opposite endGroup is included in the list bonded to an endGroup so skip
-                        if batom == b2:
-                            continue
-                        _angles.add((batom, b1, b2))
-                    for batom in block.atomBonded1(b2):
-                        # The opposite endGroup is included in the list bonded to an endGroup so skip
-                        if batom == b1:
-                            continue
-                        _angles.add((b1, b2, batom))
-                    # Add to overall lists
-                    for a1, a2, a3 in _angles:
-                        d.angles.append((a1 + atomIdx, a2 + atomIdx, a3 + atomIdx))
-                        l = "{0}-{1}-{2}".format(
-                            block.type(a1), block.type(a2), block.type(a3)
-                        )
-                        d.angleLabels.append(l)
-                    # Dihedrals
-                    for dindices in block.dihedrals(b1, b2):
-                        dihedral = (
-                            dindices[0] + atomIdx,
-                            dindices[1] + atomIdx,
-                            dindices[2] + atomIdx,
-                            dindices[3] + atomIdx,
-                        )
-                        d.propers.append(dihedral)
-                        dlabel = "{0}-{1}-{2}-{3}".format(
-                            block.type(dindices[0]),
-                            block.type(dindices[1]),
-                            block.type(dindices[2]),
-                            block.type(dindices[3]),
-                        )
-                        d.properLabels.append(dlabel)
-            # Now loop through fragments and coordinates
-            for frag in block.fragments:
-                for body in frag.bodies():
-                    d.natoms += body.natoms
-                    atomIdx += body.natoms
-                    if RIGIDPARTICLES:
+                blockTopology = self._blockBondTopology(block)
+            for key, indices in zip(TOPOLOGY, blockTopology):
+                topology[key].append(np.array(indices, dtype=np.int64) + atomIdx)
+        for key, width in zip(TOPOLOGY, [2, 3, 4, 4]):
+            indices = [a.reshape(-1, width) for a in topology[key]]
+            offsets = np.cumsum([0] + [len(a) for a in indices])
+            indices = np.concatenate(indices)
+            typeIds, typeNames = d.topologyTypes(indices)
+            setattr(d, key, indices)
+            setattr(d, key[:-1] + "TypeIds", typeIds)
+            setattr(d, key[:-1] + "TypeNames", typeNames)
+            setattr(d, key[:-1] + "Offsets", offsets)
+        if RIGIDPARTICLES:
+            for block in blocks:
+                for frag in block.fragments:
+                    for body in frag.bodies():
                         d.rigidParticles.append(
                             self.rigidParticleMgr.createParticle(body)
                         )
-                    else:
-                        coords = body.coords
-                        coords, images = xyz_core.wrapCoord3(
-                            coords, dim=self.dim, center=center
-                        )
-                        d.coords += list(coords)
-                        d.images += list(images)
-                        d.atomTypes += body.atomTypes
-                        d.bodies += [bodyIdx] * body.natoms
-                        d.charges += body.charges
-                        d.diameters += body.diameters
-                        d.masked += body.masked
-                        d.masses += list(body.masses)
-                        d.static += body.static
-                        d.symbols += body.symbols
-                bodyIdx += 1
-        if RIGIDPARTICLES:
-            self.rigidParticleMgr.checkConfigStrClashes(d.atomTypes)
+            self.rigidParticleMgr.checkConfigStrClashes(d.atomTypeNames)
             d.rigidParticleMgr = self.rigidParticleMgr
+            return d
+        # Now the per-atom data
+        coords = np.concatenate([block.coords() for block in blocks])
+        if periodic:
+            d.coords, d.images = xyz_core.wrapCoord3(
+                coords, dim=self.dim, center=center
+            )
+        else:
+            d.coords, d.images = coords, np.zeros(coords.shape, dtype=np.int64)
+        fragments = [frag for block in blocks for frag in block.fragments]
+        fragmentAtoms = [frag.numAtoms() for frag in fragments]
+        d.bodies = np.repeat(np.arange(len(fragments)), fragmentAtoms)
+        d.blockBodies = np.concatenate([block.bodies() for block in blocks])
+        d.charges = np.concatenate([block.charges() for block in blocks])
+        d.diameters = np.full(d.natoms, xyz_util.DUMMY_DIAMETER)
+        d.masses = np.concatenate([block.masses() for block in blocks])
+        # Atoms that haven't been bonded or are dummy atoms are ignored
+        d.masked = np.concatenate([block.unBonded() for block in blocks])
+        dummy = np.char.lower(np.array(d.atomTypeNames, dtype=str)) == "x"
+        d.masked |= dummy[d.atomTypeIds]
+        static = [bool(getattr(f, "static", False)) for f in fragments]
+        d.static = np.repeat(static, fragmentAtoms)
+        d.symbols = np.concatenate([block.symbols() for block in blocks])
         return d
 
+    def _blockBondTopology(self, block):
+        """Return the bonds, angles, propers and impropers that are needed for the bonds between the blocks.
+
+        We add angles for all atoms connected to the bonds so that we can exclude them from VdW interactions
+        in MD codes.
+        """
+        bonds = []
+        angles = []
+        propers = []
+        for b1, b2 in block.blockBonds():
+            # The bonds themselves
+            bonds.append((b1, b2))
+            _angles = set()
+            # Atoms connected to the endGroup that we need to specify as connected so we add as angles
+            for batom in block.atomBonded1(b1):
+                # The opposite endGroup is included in the list bonded to an endGroup so skip
+                if batom == b2:
+                    continue
+                _angles.add((batom, b1, b2))
+            for batom in block.atomBonded1(b2):
+                # The opposite endGroup is included in the list bonded to an endGroup so skip
+                if batom == b1:
+                    continue
+                _angles.add((b1, b2, batom))
+            angles += list(_angles)
+            # Dihedrals
+            propers += [tuple(dindices) for dindices in block.dihedrals(b1, b2)]
+        return bonds, angles, propers, []
+
     def delBlock(self, blockId):
         """
         Remove the block with the given index from the cell
         """
-        block = self.blocks[blockId]
-        # Remove each atom from the list
-        keys = []
-        for iatom, key in enumerate(block.atomCell):
-            # Skip dummy atoms
-            if key == None:
-                continue
-            keys.append(key)
-            self.box1[key].remove((blockId, iatom))
-        # Now remove any empty keys and corresponding surrounding boxes
-        # Might think about keeping the surrounding boxes as they could be use by other atoms?
-        # print "now checking keys"
-        for key in keys:
-            if key in self.box1 and len(self.box1[key]) == 0:
-                del self.box1[key]
-                del self.box3[key]
+        self.cellList.remove(blockId)
+        self.endGroupIndex.remove(blockId)
+        self.blockIndex.remove(blockId)
+        self.endGroupRegistry.remove(blockId)
+        self.endGroupTable.remove(blockId)
         del self.blocks[blockId]
         return
 
@@ -1477,27 +1668,16 @@ class Cell:
                     s += "|" + c
         return [str(self._fileCount), s]
 
-    def _endGroupsInPossibleBonds(self, endGroups):
-        """Check if any of the endGroups are already in the list of possible bonds"""
-        eg = set()
-        for b in self._possibleBonds:
-            eg.update([b.endGroup1, b.endGroup2])
-        return bool(eg.intersection(frozenset(endGroups)))
-
     def endGroupTypes2Block(self):
-        """Return a dictionary mapping free endGroup types to a list of the blocks
+        """Return a dictionary mapping free endGroup types to a set of the blocks
 
         We don't check if any are available just return an empty dictionary if not
         """
-        endGroupTypes2Block = {}
-        for block in self.blocks.values():
-            # numFreeEndGroups += block.numFreeEndGroups()
-            # Get a list of the free endGroup types in the block
-            for endGroupType in block.freeEndGroupTypes():
-                if endGroupType not in endGroupTypes2Block:
-                    endGroupTypes2Block[endGroupType] = set()
-                endGroupTypes2Block[endGroupType].add(block)
-        return endGroupTypes2Block
+        registry = self.endGroupRegistry
+        return dict(
+            (endGroupType, set(self.blocks[k] for k in registry.keys(endGroupType)))
+            for endGroupType in registry.types()
+        )
 
     def fragMaxEnergy(
         self,
@@ -1541,11 +1721,18 @@ class Cell:
         return endGroupType.split(self.ENDGROUPSEP)[0]
 
     def _getBox(self, coord):
-        """Return the box that the coord is in under periodic boundaries"""
+        """Return the box that the coord is in under periodic boundaries.
+
+        This is the legacy box grid of numBoxes, not that of the cellList, and is no longer used by the Cell.
+        """
         return xyz_util.getCell(coord, self.boxSize, dim=self.dim, pbc=self.pbc)
 
     def getLibraryBlock(self, fragmentType=None, random=True):
-        """Return an initBlock"""
+        """Return an initBlock
+
+        A block that was discarded with _releaseLibraryBlock is reused if there is one, otherwise the block is
+        created from a prototype block for the fragmentType (see Block.newInstance).
+        """
         if fragmentType is None:
             # Need to determine the fragmentType from the endGroupType
             if random:
@@ -1559,9 +1746,34 @@ class Cell:
             raise RuntimeError(
                 "Asking for a non-existing initBlock type: {0}".format(fragmentType)
             )
-        # Copy the init fragment
-        f = self._fragmentLibrary[fragmentType].copy()
-        return ab_block.Block(initFragment=f)
+        prototype = self._libraryBlocks.get(fragmentType)
+        if prototype is None:
+            # Copy the init fragment
+            f = self._fragmentLibrary[fragmentType].copy()
+            prototype = ab_block.Block(initFragment=f)
+            self._libraryBlocks[fragmentType] = prototype
+        pool = self._libraryBlockPool.get(fragmentType)
+        if pool:
+            block = pool.pop()
+            block.resetInstance(prototype)
+            return block
+        return prototype.newInstance()
+
+    def _releaseLibraryBlock(self, block):
+        """Keep a library block that has been discarded without being bonded so getLibraryBlock can reuse it
+
+        Args:
+        block - a block from getLibraryBlock that is not in the cell and that nothing else refers to
+        """
+        if len(block.fragments) != 1 or block.blockBonds() or block.id in self.blocks:
+            return
+        fragmentType = block.fragments[0].fragmentType
+        if fragmentType not in self._libraryBlocks:
+            return
+        pool = self._libraryBlockPool.setdefault(fragmentType, [])
+        if len(pool) < LIBRARY_POOL_SIZE:
+            pool.append(block)
+        return
 
     def growBlocks(
         self,
@@ -1572,6 +1784,8 @@ class Cell:
         dihedral=None,
         maxTries=50,
         random=True,
+        batchRotations=False,
+        batchSize=None,
     ):
         """
         Add toGrow new blocks to the cell.
@@ -1586,6 +1800,12 @@ class Cell:
                       that list.
         dihedral: the dihedral angle about the bond (3rd column in csv file)
         maxTries: number of attempts to make before giving up
+        batchRotations: screen all the rotations of each new block about its bond in a single pass
+                        (see attachBlock)
+        batchSize: if set, make the attempts speculatively this many at a time. Every orientation of every
+                   attempt in a batch is screened against the cell as it was at the start of the batch, and
+                   the attempts are then tried in turn with checkMove, so each is still checked against the
+                   blocks added earlier in the batch.
         """
         logger.info("Growing {0} new blocks".format(toGrow))
         assert len(self.blocks), "Need to seed blocks before growing!"
@@ -1598,6 +1818,18 @@ class Cell:
 
         if dihedral:
             dihedral = math.radians(dihedral)
+        if batchSize:
+            added = self._growBlocksBatch(
+                toGrow,
+                cellEndGroups,
+                libraryEndGroups,
+                dihedral,
+                maxTries,
+                random,
+                batchSize,
+            )
+            logger.info("After growBlocks numBlocks: {0}".format(len(self.blocks)))
+            return added
         added = 0
         tries = 0
         attemptedPairs = set()
@@ -1625,6 +1857,7 @@ class Cell:
             # See if we've seen this pair before
             if endGroupPair in attemptedPairs:
                 logger.debug("growBlocks got endGroupPair again")
+                self._releaseLibraryBlock(endGroupPair[1].block())
                 tries += 1
                 continue
             else:
@@ -1634,7 +1867,12 @@ class Cell:
             # Apply random rotation in 3 axes to randomise the orientation before we align
             if random:
                 libraryBlock.randomRotate(origin=self.origin)
-            ok = self.attachBlock(libraryEndGroup, cellEndGroup, dihedral=dihedral)
+            ok = self.attachBlock(
+                libraryEndGroup,
+                cellEndGroup,
+                dihedral=dihedral,
+                batchRotations=batchRotations,
+            )
             if ok:
                 added += 1
                 logger.info(
@@ -1643,10 +1881,129 @@ class Cell:
                 self.analyse.stop("grow", d={"num_tries": tries})
                 tries = 0
             else:
+                self._releaseLibraryBlock(libraryBlock)
                 tries += 1
         logger.info("After growBlocks numBlocks: {0}".format(len(self.blocks)))
         return added
 
+    def _growBlocksBatch(
+        self,
+        toGrow,
+        cellEndGroups,
+        libraryEndGroups,
+        dihedral,
+        maxTries,
+        random,
+        batchSize,
+    ):
+        """Add the blocks for growBlocks a batch of attempts at a time and return the number added"""
+        added = 0
+        tries = 0
+        attemptedPairs = set()
+        while added < toGrow:
+            if self.numFreeEndGroups() == 0:
+                logger.critical("growBlocks got no free endGroups!")
+                return added
+            # Draw the attempts for the batch and position each library block to bond to its cell endGroup.
+            # Repeated pairs are kept as None so they count as tries in the same way as in growBlocks.
+            attempts = []
+            for _ in range(max(1, min(batchSize, maxTries - tries))):
+                try:
+                    endGroupPair = self.libraryEndGroupPair(
+                        cellEndGroups=cellEndGroups,
+                        libraryEndGroups=libraryEndGroups,
+                        random=random,
+                    )
+                except RuntimeError as e:
+                    if not attempts:
+                        logger.critical(
+                            "growBlocks cannot grow more blocks: {0}".format(e)
+                        )
+                        return added
+                    break
+                if endGroupPair in attemptedPairs:
+                    self._releaseLibraryBlock(endGroupPair[1].block())
+                    attempts.append(None)
+                    continue
+                attemptedPairs.add(endGroupPair)
+                cellEndGroup, libraryEndGroup = endGroupPair
+                libraryBlock = libraryEndGroup.block()
+                if random:
+                    libraryBlock.randomRotate(origin=self.origin)
+                cellEndGroup.block().positionGrowBlock(
+                    cellEndGroup, libraryEndGroup, dihedral=dihedral
+                )
+                # Only attempt rotation if we're not worried about the dihedral (as for attachBlock)
+                center = cellEndGroup.block().coord(cellEndGroup.endGroupIdx())
+                axis = center - libraryBlock.coord(libraryEndGroup.endGroupIdx())
+                angles, candidates = self._rotationCandidates(
+                    libraryBlock, axis, center, None if dihedral else math.pi / 9
+                )
+                attempts.append(
+                    (cellEndGroup, libraryBlock, axis, center, angles, candidates)
+                )
+            possible = self._screenAttempts(attempts)
+            # Commit the attempts in order
+            for attempt, attemptPossible in zip(attempts, possible):
+                if tries >= maxTries:
+                    logger.critical(
+                        "growBlocks - exceeded maxtries {0} when joining blocks!".format(
+                            maxTries
+                        )
+                    )
+                    return added
+                if attempt is None:
+                    logger.debug("growBlocks got endGroupPair again")
+                    tries += 1
+                    continue
+                cellEndGroup, libraryBlock, axis, center, angles, _ = attempt
+                # An earlier attempt in the batch may have bonded to the cell endGroup
+                if cellEndGroup.free() and self._tryRotations(
+                    libraryBlock, axis, center, angles, attemptPossible
+                ):
+                    added += 1
+                    logger.info(
+                        "growBlocks added block {0} after {1} tries.".format(
+                            added, tries
+                        )
+                    )
+                    self.analyse.stop("grow", d={"num_tries": tries})
+                    tries = 0
+                    if added == toGrow:
+                        break
+                else:
+                    self._releaseLibraryBlock(libraryBlock)
+                    tries += 1
+        return added
+
+    def _screenAttempts(self, attempts):
+        """Screen the orientations of a batch of attempts from _growBlocksBatch against the cell.
+
+        Attempts with library blocks of the same fragmentType are screened together with _screenPlacements.
+
+        Returns:
+        A list with an array of which orientations of each attempt are possible (None for repeated pairs)
+        """
+        possible = [None] * len(attempts)
+        byType = collections.OrderedDict()
+        for i, attempt in enumerate(attempts):
+            if attempt is not None:
+                fragmentType = attempt[1].fragments[0].fragmentType
+                byType.setdefault(fragmentType, []).append(i)
+        for idxAttempts in byType.values():
+            block = attempts[idxAttempts[0]][1]
+            candidates = np.concatenate([attempts[i][5] for i in idxAttempts])
+            typePossible = self._screenPlacements(block, candidates)
+            logger.debug(
+                "growBlocks screened {0} of {1} orientations".format(
+                    np.count_nonzero(typePossible), len(candidates)
+                )
+            )
+            sections = np.cumsum([len(attempts[i][5]) for i in idxAttempts])[:-1]
+            for i, p in zip(idxAttempts, np.split(typePossible, sections)):
+                possible[i] = p
+        return possible
+
     def growPolymer(self, monomers, ratio, length, random=False, center=False):
         """Create a linear polymer.
 
@@ -1726,11 +2083,14 @@ class Cell:
         return
 
     def haloCells(self, key):
+        """Return the boxes around key in the legacy box grid of numBoxes (see _getBox)"""
         return xyz_util.haloCells(key, self.numBoxes, pbc=self.pbc)
 
     def _intersectedCells(self, p1, p2, endPointCells=True):
         """Return a list of the cells intersected by the vector passing from p1 to p2.
 
+        This uses the legacy box grid of numBoxes (see _getBox) and is no longer used by the Cell.
+
         Filched from:
         http://www.flipcode.com/archives/Raytracing_Topics_Techniques-Part_4_Spatial_Subdivisions.shtml
         http://stackoverflow.com/questions/12367071/how-do-i-initialize-the-t-variables-in-a-fast-voxel-traversal-algorithm-for-ray
@@ -1742,15 +2102,8 @@ class Cell:
             self.dim[0], self.dim[1], self.dim[2]
         )  # Not 100% sure - just needs to be bigger than any possible value in the cell
         # Wrap into a single cell
-        if self.pbc[0]:
-            p1[0] % self.dim[0]
-            p2[0] % self.dim[0]
-        if self.pbc[1]:
-            p1[1] % self.dim[1]
-            p2[1] % self.dim[1]
-        if self.pbc[2]:
-            p1[2] % self.dim[2]
-            p2[2] % self.dim[2]
+        p1 = np.where(self.pbc, np.remainder(p1, self.dim), p1)
+        p2 = np.where(self.pbc, np.remainder(p2, self.dim), p2)
         X, Y, Z = self._getBox(p1)  # The cell p1 is in
         outX, outY, outZ = self._getBox(p2)  # The cell p2 is in
         dx, dy, dz = self.vecDiff(p2, p1)  # length components of line
@@ -1848,7 +2201,14 @@ class Cell:
         else:
             return cells[1:-1]
 
-    def joinBlocks(self, toJoin, cellEndGroups=None, dihedral=None, maxTries=100):
+    def joinBlocks(
+        self,
+        toJoin,
+        cellEndGroups=None,
+        dihedral=None,
+        maxTries=100,
+        batchRotations=False,
+    ):
         """
         Bond toJoin blocks together using the endGroup types specified in cellEndGroups
 
@@ -1858,6 +2218,8 @@ class Cell:
                         randomly chosen endGroups will be used.
         dihedral: the dihedral angle about the bond (3rd column in csv file)
         maxTries - the maximum number of moves to try when joining
+        batchRotations - screen all the rotations of the moved block about the bond in a single pass
+                         (see attachBlock)
         """
         logger.info("Joining {0} new blocks".format(toJoin))
         if dihedral:
@@ -1894,7 +2256,12 @@ class Cell:
                 )
             )
             # now attach it
-            ok = self.attachBlock(moveEndGroup, staticEndGroup, dihedral=dihedral)
+            ok = self.attachBlock(
+                moveEndGroup,
+                staticEndGroup,
+                dihedral=dihedral,
+                batchRotations=batchRotations,
+            )
             if ok:
                 added += 1
                 logger.info(
@@ -1947,6 +2314,8 @@ class Cell:
         maxAtomRadius = frag.maxAtomRadius()
         if maxAtomRadius > self.maxAtomRadius:
             self.updateCellSize(maxAtomRadius=maxAtomRadius)
+        # Calculate the topology once so all copies of the fragment share it
+        frag.topologyTemplate()
         # Add to _fragmentLibrary
         self._fragmentLibrary[fragmentType] = frag
         # create dictionary keyed by endGroup types
@@ -1957,14 +2326,12 @@ class Cell:
             self._endGroup2LibraryFragment[ft] = fragmentType
         return
 
-    def _getCell2Library(
-        self, endGroupTypes2Block, cellEndGroups=None, libraryEndGroups=None
-    ):
-        if len(endGroupTypes2Block.keys()) == 0:
+    def _getCell2Library(self, cellTypes, cellEndGroups=None, libraryEndGroups=None):
+        if len(cellTypes) == 0:
             raise RuntimeError("No available endGroups in the cell")
         # We create a dictionary mapping cell endGroups to possible libraryEndGroups
-        cell2Library = {}
-        for ceg in endGroupTypes2Block.keys():
+        cell2Library = collections.OrderedDict()
+        for ceg in cellTypes:
             # We add those endGroup types that can be bonded to that are also in the library
             if ceg in self._bondTable:
                 leg = self._bondTable[ceg].intersection(
@@ -1977,7 +2344,7 @@ class Cell:
         if len(cell2Library.keys()) == 0:
             raise RuntimeError(
                 "No library fragments available to bond under the given rules: {0}".format(
-                    endGroupTypes2Block.keys()
+                    cellTypes
                 )
             )
 
@@ -1992,7 +2359,7 @@ class Cell:
             if len(cell2Library.keys()) == 0:
                 raise RuntimeError(
                     "No free endGroups of types in cellEndGroups: {0} - {1}".format(
-                        cellEndGroups, endGroupTypes2Block.keys()
+                        cellEndGroups, cellTypes
                     )
                 )
 
@@ -2005,7 +2372,7 @@ class Cell:
                 libraryEndGroups
             )  # Save old so we can warn user and also find matching
             tmp = cell2Library
-            cell2Library = {}
+            cell2Library = collections.OrderedDict()
             for ceg, leg in tmp.items():
                 # Only select those that are in the libraryEndGroups
                 pleg = libraryEndGroups.intersection(leg)
@@ -2014,7 +2381,7 @@ class Cell:
             if not len(cell2Library.keys()):
                 raise RuntimeError(
                     "No library fragments of type {0} available to bond under the given rules: {0}".format(
-                        libraryEndGroups, endGroupTypes2Block.keys()
+                        libraryEndGroups, cellTypes
                     )
                 )
         return cell2Library
@@ -2023,9 +2390,9 @@ class Cell:
         self, cellEndGroups=None, libraryEndGroups=None, random=True
     ):
         """Return a fee endGroup from the cell and one from the library that can be bonded to it."""
-        endGroupTypes2Block = self.endGroupTypes2Block()
+        registry = self.endGroupRegistry
         cell2Library = self._getCell2Library(
-            endGroupTypes2Block,
+            registry.types(),
             cellEndGroups=cellEndGroups,
             libraryEndGroups=libraryEndGroups,
         )
@@ -2037,8 +2404,7 @@ class Cell:
             cellEgT = _random.choice(list(cell2Library.keys()))
 
             # First get a block that contains this type of endGroup
-            # Need to use sample as sets don't support random.choice
-            cellBlock = _random.sample(endGroupTypes2Block[cellEgT], 1)[0]
+            cellBlock = self.blocks[registry.sample(cellEgT)]
 
             # Now select a random endGroup of that type from it
             cellEndGroup = cellBlock.selectEndGroup(
@@ -2047,7 +2413,7 @@ class Cell:
 
             # Now get a corresponding library endGroup
             # We need to pick a random one of the types that we can bond to that is also in libraryTypes
-            libEgT = _random.sample(cell2Library[cellEgT], 1)[0]
+            libEgT = _random.choice(sorted(cell2Library[cellEgT]))
 
             # Now determine the fragmentType and create the block and fragment
             fragmentType = self._endGroup2LibraryFragment[libEgT]
@@ -2061,10 +2427,11 @@ class Cell:
             # We need to keep selecting a different but deterministic endGroupType each call
             i = self._deterministicState % len(cell2Library.keys())
             cellEgT = sorted(cell2Library.keys())[i]
-            i = self._deterministicState % len(endGroupTypes2Block[cellEgT])
+            i = self._deterministicState % registry.count(cellEgT)
             # sort blocks by id - what we use is irrelevant, it just needs to be consistent
             cellBlock = sorted(
-                list(endGroupTypes2Block[cellEgT]), key=lambda block: block.id
+                [self.blocks[k] for k in registry.keys(cellEgT)],
+                key=lambda block: block.id,
             )[i]
             cellEndGroup = cellBlock.selectEndGroup(
                 endGroupTypes=[cellEgT], random=random
@@ -2096,7 +2463,11 @@ class Cell:
         return sum([len(b.fragments) for b in self.blocks.values()])
 
     def numFreeEndGroups(self):
-        return sum([b.numFreeEndGroups() for b in self.blocks.values()])
+        return self.endGroupTable.numFree()
+
+    def freeEndGroupCounts(self):
+        """Return an OrderedDict mapping each endGroup type with free endGroups to the number that are free"""
+        return self.endGroupTable.freeCounts()
 
     def numAtoms(self):
         return sum([b.numAtoms() for b in self.blocks.values()])
@@ -2126,7 +2497,7 @@ class Cell:
         logger.info("Running optimisation")
         if not self.mdEngineCls:
             raise RuntimeError("No mdEngine defined - cannot run MD.")
-        mdEngine = self.mdEngineCls(self.paramsDir)
+        mdEngine = self._getMdEngine()
         if doDihedral and doImproper:
             raise RuntimeError("Cannot have impropers and dihedrals at the same time")
         self.setRcut(rigidBody, mdEngine, kw)
@@ -2332,11 +2703,8 @@ class Cell:
 
     def repopulateCells(self, boxShift=None):
         """Add all the blocks to resized cells"""
-        blocks = None
-        if len(self.blocks):
-            # Put all the blocks into the new cells
-            # First copy the blocks dictionary
-            blocks = copy.copy(self.blocks)
+        # First copy the blocks dictionary
+        blocks = copy.copy(self.blocks)
         self.clear()
         if len(blocks):
             logger.debug("repopulateCells, adding blocks into new cells")
@@ -2347,6 +2715,25 @@ class Cell:
             del blocks
         return
 
+    def rebin(self):
+        """Update the spatial indexes after the blocks have been moved in place (e.g. by an MD run).
+
+        Unlike repopulateCells, the blocks are not removed and added back, and only the atoms that have moved
+        into a different box are rebinned. The cell dimensions must not have changed.
+
+        Returns:
+        The number of atoms that changed box
+        """
+        keys = list(self.blocks.keys())
+        if not keys:
+            return 0
+        coords = np.concatenate([self.blocks[key].coords() for key in keys])
+        moved = self.cellList.updateCoords(keys, coords)
+        self.endGroupIndex.updateCoords(self.blocks)
+        self.blockIndex.updateCoords(self.blocks)
+        logger.debug("rebin moved {0} of {1} atoms".format(moved, len(coords)))
+        return moved
+
     def restoreBlocks(self, blocks, fragmentTypes=None):
         assert len(blocks) > 0, "Need blocks to restore!"
         added = 0
@@ -2395,7 +2782,7 @@ class Cell:
         logger.info("Running MD")
         if not self.mdEngineCls:
             raise RuntimeError("No MDENGINE defined - cannot run MD.")
-        mdEngine = self.mdEngineCls(self.paramsDir)
+        mdEngine = self._getMdEngine()
         if doDihedral and doImproper:
             raise RuntimeError("Cannot have impropers and dihedrals at the same time")
         self.setRcut(rigidBody, mdEngine, kw)
@@ -2434,7 +2821,7 @@ class Cell:
         """
         if not self.mdEngineCls:
             raise RuntimeError("No MDENGINE defined - cannot run MD.")
-        mdEngine = self.mdEngineCls(self.paramsDir)
+        mdEngine = self._getMdEngine()
         assert rigidBody, "FIX runMD FOR ALL ATOM!!"
         if doDihedral and doImproper:
             raise RuntimeError("Cannot have impropers and dihedrals at the same time")
@@ -2460,6 +2847,92 @@ class Cell:
         mdEngine.updateCell(self)
         return ok
 
+    def _nearBlocks(self, centres, radii, margin, exclude=None):
+        """Return a mask of the placements of a block that may come within margin of an atom in the cell.
+
+        This is the broad phase of the atom-level searches: the bounding sphere of each placement is checked
+        against the bounding spheres of the blocks in the cell, so the atoms of a placement that is clear of
+        every other block never need to be searched for.
+
+        Args:
+        centres - an (nPlacements, 3) array of the centres of the bounding spheres of the placements
+        radii - the radii of the bounding spheres of the placements, including the largest atom radius
+        margin - the distance between the surfaces of two atoms within which they need to be checked
+        exclude - the key of a block in the cell that should be ignored
+
+        Returns:
+        A boolean array that is True for every placement whose atoms need to be checked
+        """
+        near = np.zeros(len(centres), dtype=bool)
+        idxPlacements = self.blockIndex.overlapping(
+            centres, radii, margin, exclude=exclude
+        )[0]
+        near[idxPlacements] = True
+        return near
+
+    def _screenPlacements(self, block, candidates, tolerance=1.0e-9, pool=None):
+        """Screen possible placements of a block against the atoms in the cell.
+
+        Args:
+        block - the block to place, which must not be in the cell
+        candidates - an (nCandidates, nAtoms, 3) array of coordinates for the block
+        pool - an optional ab_celllist.CellListPool across which the distance checks are split by candidate
+
+        Returns:
+        A boolean array that is False for every candidate that checkMove would reject: those clashing with a
+        wall or with a clash between two atoms that no bond can excuse, as neither atom is a free endGroup or
+        the cap atom of one. Candidates that are True still need to be checked with checkMove.
+        """
+        ncandidates, natoms = candidates.shape[:2]
+        possible = np.ones(ncandidates, dtype=bool)
+        radii = block.radii()
+        if any(self.walls):
+            wradii = radii + self.wallRadius + self.atomMargin
+            for axis, wall in enumerate(self.walls):
+                if wall:
+                    c = candidates[:, :, axis]
+                    possible &= ~np.any(
+                        (c < wradii) | (c > self.dim[axis] - wradii), axis=1
+                    )
+        # Only the placements that could clash with another block need their atoms searched for
+        centres = np.mean(candidates, axis=1)
+        near = self._nearBlocks(
+            centres,
+            np.max(xyz_core.distance(candidates, centres[:, np.newaxis]), axis=1)
+            + np.max(radii),
+            self.atomMargin,
+            exclude=block.id,
+        )
+        idxReachable = np.flatnonzero(np.repeat(near & possible, natoms))
+        if not len(idxReachable):
+            return possible
+        coords = candidates.reshape(-1, 3)[idxReachable]
+        coordRadii = np.tile(radii, ncandidates)[idxReachable]
+        cl = self.cellList
+        margin = self.atomMargin - tolerance
+        backend = self.neighbourBackends["screenPlacements"]
+        if pool is None:
+            idxCoords, slots = cl.clashes(
+                coords, coordRadii, margin, exclude=block.id, backend=backend
+            )
+        else:
+            assert block.id not in cl, "Cannot use a pool to screen a block in the cell"
+            idxCoords, slots = pool.clashes(
+                cl, coords, coordRadii, margin, backend=backend
+            )
+        idxCoords = idxReachable[idxCoords]
+        idxAtoms = idxCoords % natoms
+        # Clashes involving an endGroup or cap atom may be removed by a bond
+        clashing = ~block.isEndGroupArray(idxAtoms, caps=True)
+        keys = cl.blockKeys(slots)
+        for key in np.unique(keys[clashing]):
+            mask = clashing & (keys == key)
+            clashing[mask] = ~self.blocks[key].isEndGroupArray(
+                cl.atomIdx[slots[mask]], caps=True
+            )
+        possible[idxCoords[clashing] // natoms] = False
+        return possible
+
     def seed(
         self,
         nblocks,
@@ -2470,6 +2943,8 @@ class Cell:
         radius=None,
         zone=None,
         random=True,
+        batchSize=None,
+        processes=None,
     ):
         """ Seed a cell with nblocks of type fragmentType.
 
@@ -2486,6 +2961,10 @@ class Cell:
         zone - a list of 6 floats specifying a box within the cell within which the centroids of the blocks will
                be seeded.
         random - randomly rotate the blocks on seeding
+        batchSize - if set, generate this many placements for a block at a time and screen them together for
+                    clashes. The placements are tried in the order they were generated, so the first one that
+                    fits is the one that would have been found by trying them one at a time.
+        processes - the number of processes used to screen each batch of placements (requires batchSize).
         Returns:
         the number of blocks added
         """
@@ -2497,6 +2976,47 @@ class Cell:
         if not len(self._fragmentLibrary):
             raise RuntimeError("Must have set an initBlock before seeding.")
         logger.info("seed adding {0} block of type {1}".format(nblocks, fragmentType))
+        if processes and processes > 1 and batchSize:
+            pool = ab_celllist.CellListPool(processes)
+        else:
+            pool = None
+        try:
+            numBlocksAdded = self._seed(
+                nblocks,
+                fragmentType,
+                maxTries,
+                center,
+                point,
+                radius,
+                zone,
+                random,
+                batchSize,
+                pool,
+            )
+        finally:
+            if pool is not None:
+                pool.close()
+        logger.info(
+            "Seed added {0} blocks. Cell now contains {1} blocks".format(
+                numBlocksAdded, len(self.blocks)
+            )
+        )
+        return numBlocksAdded
+
+    def _seed(
+        self,
+        nblocks,
+        fragmentType,
+        maxTries,
+        center,
+        point,
+        radius,
+        zone,
+        random,
+        batchSize,
+        pool,
+    ):
+        """Add the blocks for seed and return the number added"""
         numBlocksAdded = 0
         # Loop through the nblocks adding the blocks to the cell
         for seedCount in range(nblocks):
@@ -2512,25 +3032,57 @@ class Cell:
                             numBlocksAdded
                         )
                     )
+                    self._releaseLibraryBlock(newblock)
                     self.analyse.stop("seed", d={"num_tries": tries})
                     return numBlocksAdded
-                # if center put the first one in the center of the cell
-                # only if this is the first attempt as otherwise we always fail if there is already something there
-                if center and seedCount == 0 and tries == 0:
-                    newblock.translateCentroid(
-                        [self.dim[0] / 2, self.dim[1] / 2, self.dim[2] / 2]
+                if batchSize:
+                    # Generate a batch of placements and only add those that pass the screen
+                    ncandidates = min(batchSize, maxTries - tries)
+                    candidates = np.empty((ncandidates, newblock.numAtoms(), 3))
+                    for i in range(ncandidates):
+                        self._seedPosition(
+                            newblock,
+                            center and seedCount == 0 and tries + i == 0,
+                            point,
+                            radius,
+                            zone,
+                            random,
+                        )
+                        candidates[i] = newblock.coords()
+                    possible = self._screenPlacements(newblock, candidates, pool=pool)
+                    logger.debug(
+                        "seed screened {0} of {1} placements".format(
+                            np.count_nonzero(possible), ncandidates
+                        )
                     )
                 else:
-                    # Move the block and rotate it
-                    self.positionBlock(
-                        newblock, point=point, radius=radius, zone=zone, random=random
+                    ncandidates = 1
+                    candidates = None
+                    possible = [True]
+                    self._seedPosition(
+                        newblock,
+                        center and seedCount == 0 and tries == 0,
+                        point,
+                        radius,
+                        zone,
+                        random,
                     )
-                # Add the block so we can check for clashes/bonds
-                idxBlock = self.addBlock(newblock)
-                # Test for Clashes with other molecules
-                if self.checkMove(idxBlock):
-                    if self.processBonds() > 0:
-                        logger.info("Added bond in seed!")
+                added = False
+                for i in np.flatnonzero(possible):
+                    if candidates is not None:
+                        newblock.setCoords(candidates[i])
+                    # Add the block so we can check for clashes/bonds
+                    idxBlock = self.addBlock(newblock)
+                    # Test for Clashes with other molecules
+                    if self.checkMove(idxBlock):
+                        if self.processBonds() > 0:
+                            logger.info("Added bond in seed!")
+                        tries += i
+                        added = True
+                        break
+                    # Unsuccessful so remove the block from cell
+                    self.delBlock(idxBlock)
+                if added:
                     logger.debug(
                         "seed added block {0} after {1} tries.".format(
                             seedCount + 1, tries
@@ -2539,23 +3091,29 @@ class Cell:
                     self.analyse.stop("seed", d={"num_tries": tries})
                     numBlocksAdded += 1
                     break
-                # Unsuccessful so remove the block from cell
-                self.delBlock(idxBlock)
                 # If seed fails with center need to bail on first one.
                 if center and seedCount == 0 and tries == 0:
                     logger.warn(
                         "Seed with center failed to place first block in center!"
                     )
-                tries += 1  # increment tries counter
+                tries += ncandidates  # increment tries counter
             # End Clash loop
         # End of loop to seed cell
-        logger.info(
-            "Seed added {0} blocks. Cell now contains {1} blocks".format(
-                numBlocksAdded, len(self.blocks)
-            )
-        )
         return numBlocksAdded
 
+    def _seedPosition(self, block, center, point, radius, zone, random):
+        """Move a block to the center of the cell or to a random position for seed"""
+        if center:
+            block.translateCentroid(
+                [self.dim[0] / 2, self.dim[1] / 2, self.dim[2] / 2]
+            )
+        else:
+            # Move the block and rotate it
+            self.positionBlock(
+                block, point=point, radius=radius, zone=zone, random=random
+            )
+        return
+
     def setBondingFunction(self, fragmentType, onbondFunction):
         fragment = self._fragmentLibrary[fragmentType]
         fragment.onbondFunction = onbondFunction
@@ -2692,6 +3250,61 @@ class Cell:
         )
         return
 
+    def setMdSession(self, session=True):
+        """Keep a single MD engine and simulation alive between calls to optimiseGeometry and runMD.
+
+        Between calls only the particles and topology are replaced in the running simulation. The simulation
+        is rebuilt from scratch whenever the particle, bond, angle or dihedral types change.
+        Requires HOOMD-blue 2.
+
+        Args:
+        session - True/False - turn the session on or off
+        """
+        if session and not (ab_util.HOOMDVERSION and ab_util.HOOMDVERSION[0] > 1):
+            msg = "An MD session requires HOOMD-blue 2"
+            logger.critical(msg)
+            raise RuntimeError(msg)
+        self.mdSession = session
+        self._mdEngine = None
+        return
+
+    def _getMdEngine(self):
+        """Return the MD engine, reusing the engine from the last run if we are in an MD session"""
+        if not getattr(self, "mdSession", False):
+            return self.mdEngineCls(self.paramsDir)
+        if getattr(self, "_mdEngine", None) is None:
+            self._mdEngine = self.mdEngineCls(self.paramsDir)
+            self._mdEngine.session = True
+        return self._mdEngine
+
+    def setNeighbourBackend(self, backend, operations=None):
+        """Set the method used to search for the atoms or endGroups close to each other.
+
+        The "cells" backend searches the boxes of the cellList, which are sized for atom clashes. The "kdtree"
+        backend uses a periodic scipy cKDTree, which can be faster when the search distance is a poor fit for
+        the box size, such as zipBlocks with a large bondMargin. Both find exactly the same atoms.
+
+        Args:
+        backend - "cells" or "kdtree" (requires scipy)
+        operations - the name or list of names of the operations that will use the backend, from closeAtoms,
+                     screenPlacements, bondClash and zipBlocks. If None the backend is used for all of them.
+        """
+        ab_celllist.checkBackend(backend)
+        if operations is None:
+            operations = NEIGHBOUR_OPERATIONS
+        elif isinstance(operations, str):
+            operations = [operations]
+        for operation in operations:
+            if operation not in NEIGHBOUR_OPERATIONS:
+                msg = "Unknown neighbour search operation: {0}. Operations are: {1}".format(
+                    operation, NEIGHBOUR_OPERATIONS
+                )
+                logger.critical(msg)
+                raise RuntimeError(msg)
+            self.neighbourBackends[operation] = backend
+        logger.info("Neighbour search backends: {0}".format(self.neighbourBackends))
+        return
+
     def setRcut(self, rigidBody, mdEngine, kw):
         """if rCut not in kw, for hoomd2 rigidBodies calculate from max block size or use mdEngine default"""
         RIGIDPARTICLES = (
@@ -2727,6 +3340,9 @@ class Cell:
         z = xyz_core.SYMBOL_TO_NUMBER[symbol]
         r = xyz_core.COVALENT_RADII[z] * xyz_core.BOHR2ANGSTROM
         self.wallRadius = r
+        if self.cellList is not None:
+            # The boxes depend on which axes are periodic
+            self.repopulateCells()
         return
 
     def _setupAnalyse(self, logfile="ambuild.csv"):
@@ -2792,18 +3408,19 @@ class Cell:
             self.boxMargin = max(self.atomMargin, self.bondMargin) + MARGIN
         assert self.boxMargin != 0 and self.maxAtomRadius != 0
         self.boxSize = (self.maxAtomRadius * 2) + self.boxMargin
-        # jmht - ceil or floor
+        # The legacy box grid of _getBox, haloCells and _intersectedCells - the atoms are binned by the cellList
         self.numBoxes[0] = int(math.ceil(self.dim[0] / self.boxSize))
         self.numBoxes[1] = int(math.ceil(self.dim[1] / self.boxSize))
         self.numBoxes[2] = int(math.ceil(self.dim[2] / self.boxSize))
+        # Create the new boxes and add any blocks that are already in the cell to them
+        self.repopulateCells(boxShift=boxShift)
+        # There is no cellList while the box size is still zero
+        numBoxes = None if self.cellList is None else self.cellList.numBoxes.tolist()
         logger.debug(
             "updateCellSize: boxSize {0} nboxes: {1} maxR {2} margin {3}".format(
-                self.boxSize, self.numBoxes, self.maxAtomRadius, self.boxMargin
+                self.boxSize, numBoxes, self.maxAtomRadius, self.boxMargin
             )
         )
-        # If there are already blocks in the cell, we need to add them to the new boxes
-        if len(self.blocks):
-            self.repopulateCells(boxShift=boxShift)
         return
 
     def updateFragmentCharges(self, fragmentType=None, filename=None):
@@ -2961,6 +3578,7 @@ class Cell:
         clashCheck=False,
         clashDist=1.6,
         selfBond=True,
+        processes=None,
     ):
         """Join existing blocks in the cell by changing the bondMargin and bondAngleMargin parameters that were
         specified when the cell was created, and then looping over all the free endGroups to see if any can bond
@@ -2972,9 +3590,11 @@ class Cell:
         clashCheck - True/False check for clashes between the bond and any atoms that fall within a cylinder
                      of radius clashDist (default=1.6A) centered on the bond axis.
         clashDist  - a float specifying the perpendicular distance from the bond axis that determines if an atom
-                     is clashing with the bond. clashDist needs to be < the the cell box size as otherwise we won't
-                     see the atom.
+                     is clashing with the bond.
         selfBond  - boolean to specify if zip will allow a block to bond to itself (True) or not (False) [default: True]
+        processes - the number of processes used to screen the possible bonds. The cell is split into this many
+                    slabs that are screened in parallel, and the bonds made are the same as with a single process.
+                    The bond clash checks search a copy of the cell's atoms shared with the same processes.
         """
         if bondMargin > max(self.dim):
             raise RuntimeError("bondMargin is greater then the cell")
@@ -2985,100 +3605,55 @@ class Cell:
         )
         # Convert to radians
         bondAngleMargin = math.radians(bondAngleMargin)
-        # Calculate the number of boxes - should calculate max possible bond length
-        maxBondLength = 2.5
-        boxSize = maxBondLength + bondMargin
-        numBoxes = [None, None, None]
-        numBoxes[0] = int(math.ceil(self.dim[0] / boxSize))
-        numBoxes[1] = int(math.ceil(self.dim[1] / boxSize))
-        numBoxes[2] = int(math.ceil(self.dim[2] / boxSize))
-        # Create empty cells to hold data
-        cell1 = {}
-        cell3 = {}
-        # Get a list of all block, endGroups
-        endGroups = []
-        for block in self.blocks.values():
-            egs = block.freeEndGroups()
-            if len(egs):
-                block.zipCell = {}
-                for endGroup in egs:
-                    endGroups.append((block, endGroup.endGroupIdx()))
-        if not len(endGroups) > 0:
+        if not len(self.endGroupIndex):
             logger.warn("zipBlocks found no free endGroups!")
             return 0
-        # Add all (block, idxEndGroup) tuples to the cells
-        for (block, idxEndGroup) in endGroups:
-            coord = block.coord(idxEndGroup)
-            # Periodic Boundaries
-            x = coord[0] % self.dim[0] if self.pbc[0] else coord[0]
-            y = coord[1] % self.dim[1] if self.pbc[1] else coord[1]
-            z = coord[1] % self.dim[2] if self.pbc[2] else coord[2]
-            # Calculate which cell the atom is in
-            a = int(math.floor(x / boxSize))
-            b = int(math.floor(y / boxSize))
-            c = int(math.floor(z / boxSize))
-            key = (a, b, c)
-            block.zipCell[idxEndGroup] = key
-            try:
-                # Add the atom to the cell
-                cell1[key].append((block, idxEndGroup))
-            except KeyError:
-                # Add the cell to the list and then add the atom
-                cell1[key] = [(block, idxEndGroup)]
-                # Map the cells surrounding this one
-                cell3[key] = xyz_util.haloCells(key, numBoxes, pbc=self.pbc)
-        # Loop through all the end groups and run canBond
-        egPairs = (
-            collections.OrderedDict()
-        )  # Use dict keys as effectively implements an ordered set
-        c1 = []
-        c2 = []
-        for block1, idxEndGroup1 in endGroups:
-            key = block1.zipCell[idxEndGroup1]  # Get the box this atom is in
-            surroundingCells = cell3[key]
-            for sbox in surroundingCells:
-                # Check if we have a box with anything in it
-                # use exception so we don't have to search through the whole list
-                try:
-                    alist = cell1[sbox]
-                except KeyError:
-                    continue
-                for (block2, idxEndGroup2) in alist:
-                    if block1 == block2:
-                        # Self-bonded blocks need special care
-                        if not selfBond:
-                            continue
-                        if (
-                            idxEndGroup1 == idxEndGroup2
-                        ):  # Don't check endGroups against themselves
-                            continue
-                        # Make sure the two atoms are separated by at least 3 bonds.
-                        # Could put this check in canBond but it would slow the normal bonding down
-                        if idxEndGroup2 in block1.atomBonded3(idxEndGroup1):
-                            continue
-                    pair1 = (block1, idxEndGroup1, block2, idxEndGroup2)
-                    pair2 = (block2, idxEndGroup2, block1, idxEndGroup1)
-                    if pair1 not in egPairs and pair2 not in egPairs:
-                        # Check if it is already present as we loop over all endGroups so we will have both sides twice
-                        egPairs[pair1] = None
-                        c1.append(block1.coord(idxEndGroup1))
-                        c2.append(block2.coord(idxEndGroup2))
-        if len(egPairs.keys()) < 1:
-            logger.info("zipBlocks: no endGroups close enough to bond")
-            return 0
-        distances = self.distance(np.array(c1), np.array(c2))
-        self._possibleBonds = []
-        for i, (block1, idxEndGroup1, block2, idxEndGroup2) in enumerate(
-            egPairs.keys()
-        ):
-            got = self.canBond(
-                block1,
-                idxEndGroup1,
-                block2,
-                idxEndGroup2,
-                distances[i],
+        if processes and processes > 1:
+            pool = ab_celllist.CellListPool(processes)
+            if clashCheck:
+                # Start the processes with room for the atoms of the cell for the bond clash checks
+                pool.publish(self.cellList)
+        else:
+            pool = None
+        try:
+            bondsMade = self._zipBlocks(
                 bondMargin,
                 bondAngleMargin,
+                clashCheck,
+                clashDist,
+                selfBond,
+                pool,
+                processes,
+            )
+        finally:
+            if pool is not None:
+                pool.close()
+        return bondsMade
+
+    def _zipBlocks(
+        self,
+        bondMargin,
+        bondAngleMargin,
+        clashCheck,
+        clashDist,
+        selfBond,
+        pool,
+        processes,
+    ):
+        """Find and make the bonds for zipBlocks and return the number made"""
+        # Get all pairs of free endGroups that could be close enough to bond - should calculate max possible bond length
+        if pool is None:
+            self._possibleBonds = self._zipPossibleBonds(
+                MAX_BOND_LENGTH + bondMargin, bondMargin, bondAngleMargin, selfBond
+            )
+        else:
+            self._possibleBonds = self._zipPossibleBondsParallel(
+                MAX_BOND_LENGTH + bondMargin,
+                bondMargin,
+                bondAngleMargin,
+                selfBond,
+                pool,
+                processes,
             )
         # Process any bonds
         if len(self._possibleBonds) == 0:
@@ -3087,11 +3662,8 @@ class Cell:
         # Check the bonds don't clash with anything
         if clashCheck:
             logger.info("zipBlocks: checking for clashes with bonds...")
-            toRemove = [
-                bond
-                for bond in self._possibleBonds
-                if self.bondClash(bond=bond, clashDist=clashDist)
-            ]
+            clashes = self.bondClashes(self._possibleBonds, clashDist, pool=pool)
+            toRemove = [b for b, c in zip(self._possibleBonds, clashes) if c]
             if len(toRemove):
                 logger.info(
                     "zipBlocks: {0} bonds not accepted due to clashes".format(
@@ -3122,6 +3694,172 @@ class Cell:
         self.analyse.stop("zip")
         return bondsMade
 
+    def _zipPossibleBonds(self, cutoff, bondMargin, bondAngleMargin, selfBond):
+        """Return the list of bonds zipBlocks could make between endGroup atoms less than cutoff apart"""
+        self._possibleBonds = []
+        pairs = self.endGroupIndex.pairs(
+            cutoff, backend=self.neighbourBackends["zipBlocks"]
+        )
+        idxBlocks1, idxAtoms1, idxBlocks2, idxAtoms2, distances = pairs
+        blocks1 = [self.blocks[i] for i in idxBlocks1.tolist()]
+        blocks2 = [self.blocks[i] for i in idxBlocks2.tolist()]
+        keep = np.ones(len(distances), dtype=bool)
+        for i in np.flatnonzero(idxBlocks1 == idxBlocks2).tolist():
+            # Self-bonded blocks need special care
+            # Make sure the two atoms are separated by at least 3 bonds.
+            # Could put this check in canBond but it would slow the normal bonding down
+            keep[i] = selfBond and int(idxAtoms2[i]) not in blocks1[i].atomBonded3(
+                int(idxAtoms1[i])
+            )
+        keep = np.flatnonzero(keep)
+        if len(keep) < 1:
+            logger.info("zipBlocks: no endGroups close enough to bond")
+            return []
+        self._screenBonds(
+            [blocks1[i] for i in keep],
+            idxAtoms1[keep],
+            [blocks2[i] for i in keep],
+            idxAtoms2[keep],
+            distances[keep],
+            bondMargin,
+            bondAngleMargin,
+            match=True,
+        )
+        return self._possibleBonds
+
+    def _zipPossibleBondsParallel(
+        self, cutoff, bondMargin, bondAngleMargin, selfBond, pool, processes
+    ):
+        """Return the same bonds as _zipPossibleBonds, screening slabs of the cell in a process pool.
+
+        The free endGroups are flattened into arrays, split into slabs with halos of cutoff (see
+        ab_celllist.slabDomains) and screened for distances, angles and bonding rules by zipWorker. The
+        candidates from all the slabs are merged back into the order _screenBonds would have found them in
+        before they are matched, so the result doesn't depend on the number of processes.
+        """
+        index = self.endGroupIndex
+        index.update()
+        cl = index.cellList
+        # Compact the slots so they are numbered as for EndGroupIndex.pairs
+        cl.rebuild()
+        nslots = len(cl)
+        keys = cl.blockKeys(np.arange(nslots))
+        idxAtoms = cl.atomIdx[:nslots]
+        # The free endGroups from the endGroupTable, sorted so those of each atom are in the rows egStart to
+        # egStart + egCount (and in the order of the atom's endGroups in its block)
+        table = self.endGroupTable
+        rows = table.free()
+        if not nslots or not len(rows):
+            logger.info("zipBlocks: no endGroups close enough to bond")
+            return []
+        blockKeys, blockCodes = np.unique(
+            np.concatenate((keys, table.blockKey[rows])), return_inverse=True
+        )
+        slotBlocks, rowBlocks = blockCodes[:nslots], blockCodes[nslots:]
+        stride = max(np.max(idxAtoms), np.max(table.endGroupIdx[rows])) + 1
+        rowCodes = rowBlocks * stride + table.endGroupIdx[rows]
+        order = np.argsort(rowCodes, kind="mergesort")
+        rows, rowCodes, rowBlocks = rows[order], rowCodes[order], rowBlocks[order]
+        atomCodes = slotBlocks * stride + idxAtoms
+        egStart = np.searchsorted(rowCodes, atomCodes, side="left")
+        egCount = np.searchsorted(rowCodes, atomCodes, side="right") - egStart
+        endGroups = table.endGroups[rows]
+        # All the endGroups of an atom are in the same fragment
+        fragments = np.where(
+            egCount > 0, table.fragmentId[rows][np.minimum(egStart, len(rows) - 1)], -1
+        )
+        # Gather the coordinates and symbols of the atoms and the coordinates of the caps a block at a time
+        atomCoords = np.empty((nslots, 3))
+        atomSymbols = np.empty(nslots, dtype=object)
+        egCaps = np.empty((len(rows), 3))
+        slotOrder = np.argsort(slotBlocks, kind="mergesort")
+        bounds = np.arange(len(blockKeys) + 1)
+        slotSplit = np.searchsorted(slotBlocks[slotOrder], bounds)
+        rowSplit = np.searchsorted(rowBlocks, bounds)
+        for code, key in enumerate(blockKeys.tolist()):
+            block = self.blocks[key]
+            coords = block.coords()
+            slots = slotOrder[slotSplit[code] : slotSplit[code + 1]]
+            atomCoords[slots] = coords[idxAtoms[slots]]
+            atomSymbols[slots] = block.symbols()[idxAtoms[slots]]
+            start, stop = rowSplit[code], rowSplit[code + 1]
+            egCaps[start:stop] = coords[table.capIdx[rows[start:stop]]]
+        symbolNames, symbols = np.unique(atomSymbols.astype(str), return_inverse=True)
+        symbolNames = symbolNames.tolist()
+        # Number the endGroup types and pick an endGroup of each type to check which can bond
+        _, typeEndGroups, egTypes = np.unique(
+            table.typeId[rows], return_index=True, return_inverse=True
+        )
+        allowed = np.array(
+            [
+                [self.bondAllowed(endGroups[i], endGroups[j]) for j in typeEndGroups]
+                for i in typeEndGroups
+            ],
+            dtype=bool,
+        )
+        # Length of a bond from an atom of the first symbol to one of the second, as canBond looks them up
+        bondLengths = np.array(
+            [[xyz_util.bondLength(s2, s1) for s2 in symbolNames] for s1 in symbolNames]
+        )
+        args = []
+        for slots, owned in ab_celllist.slabDomains(
+            cl.coords[:nslots], self.dim, self.pbc, processes, cutoff
+        ):
+            counts = egCount[slots]
+            starts = np.cumsum(counts) - counts
+            rows = np.repeat(egStart[slots] - starts, counts) + np.arange(counts.sum())
+            domain = {
+                "coords": cl.coords[slots],
+                "atomCoords": atomCoords[slots],
+                "slots": slots,
+                "owned": owned,
+                "symbols": symbols[slots],
+                "fragments": fragments[slots],
+                "egStart": starts,
+                "egCount": counts,
+                "egRows": rows,
+                "egTypes": egTypes[rows],
+                "egCaps": egCaps[rows],
+            }
+            args.append(
+                (
+                    domain,
+                    bondLengths,
+                    symbolNames,
+                    allowed,
+                    cutoff,
+                    bondMargin,
+                    bondAngleMargin,
+                    cl.boxSize,
+                    self.dim,
+                    self.pbc,
+                    self.neighbourBackends["zipBlocks"],
+                )
+            )
+        results = pool.map(zipWorker, args)
+        slots1, slots2, rows1, rows2, scores = [np.concatenate(r) for r in zip(*results)]
+        # Order the candidates by pair of atoms and then endGroups as _screenBonds does
+        order = np.lexsort((rows2, rows1, slots2, slots1))
+        slots1, slots2, scores = slots1[order], slots2[order], scores[order]
+        rows1, rows2 = rows1[order], rows2[order]
+        keep = np.ones(len(order), dtype=bool)
+        for i in np.flatnonzero(keys[slots1] == keys[slots2]).tolist():
+            # Self-bonded blocks need special care (see _zipPossibleBonds)
+            keep[i] = selfBond and int(idxAtoms[slots2[i]]) not in self.blocks[
+                keys[slots1[i]]
+            ].atomBonded3(int(idxAtoms[slots1[i]]))
+        candidates = [
+            (s1 * nslots + s2, endGroups[r1], endGroups[r2])
+            for s1, s2, r1, r2 in zip(
+                slots1[keep].tolist(),
+                slots2[keep].tolist(),
+                rows1[keep].tolist(),
+                rows2[keep].tolist(),
+            )
+        ]
+        chosen = self._matchBonds(candidates, scores[keep])
+        return [ab_bond.Bond(candidates[j][1], candidates[j][2]) for j in chosen]
+
     def __getstate__(self):
         """Return a dict of objects we want to pickle.
 
@@ -3136,6 +3874,10 @@ class Cell:
             del d[
                 "mdEngineCls"
             ]  # Contains a reference to the hoomd-blue module and logger
+        d["_mdEngine"] = None  # Holds a live hoomd-blue simulation
+        # The library blocks are recreated when they are needed
+        d["_libraryBlocks"] = {}
+        d["_libraryBlockPool"] = {}
         return d
 
     def __setstate__(self, d):
@@ -3151,4 +3893,126 @@ class Cell:
         else:
             self.logcsv = "ambuild_1.csv"
         self._setupAnalyse(logfile=self.logcsv)
+        if "neighbourBackends" not in d:  # Hack for older versions with only the cell list
+            self.neighbourBackends = dict.fromkeys(
+                NEIGHBOUR_OPERATIONS, ab_celllist.CELLS
+            )
+        if "_libraryBlocks" not in d:  # Hack for older versions without library blocks
+            self._libraryBlocks = {}
+            self._libraryBlockPool = {}
         return
+
+
+def bondGeometry(
+    staticCoords,
+    staticCaps,
+    addCoords,
+    addCaps,
+    bondLengths,
+    bondMargin,
+    bondAngleMargin,
+    dim,
+    pbc,
+):
+    """Return Cell.screenBondGeometry's mask and a score of how far each bond is from the ideal geometry.
+
+    The score is the deviation from the bond length as a fraction of bondMargin plus the mean deviation of the
+    two angles as a fraction of bondAngleMargin, so it is 0 for a perfect bond and below 2 for any acceptable
+    bond.
+    """
+    distances = xyz_core.distance(staticCoords, addCoords, dim=dim, pbc=pbc)
+    ok = (np.maximum(0.1, bondLengths - bondMargin) < distances) & (
+        distances < bondLengths + bondMargin
+    )
+    # Check if atoms are in line (zero degrees) within margin
+    angle1 = xyz_core.angles(addCaps, addCoords, staticCoords, dim=dim, pbc=pbc)
+    angle2 = xyz_core.angles(staticCaps, staticCoords, addCoords, dim=dim, pbc=pbc)
+    ok &= (-bondAngleMargin < angle1) & (angle1 < bondAngleMargin)
+    ok &= (-bondAngleMargin < angle2) & (angle2 < bondAngleMargin)
+    scores = np.abs(distances - bondLengths) / bondMargin
+    scores += (np.abs(angle1) + np.abs(angle2)) / (2 * bondAngleMargin)
+    return ok, scores
+
+
+def zipWorker(args):
+    """Screen the possible bonds between the free endGroup atoms in one slab of the cell for zipBlocks.
+
+    Called from a process pool with a tuple of (domain, bondLengths, symbols, allowed, cutoff, bondMargin,
+    bondAngleMargin, boxSize, dim, pbc, backend), where domain is a dictionary of the arrays for the slab made by
+    Cell._zipPossibleBondsParallel, bondLengths[i, j] is the length of a bond from an atom of symbol i to one of
+    symbol j and allowed[i, j] is True if endGroup types i and j can bond.
+
+    Returns:
+    A tuple of arrays (slots1, slots2, rows1, rows2, scores) for the bonds with an acceptable geometry between
+    pairs of atoms where the atom in the lower slot is owned by the slab. The slots are those of the atoms in
+    the EndGroupIndex and the rows those of the endGroups in the table the slab was taken from.
+    """
+    (
+        domain,
+        bondLengths,
+        symbols,
+        allowed,
+        cutoff,
+        bondMargin,
+        bondAngleMargin,
+        boxSize,
+        dim,
+        pbc,
+        backend,
+    ) = args
+    slots = domain["slots"]
+    cl = ab_celllist.CellList(boxSize, dim, pbc)
+    cl.add(0, domain["coords"])
+    local1, local2, distances = cl.pairs(cutoff, backend=backend)
+    # Each pair is screened by the slab that owns the atom in the lower slot
+    swap = slots[local1] > slots[local2]
+    local1, local2 = np.where(swap, local2, local1), np.where(swap, local1, local2)
+    owned = domain["owned"][local1]
+    local1, local2, distances = local1[owned], local2[owned], distances[owned]
+    symbols1, symbols2 = domain["symbols"][local1], domain["symbols"][local2]
+    lengths = bondLengths[symbols1, symbols2]
+    if np.any(lengths < 0):
+        i = np.flatnonzero(lengths < 0)[0]
+        raise RuntimeError(
+            "Missing bond distance for: {0}-{1}".format(
+                symbols[symbols2[i]], symbols[symbols1[i]]
+            )
+        )
+    inRange = (np.maximum(0.1, lengths - bondMargin) < distances) & (
+        distances < lengths + bondMargin
+    )
+    # EndGroups in the same fragment can never bond
+    inRange &= domain["fragments"][local1] != domain["fragments"][local2]
+    local1, local2, lengths = local1[inRange], local2[inRange], lengths[inRange]
+    # Expand the pairs of atoms to all the pairs of their endGroups
+    count1, count2 = domain["egCount"][local1], domain["egCount"][local2]
+    counts = count1 * count2
+    idxPair = np.repeat(np.arange(len(counts)), counts)
+    k = np.arange(len(idxPair)) - np.repeat(np.cumsum(counts) - counts, counts)
+    eg1 = domain["egStart"][local1][idxPair] + k // count2[idxPair]
+    eg2 = domain["egStart"][local2][idxPair] + k % count2[idxPair]
+    ok = allowed[domain["egTypes"][eg1], domain["egTypes"][eg2]]
+    idxPair, eg1, eg2 = idxPair[ok], eg1[ok], eg2[ok]
+    if not len(idxPair):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, empty, np.empty(0)
+    atomCoords = domain["atomCoords"]
+    ok, scores = bondGeometry(
+        atomCoords[local1[idxPair]],
+        domain["egCaps"][eg1],
+        atomCoords[local2[idxPair]],
+        domain["egCaps"][eg2],
+        lengths[idxPair],
+        bondMargin,
+        bondAngleMargin,
+        dim,
+        pbc,
+    )
+    rows = domain["egRows"]
+    return (
+        slots[local1[idxPair[ok]]],
+        slots[local2[idxPair[ok]]],
+        rows[eg1[ok]],
+        rows[eg2[ok]],
+        scores[ok],
+    )
@@ -1,29 +1,99 @@
+import numpy as np
+
+
 class CellData(object):
+    """Arrays of the atom and topology data of a cell that are passed to the MD engines and file writers.
+
+    The types of the atoms, bonds, angles and dihedrals are held as integer ids into the lists of names in
+    atomTypeNames, bondTypeNames etc. The label of each bond, angle and dihedral is the types of its atoms
+    joined by "-". The offsets arrays hold where the data for each block starts.
+    """
+
     def __init__(self):
         self.cell = []
         self.natoms = 0
-        self.atomTypes = []
-        self.bodies = []
-        self.coords = []
-        self.charges = []
-        self.diameters = []
-        self.images = []
-        self.masses = []
-        self.masked = []  # Atoms that are to be ignored in MD/optimisation
-        self.symbols = []
-        self.static = []  # If this atom is part of a group that isn't to be moved
+        self.atomTypeIds = np.empty(0, dtype=np.int64)
+        self.atomTypeNames = []
+        self.bodies = np.empty(0, dtype=np.int64)  # Index of the fragment of each atom in the cell
+        self.blockBodies = np.empty(0, dtype=np.int64)  # Body of each atom within its block
+        self.coords = np.empty((0, 3))
+        self.charges = np.empty(0)
+        self.diameters = np.empty(0)
+        self.images = np.empty((0, 3), dtype=np.int64)
+        self.masses = np.empty(0)
+        self.masked = np.empty(0, dtype=bool)  # Atoms that are to be ignored in MD/optimisation
+        self.symbols = np.empty(0, dtype=str)
+        self.static = np.empty(0, dtype=bool)  # If this atom is part of a group that isn't to be moved
+        self.blockOffsets = np.zeros(1, dtype=np.int64)
         # multi-particle properties
-        self.bonds = []
-        self.bondLabels = []
-        self.angles = []
-        self.angleLabels = []
-        self.propers = []
-        self.properLabels = []
-        self.impropers = []
-        self.improperLabels = []
+        self.bonds = np.empty((0, 2), dtype=np.int64)
+        self.bondTypeIds = np.empty(0, dtype=np.int64)
+        self.bondTypeNames = []
+        self.bondOffsets = np.zeros(1, dtype=np.int64)
+        self.angles = np.empty((0, 3), dtype=np.int64)
+        self.angleTypeIds = np.empty(0, dtype=np.int64)
+        self.angleTypeNames = []
+        self.angleOffsets = np.zeros(1, dtype=np.int64)
+        self.propers = np.empty((0, 4), dtype=np.int64)
+        self.properTypeIds = np.empty(0, dtype=np.int64)
+        self.properTypeNames = []
+        self.properOffsets = np.zeros(1, dtype=np.int64)
+        self.impropers = np.empty((0, 4), dtype=np.int64)
+        self.improperTypeIds = np.empty(0, dtype=np.int64)
+        self.improperTypeNames = []
+        self.improperOffsets = np.zeros(1, dtype=np.int64)
         # for computing block/fragment enegies
         self.tagIndices = []
         # Central particles for hoomd-blue rigid bodies
         self.rigidParticles = []
         self.rigidParticleMgr = None
         return
+
+    @property
+    def atomTypes(self):
+        return [self.atomTypeNames[i] for i in self.atomTypeIds]
+
+    @property
+    def bondLabels(self):
+        return [self.bondTypeNames[i] for i in self.bondTypeIds]
+
+    @property
+    def angleLabels(self):
+        return [self.angleTypeNames[i] for i in self.angleTypeIds]
+
+    @property
+    def properLabels(self):
+        return [self.properTypeNames[i] for i in self.properTypeIds]
+
+    @property
+    def improperLabels(self):
+        return [self.improperTypeNames[i] for i in self.improperTypeIds]
+
+    def setAtomTypes(self, atomTypes):
+        """Set the atom type ids and names from an array of the type of each atom"""
+        names, ids = np.unique(np.asarray(atomTypes, dtype=str), return_inverse=True)
+        self.atomTypeNames = names.tolist()
+        self.atomTypeIds = ids.reshape(-1)
+        return
+
+    def topologyTypes(self, indices):
+        """Return the type ids and type names for the bonds, angles or dihedrals in indices.
+
+        Each label is only formatted once for each unique combination of atom types.
+
+        Args:
+        indices: (n, k) array of atom indices
+
+        Returns:
+        A tuple of the (n,) array of type ids and the sorted list of type names
+        """
+        if not len(indices):
+            return np.empty(0, dtype=np.int64), []
+        unique, inverse = np.unique(
+            self.atomTypeIds[indices], axis=0, return_inverse=True
+        )
+        labels = ["-".join(self.atomTypeNames[t] for t in row) for row in unique]
+        names = sorted(set(labels))
+        lookup = dict((name, i) for i, name in enumerate(names))
+        ids = np.array([lookup[label] for label in labels], dtype=np.int64)
+        return ids[inverse.reshape(-1)], names
@@ -0,0 +1,1190 @@
+"""
+Array-backed spatial hashes used by the Cell to find close atoms, endGroups and blocks, the registry it uses
+to pick blocks by the types of their free endGroups, the table of all its endGroups and the process pool that
+searches a shared copy of its atoms.
+"""
+import collections
+import itertools
+import logging
+import math
+import multiprocessing
+import random as _random
+
+import numpy as np
+
+from ambuild import xyz_core
+
+logger = logging.getLogger(__name__)
+
+# Offsets to the 27 boxes that make up the halo of (and include) a box
+STENCIL = np.array(list(itertools.product((-1, 0, 1), repeat=3)), dtype=np.int64)
+
+
+_STENCILS = {1: STENCIL}
+
+
+def stencil(shells):
+    """Return the offsets to the boxes within shells boxes of (and including) a box"""
+    if shells not in _STENCILS:
+        offsets = range(-shells, shells + 1)
+        _STENCILS[shells] = np.array(
+            list(itertools.product(offsets, repeat=3)), dtype=np.int64
+        )
+    return _STENCILS[shells]
+
+# Size of the pending region (and number of dead slots) that triggers a re-sort
+MIN_REBUILD = 256
+
+# Neighbour search backends: the boxes of the CellList or a periodic scipy cKDTree
+CELLS = "cells"
+KDTREE = "kdtree"
+BACKENDS = [CELLS, KDTREE]
+# Extra distance the KD-tree is searched to so no atoms are lost to rounding before the distances are checked
+TREE_SLACK = 1.0e-9
+# Extra thickness given to the halos of the slabs from slabDomains so no close pairs are lost to rounding
+HALO_SLACK = 1.0e-6
+# Every change to a CellList gets a new version so a CellListPool knows when its copy is out of date
+_VERSIONS = itertools.count()
+# Bits of the state of an endGroup in the EndGroupTable - an endGroup is free if neither is set
+BONDED = 1
+BLOCKED = 2
+
+
+def checkBackend(backend):
+    """Raise a RuntimeError if the neighbour search backend is unknown or can't be used"""
+    if backend not in BACKENDS:
+        msg = "Unknown neighbour search backend: {0}. Available backends are: {1}".format(
+            backend, BACKENDS
+        )
+        logger.critical(msg)
+        raise RuntimeError(msg)
+    if backend == KDTREE and xyz_core.cKDTree is None:
+        msg = "The {0} neighbour search backend requires scipy to be installed".format(
+            KDTREE
+        )
+        logger.critical(msg)
+        raise RuntimeError(msg)
+    return
+
+
+class CellList(object):
+    """Spatial hash of all the atoms in a cell.
+
+    Every atom occupies a slot in a set of flat arrays that hold the handle of the block it belongs to,
+    its index within that block, its coordinate and the box it sits in. The slots are sorted by box
+    with a counting sort, so the atoms in any box are found from the cellStart and cellCount arrays and
+    the atoms surrounding a point are gathered with a single vectorised pass over the 27-box stencil.
+
+    Atoms added since the last sort sit in a pending region that is searched separately, so adding and
+    removing a trial block only touches that block's atoms. The sorted region is rebuilt once the pending
+    region or the number of removed atoms grows large.
+
+    Searches can also be made with a periodic KD-tree (the KDTREE backend), which doesn't depend on the box
+    size so copes better with cutoffs much larger or smaller than boxSize. The tree covers the sorted region
+    and is kept until the sorted region changes, while the pending region gets a small tree of its own.
+    """
+
+    def __init__(self, boxSize, dim, pbc):
+        assert boxSize > 0, "CellList needs a positive boxSize: {0}".format(boxSize)
+        self.boxSize = float(boxSize)
+        self.dim = np.array(dim, dtype=np.float64)
+        self.pbc = np.array(pbc, dtype=bool)
+        # Along periodic axes the last box absorbs any remainder so that no box is narrower than boxSize,
+        # otherwise atoms either side of the boundary could be within boxSize but not in neighbouring boxes
+        self.numBoxes = np.array(
+            [
+                max(1, int(math.floor(d / self.boxSize) if p else math.ceil(d / self.boxSize)))
+                for d, p in zip(self.dim, self.pbc)
+            ],
+            dtype=np.int64,
+        )
+        self._stride = np.array(
+            [self.numBoxes[1] * self.numBoxes[2], self.numBoxes[2], 1], dtype=np.int64
+        )
+        # If there are fewer than 3 boxes along a periodic axis the halo visits boxes twice
+        self._haloDuplicates = bool(np.any(self.numBoxes < 3))
+        self.numCells = int(np.prod(self.numBoxes))
+
+        # Per-slot data
+        self.handle = np.empty(0, dtype=np.int64)
+        self.atomIdx = np.empty(0, dtype=np.int64)
+        self.coords = np.empty((0, 3), dtype=np.float64)
+        self.radius = np.empty(0, dtype=np.float64)
+        self.box = np.empty(0, dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+        self._size = 0  # Number of slots in use
+        self._numSorted = 0  # Slots below this index are in the sorted region
+        self._numDead = 0
+
+        # Sorted region
+        self.order = np.empty(0, dtype=np.int64)
+        self.cellStart = np.zeros(self.numCells, dtype=np.int64)
+        self.cellCount = np.zeros(self.numCells, dtype=np.int64)
+
+        self._handleCount = 0
+        self._handleKeys = np.empty(0, dtype=np.int64)  # handle -> block key
+        self._blockSlots = {}  # block key -> (handle, first slot, number of atoms)
+        self._tree = None  # KD-tree of the sorted region, created when first needed
+        self._version = next(_VERSIONS)  # Changes whenever the atoms do (see CellListPool)
+        return
+
+    def __getstate__(self):
+        # The KD-tree is cheap to recreate so there's no need to pickle it
+        d = dict(self.__dict__)
+        d["_tree"] = None
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self._tree = None  # Hack for older versions with no KD-tree
+        self._version = next(_VERSIONS)
+        return
+
+    def __len__(self):
+        return self._size - self._numDead
+
+    def __contains__(self, key):
+        return key in self._blockSlots
+
+    def add(self, key, coords, radii=None, atomIdx=None):
+        """Add the atoms of the block with the given (integer) key
+
+        atomIdx holds the indices of the atoms within the block if they are not simply 0 to len(coords)
+        """
+        if key in self._blockSlots:
+            raise RuntimeError("CellList already contains block: {0}".format(key))
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        natoms = len(coords)
+        self._reserve(self._size + natoms)
+        start, end = self._size, self._size + natoms
+        handle = self._handleCount
+        self._handleCount += 1
+        if handle >= len(self._handleKeys):
+            self._handleKeys = np.resize(self._handleKeys, max(64, 2 * handle))
+        self._handleKeys[handle] = key
+        self.handle[start:end] = handle
+        self.atomIdx[start:end] = np.arange(natoms) if atomIdx is None else atomIdx
+        self.coords[start:end] = coords
+        self.radius[start:end] = 0.0 if radii is None else radii
+        self.box[start:end] = self.flatten(self.boxes(coords))
+        self.alive[start:end] = True
+        self._size = end
+        self._blockSlots[key] = (handle, start, natoms)
+        self._version = next(_VERSIONS)
+        return
+
+    def blockKeys(self, slots):
+        """Return an array of the keys of the blocks the given slots belong to"""
+        return self._handleKeys[self.handle[slots]]
+
+    def boxes(self, coords):
+        """Return an (n, 3) array of the boxes the coordinates are in.
+
+        Coordinates along periodic axes are wrapped into the cell. Coordinates beyond the last box are clamped
+        into it, which keeps atoms that are within boxSize of each other in neighbouring boxes.
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        coords = np.where(self.pbc, np.remainder(coords, self.dim), coords)
+        boxes = np.floor(coords / self.boxSize).astype(np.int64)
+        return np.clip(boxes, 0, self.numBoxes - 1)
+
+    def flatten(self, boxes):
+        """Convert box triples to flat box indices"""
+        return np.dot(boxes, self._stride)
+
+    def clashes(self, coords, radii, margin, exclude=None, backend=CELLS):
+        """Return all atoms that are within the sum of their radii plus margin of the coordinates.
+
+        Args:
+        coords: (n, 3) array of coordinates
+        radii: (n,) array of the radii of the atoms at the coordinates
+        margin: distance added to the sum of the two radii
+        exclude: the key of a block whose atoms should be ignored
+        backend: the neighbour search backend (CELLS or KDTREE)
+
+        Returns:
+        A tuple of arrays (idxCoord, slots) in the same order as neighbours
+        """
+        radii = np.asarray(radii, dtype=np.float64).reshape(-1)
+        maxRadius = np.max(self.radius[: self._size]) if self._size else 0.0
+        idxCoord, slots, distances = self.within(
+            coords, radii + maxRadius + margin, exclude=exclude, backend=backend
+        )
+        mask = distances <= radii[idxCoord] + self.radius[slots] + margin
+        return idxCoord[mask], slots[mask]
+
+    def halo(self, boxes, shells=1):
+        """Return an (n, 27) array of the flat indices of the boxes surrounding each box.
+
+        Boxes that lie outside non-periodic walls, or that have already been visited, are set to -1.
+        With shells > 1 the halo extends that many boxes out in each direction, giving (2*shells+1)**3 boxes.
+        """
+        halo = boxes[:, np.newaxis, :] + stencil(shells)[np.newaxis, :, :]
+        valid = np.ones(halo.shape[:2], dtype=bool)
+        for i in range(3):
+            if self.pbc[i]:
+                halo[:, :, i] %= self.numBoxes[i]
+            else:
+                valid &= (halo[:, :, i] >= 0) & (halo[:, :, i] < self.numBoxes[i])
+        flat = np.where(valid, self.flatten(halo), -1)
+        if self._haloDuplicates or np.any(self.numBoxes < 2 * shells + 1):
+            flat.sort(axis=1)
+            flat[:, 1:][flat[:, 1:] == flat[:, :-1]] = -1
+        return flat
+
+    def neighbours(self, coords, exclude=None, shells=1):
+        """Return all atoms in the boxes surrounding the coordinates.
+
+        Args:
+        coords: (n, 3) array of coordinates
+        exclude: the key of a block whose atoms should be ignored
+        shells: the number of boxes out from the box of each coordinate to search
+
+        Returns:
+        A tuple of arrays (idxCoord, slots), ordered by idxCoord and then by the order the atoms were added
+        """
+        self._maybeRebuild()
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        halo = self.halo(self.boxes(coords), shells=shells)
+        idxCoord = np.repeat(np.arange(len(coords)), halo.shape[1])
+        halo = halo.ravel()
+        mask = halo >= 0
+        return self._gather(idxCoord[mask], halo[mask], exclude=exclude)
+
+    def slotsInBoxes(self, flatBoxes, exclude=None):
+        """Return the slots of all atoms in the given flat boxes"""
+        self._maybeRebuild()
+        flatBoxes = np.unique(np.asarray(flatBoxes, dtype=np.int64))
+        _, slots = self._gather(np.zeros(len(flatBoxes), dtype=np.int64), flatBoxes, exclude=exclude)
+        return slots
+
+    def within(self, coords, cutoff, exclude=None, backend=CELLS):
+        """Return all atoms that are within cutoff of the coordinates.
+
+        Args:
+        coords: (n, 3) array of coordinates
+        cutoff: the distance, or (n,) array of distances for each coordinate, within which atoms are returned
+        exclude: the key of a block whose atoms should be ignored
+        backend: the neighbour search backend (CELLS or KDTREE)
+
+        Returns:
+        A tuple of arrays (idxCoord, slots, distances) in the same order as neighbours
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        cutoff = np.broadcast_to(np.asarray(cutoff, dtype=np.float64), (len(coords),))
+        if not len(coords) or not len(self):
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0)
+        if backend == KDTREE:
+            idxCoord, slots = self._treeWithin(coords, np.max(cutoff), exclude=exclude)
+        else:
+            checkBackend(backend)
+            idxCoord, slots = self._cellsWithin(coords, cutoff, exclude=exclude)
+        # The distances are calculated the same way for both backends so that they give identical results
+        distances = xyz_core.distance(
+            coords[idxCoord], self.coords[slots], dim=self.dim, pbc=self.pbc
+        )
+        mask = distances <= cutoff[idxCoord]
+        return idxCoord[mask], slots[mask], distances[mask]
+
+    def _cellsWithin(self, coords, cutoff, exclude=None):
+        """Return (idxCoord, slots) for all atoms in the boxes that cover the cutoffs of the coordinates"""
+        # Coordinates with cutoffs spanning different numbers of boxes are searched separately
+        shells = np.maximum(1, np.ceil(cutoff / self.boxSize).astype(np.int64))
+        if np.all(shells == shells[0]):
+            idxCoord, slots = self.neighbours(
+                coords, exclude=exclude, shells=int(shells[0])
+            )
+        else:
+            idxCoord, slots = [], []
+            for shell in np.unique(shells).tolist():
+                todo = np.flatnonzero(shells == shell)
+                idx, s = self.neighbours(coords[todo], exclude=exclude, shells=shell)
+                idxCoord.append(todo[idx])
+                slots.append(s)
+            idxCoord, slots = np.concatenate(idxCoord), np.concatenate(slots)
+            order = np.lexsort((slots, idxCoord))
+            idxCoord, slots = idxCoord[order], slots[order]
+        return idxCoord, slots
+
+    def pairs(self, cutoff, backend=CELLS):
+        """Return every pair of atoms that are less than cutoff apart.
+
+        The slots are compacted first, so they are in the order the blocks were added.
+
+        Args:
+        cutoff: the maximum distance between the two atoms
+        backend: the neighbour search backend (CELLS or KDTREE)
+
+        Returns:
+        A tuple of arrays (slots1, slots2, distances), with slots1 < slots2 and ordered by slots1 then slots2
+        """
+        self.rebuild()
+        if backend == KDTREE:
+            tree = self._kdTree()
+            pairs = tree.query_pairs(cutoff + TREE_SLACK, output_type="ndarray")
+            slots1, slots2 = pairs[:, 0].astype(np.int64), pairs[:, 1].astype(np.int64)
+            order = np.lexsort((slots2, slots1))
+            slots1, slots2 = slots1[order], slots2[order]
+        else:
+            checkBackend(backend)
+            slots = np.arange(len(self))
+            shells = max(1, int(math.ceil(cutoff / self.boxSize)))
+            idx, slots2 = self.neighbours(self.coords[slots], shells=shells)
+            slots1 = slots[idx]
+            mask = slots1 < slots2
+            slots1, slots2 = slots1[mask], slots2[mask]
+        distances = xyz_core.distance(
+            self.coords[slots1], self.coords[slots2], dim=self.dim, pbc=self.pbc
+        )
+        mask = distances < cutoff
+        return slots1[mask], slots2[mask], distances[mask]
+
+    def _kdTree(self):
+        """Return the KD-tree of the sorted region, creating it if needed"""
+        if self._tree is None:
+            self._tree = xyz_core.kdTree(
+                self.coords[: self._numSorted], dim=self.dim, pbc=self.pbc
+            )
+        return self._tree
+
+    def _treeWithin(self, coords, cutoff, exclude=None):
+        """Return (idxCoord, slots) for all atoms within cutoff of the coordinates, ordered as for neighbours"""
+        self._maybeRebuild()
+        cutoff += TREE_SLACK
+        query = xyz_core.kdTree(coords, dim=self.dim, pbc=self.pbc)
+        found = [
+            query.sparse_distance_matrix(self._kdTree(), cutoff, output_type="ndarray")
+        ]
+        if self._size > self._numSorted:
+            # The pending region is small so gets a tree of its own on every query
+            pending = xyz_core.kdTree(
+                self.coords[self._numSorted : self._size], dim=self.dim, pbc=self.pbc
+            )
+            found.append(
+                query.sparse_distance_matrix(pending, cutoff, output_type="ndarray")
+            )
+            found[-1]["j"] += self._numSorted
+        found = np.concatenate(found)
+        idxCoord, slots = found["i"].astype(np.int64), found["j"].astype(np.int64)
+        mask = self.alive[slots]
+        if exclude is not None and exclude in self._blockSlots:
+            mask &= self.handle[slots] != self._blockSlots[exclude][0]
+        idxCoord, slots = idxCoord[mask], slots[mask]
+        order = np.lexsort((slots, idxCoord))
+        return idxCoord[order], slots[order]
+
+    def remove(self, key):
+        """Remove the atoms of the block with the given key"""
+        handle, start, natoms = self._blockSlots.pop(key)
+        end = start + natoms
+        if start >= self._numSorted and end == self._size:
+            # The last block added so just drop it from the pending region
+            self._size = start
+        else:
+            self.alive[start:end] = False
+            self._numDead += natoms
+        self._version = next(_VERSIONS)
+        return
+
+    def slots(self, key):
+        """Return an array of the slots holding the atoms of the block with the given key"""
+        handle, start, natoms = self._blockSlots[key]
+        return np.arange(start, start + natoms)
+
+    def updateCoords(self, keys, coords):
+        """Set new coordinates for the atoms of the given blocks and rebin the atoms that have changed box.
+
+        Only the atoms that have moved into a different box are rebinned. Moved atoms in the sorted region are
+        taken out of the sorted order and inserted back at the position of their new box, so there is no need
+        for a full re-sort when (as after a short MD run) only a small fraction of the atoms change box.
+
+        Args:
+        keys: the keys of the blocks whose atoms have moved
+        coords: (n, 3) array of the new coordinates of all the atoms of the blocks, in the order of the keys
+
+        Returns:
+        The number of atoms that changed box
+        """
+        if not len(keys):
+            return 0
+        starts, counts = np.array(
+            [self._blockSlots[key][1:] for key in keys], dtype=np.int64
+        ).T
+        slots = self._expand(starts, counts)
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        if len(coords) != len(slots):
+            raise RuntimeError(
+                "updateCoords got {0} coordinates for {1} atoms".format(
+                    len(coords), len(slots)
+                )
+            )
+        self.coords[slots] = coords
+        self._tree = None
+        self._version = next(_VERSIONS)
+        boxes = self.flatten(self.boxes(coords))
+        moved = boxes != self.box[slots]
+        slots, boxes = slots[moved], boxes[moved]
+        # The pending region is sorted by box whenever it is searched, so only the sorted region needs fixing
+        inSorted = slots < self._numSorted
+        if np.any(inSorted):
+            sslots, sboxes = slots[inSorted], boxes[inSorted]
+            self.cellCount -= np.bincount(self.box[sslots], minlength=self.numCells)
+            self.cellCount += np.bincount(sboxes, minlength=self.numCells)
+            self.cellStart = np.cumsum(self.cellCount) - self.cellCount
+            isMoved = np.zeros(self._numSorted, dtype=bool)
+            isMoved[sslots] = True
+            order = self.order[~isMoved[self.order]]
+            sort = np.argsort(sboxes, kind="mergesort")
+            positions = np.searchsorted(self.box[order], sboxes[sort], side="right")
+            self.order = np.insert(order, positions, sslots[sort])
+        self.box[slots] = boxes
+        return len(slots)
+
+    def _expand(self, starts, counts):
+        """Return the indices covered by the ranges starts[i]:starts[i]+counts[i]"""
+        total = np.sum(counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.repeat(starts, counts) + offsets
+
+    def _gather(self, idxQuery, flatBoxes, exclude=None):
+        """Return (idxQuery, slots) for all atoms within the boxes paired with each query"""
+        # Sorted region
+        counts = self.cellCount[flatBoxes]
+        slots = self.order[self._expand(self.cellStart[flatBoxes], counts)]
+        idx = np.repeat(idxQuery, counts)
+        # Pending region - sort it by box and search it the same way
+        if self._size > self._numSorted:
+            pending = np.arange(self._numSorted, self._size)
+            pending = pending[np.argsort(self.box[pending], kind="mergesort")]
+            pboxes = self.box[pending]
+            pstart = np.searchsorted(pboxes, flatBoxes, side="left")
+            pcounts = np.searchsorted(pboxes, flatBoxes, side="right") - pstart
+            slots = np.concatenate((slots, pending[self._expand(pstart, pcounts)]))
+            idx = np.concatenate((idx, np.repeat(idxQuery, pcounts)))
+        mask = self.alive[slots]
+        if exclude is not None and exclude in self._blockSlots:
+            mask &= self.handle[slots] != self._blockSlots[exclude][0]
+        idx, slots = idx[mask], slots[mask]
+        order = np.lexsort((slots, idx))
+        return idx[order], slots[order]
+
+    def _maybeRebuild(self):
+        threshold = max(MIN_REBUILD, self._numSorted // 8)
+        if self._size - self._numSorted > threshold or self._numDead > threshold:
+            self.rebuild()
+        return
+
+    def rebuild(self):
+        """Compact the slots and counting-sort them all into the sorted region"""
+        keep = np.flatnonzero(self.alive[: self._size])
+        if len(keep) != self._size:
+            remap = np.full(self._size, -1, dtype=np.int64)
+            remap[keep] = np.arange(len(keep))
+            for key, (handle, start, natoms) in self._blockSlots.items():
+                self._blockSlots[key] = (handle, int(remap[start]), natoms)
+            self.handle[: len(keep)] = self.handle[keep]
+            self.atomIdx[: len(keep)] = self.atomIdx[keep]
+            self.coords[: len(keep)] = self.coords[keep]
+            self.radius[: len(keep)] = self.radius[keep]
+            self.box[: len(keep)] = self.box[keep]
+            self.alive[: len(keep)] = True
+        self._size = self._numSorted = len(keep)
+        self._numDead = 0
+        box = self.box[: self._size]
+        self.cellCount = np.bincount(box, minlength=self.numCells)
+        self.cellStart = np.cumsum(self.cellCount) - self.cellCount
+        self.order = np.argsort(box, kind="mergesort")
+        self._tree = None
+        self._version = next(_VERSIONS)
+        return
+
+    def _reserve(self, size):
+        """Make sure the slot arrays can hold size atoms"""
+        capacity = len(self.handle)
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 64)
+        used = self._size
+        for name in ["handle", "atomIdx", "box", "alive", "coords", "radius"]:
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:used] = old[:used]
+            setattr(self, name, new)
+        return
+
+
+class EndGroupIndex(object):
+    """Spatial index of the free endGroups of the blocks in a cell.
+
+    The endGroup atoms of each block are held in a CellList keyed by the block. Blocks are queued when they are
+    added and only binned when the index is next queried, so blocks that are added and removed again while
+    trying out placements cost next to nothing. As bonding, deleting and moving blocks all remove the blocks
+    from the cell and add them back, the index is kept up to date without ever being rebuilt from scratch.
+    """
+
+    def __init__(self, boxSize, dim, pbc):
+        self.cellList = CellList(boxSize, dim, pbc)
+        self._pending = collections.OrderedDict()  # block key -> block waiting to be binned
+        return
+
+    def __len__(self):
+        self.update()
+        return len(self.cellList)
+
+    def add(self, key, block):
+        """Queue the free endGroups of the block with the given key for adding to the index"""
+        self._pending[key] = block
+        return
+
+    def remove(self, key):
+        """Remove the free endGroups of the block with the given key"""
+        if self._pending.pop(key, None) is None and key in self.cellList:
+            self.cellList.remove(key)
+        return
+
+    def update(self):
+        """Bin the free endGroups of all the queued blocks"""
+        for key, block in self._pending.items():
+            # Several endGroups can share an atom so keep each atom once in the order of the endGroups
+            idxAtoms = list(
+                collections.OrderedDict.fromkeys(
+                    endGroup.endGroupIdx() for endGroup in block.freeEndGroups()
+                )
+            )
+            if not idxAtoms:
+                continue
+            self.cellList.add(key, block.coords()[idxAtoms], atomIdx=idxAtoms)
+        self._pending.clear()
+        return
+
+    def updateCoords(self, blocks):
+        """Update the coordinates of the endGroups of the blocks after the blocks have been moved in place.
+
+        Args:
+        blocks: a dictionary mapping the block keys to the blocks
+        """
+        cl = self.cellList
+        keys = [key for key in blocks if key in cl]
+        if keys:
+            coords = np.concatenate(
+                [blocks[key].coords()[cl.atomIdx[cl.slots(key)]] for key in keys]
+            )
+            cl.updateCoords(keys, coords)
+        return
+
+    def pairs(self, cutoff, backend=CELLS):
+        """Return every pair of free endGroup atoms that are less than cutoff apart.
+
+        Each pair is returned once, with the first member the one whose block was added to the index first.
+
+        Args:
+        cutoff: the maximum distance between the two atoms
+        backend: the neighbour search backend (CELLS or KDTREE)
+
+        Returns:
+        A tuple of arrays (idxBlock1, idxAtom1, idxBlock2, idxAtom2, distances) holding the block keys and the
+        indices of the atoms within the blocks.
+        """
+        self.update()
+        cl = self.cellList
+        slots1, slots2, distances = cl.pairs(cutoff, backend=backend)
+        keys1, atoms1 = cl.blockKeys(slots1), cl.atomIdx[slots1]
+        keys2, atoms2 = cl.blockKeys(slots2), cl.atomIdx[slots2]
+        return keys1, atoms1, keys2, atoms2, distances
+
+
+class BlockSphereIndex(object):
+    """Spatial index of the bounding spheres of the blocks in a cell.
+
+    The centroid of each block is held in a CellList together with the radius of the block (which includes the
+    radius of its largest atom), so the blocks that could be in contact with a block are found without looking
+    at any atoms. As with the EndGroupIndex, blocks are queued when they are added and only binned when the
+    index is next queried.
+    """
+
+    def __init__(self, boxSize, dim, pbc):
+        self.cellList = CellList(boxSize, dim, pbc)
+        self._pending = collections.OrderedDict()  # block key -> block waiting to be binned
+        return
+
+    def __len__(self):
+        self.update()
+        return len(self.cellList)
+
+    def add(self, key, block):
+        """Queue the block with the given key for adding to the index"""
+        self._pending[key] = block
+        return
+
+    def remove(self, key):
+        """Remove the block with the given key"""
+        if self._pending.pop(key, None) is None and key in self.cellList:
+            self.cellList.remove(key)
+        return
+
+    def update(self):
+        """Bin the bounding spheres of all the queued blocks"""
+        for key, block in self._pending.items():
+            self.cellList.add(key, block.centroid(), radii=block.blockRadius())
+        self._pending.clear()
+        return
+
+    def updateCoords(self, blocks):
+        """Update the bounding spheres of the blocks after the blocks have been moved in place.
+
+        Args:
+        blocks: a dictionary mapping the block keys to the blocks
+        """
+        cl = self.cellList
+        keys = [key for key in blocks if key in cl]
+        if keys:
+            cl.updateCoords(keys, [blocks[key].centroid() for key in keys])
+            slots = np.concatenate([cl.slots(key) for key in keys])
+            cl.radius[slots] = [blocks[key].blockRadius() for key in keys]
+        return
+
+    def overlapping(self, centres, radii, margin, exclude=None):
+        """Return every block whose bounding sphere comes within margin of one of the given spheres.
+
+        Args:
+        centres: (n, 3) array of the centres of the spheres
+        radii: (n,) array of the radii of the spheres
+        margin: distance added to the sum of the two radii
+        exclude: the key of a block that should be ignored
+
+        Returns:
+        A tuple of arrays (idxSphere, keys, centroids, radii) with an entry for each overlapping pair, where
+        the centroids and radii are those of the blocks
+        """
+        self.update()
+        cl = self.cellList
+        centres = np.asarray(centres, dtype=np.float64).reshape(-1, 3)
+        radii = np.asarray(radii, dtype=np.float64).reshape(-1)
+        if not len(cl) or not len(centres):
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty((0, 3)), np.empty(0)
+        alive = np.flatnonzero(cl.alive[: cl._size])
+        reach = np.max(radii) + np.max(cl.radius[alive]) + margin
+        shells = max(1, int(math.ceil(reach / cl.boxSize)))
+        if len(alive) <= len(stencil(shells)) or np.all(2 * shells + 1 >= cl.numBoxes):
+            # There are fewer blocks than boxes in the halo, or the halo would cover every box, so just check
+            # all the blocks
+            if exclude is not None and exclude in cl:
+                alive = alive[cl.handle[alive] != cl._blockSlots[exclude][0]]
+            idx = np.repeat(np.arange(len(centres)), len(alive))
+            slots = np.tile(alive, len(centres))
+        else:
+            idx, slots = cl.neighbours(centres, exclude=exclude, shells=shells)
+        distances = xyz_core.distance(
+            centres[idx], cl.coords[slots], dim=cl.dim, pbc=cl.pbc
+        )
+        mask = distances <= radii[idx] + cl.radius[slots] + margin
+        idx, slots = idx[mask], slots[mask]
+        return idx, cl.blockKeys(slots), cl.coords[slots], cl.radius[slots]
+
+
+class EndGroupTypeRegistry(object):
+    """Registry of the blocks in a cell that have free endGroups of each endGroup type.
+
+    For each type the keys of the blocks are held in a list, together with a dictionary mapping each key to its
+    position in the list. A block is removed by moving the last key in the list into its place, so adding and
+    removing blocks and picking a random block of a type all take constant time. As bonding and deleting
+    fragments always remove the blocks from the cell and add them back, the registry is kept up to date by
+    the Cell's addBlock and delBlock.
+    """
+
+    def __init__(self):
+        self._keys = collections.OrderedDict()  # endGroup type -> list of block keys
+        self._positions = {}  # endGroup type -> {block key: position in the list of keys}
+        self._blockTypes = {}  # block key -> endGroup types the block is registered under
+        return
+
+    def __contains__(self, endGroupType):
+        return endGroupType in self._keys
+
+    def __len__(self):
+        return len(self._blockTypes)
+
+    def add(self, key, endGroupTypes):
+        """Register the block with the given key under each of the given free endGroup types"""
+        if key in self._blockTypes:
+            raise RuntimeError(
+                "EndGroupTypeRegistry already contains block: {0}".format(key)
+            )
+        endGroupTypes = list(endGroupTypes)
+        if not endGroupTypes:
+            return
+        self._blockTypes[key] = endGroupTypes
+        for endGroupType in endGroupTypes:
+            if endGroupType not in self._keys:
+                self._keys[endGroupType] = []
+                self._positions[endGroupType] = {}
+            self._positions[endGroupType][key] = len(self._keys[endGroupType])
+            self._keys[endGroupType].append(key)
+        return
+
+    def count(self, endGroupType):
+        """Return the number of blocks with a free endGroup of the given type"""
+        return len(self._keys.get(endGroupType, []))
+
+    def keys(self, endGroupType):
+        """Return a list of the keys of the blocks with a free endGroup of the given type"""
+        return list(self._keys.get(endGroupType, []))
+
+    def remove(self, key):
+        """Remove the block with the given key"""
+        for endGroupType in self._blockTypes.pop(key, []):
+            keys = self._keys[endGroupType]
+            positions = self._positions[endGroupType]
+            i = positions.pop(key)
+            last = keys.pop()
+            if last != key:
+                keys[i] = last
+                positions[last] = i
+            if not keys:
+                del self._keys[endGroupType]
+                del self._positions[endGroupType]
+        return
+
+    def sample(self, endGroupType, exclude=None):
+        """Return the key of a random block with a free endGroup of the given type.
+
+        Args:
+        endGroupType: the endGroup type
+        exclude: the key of a block that shouldn't be picked
+
+        Returns:
+        The key of the block or None if there isn't one
+        """
+        keys = self._keys.get(endGroupType, [])
+        n = len(keys)
+        if exclude is not None and exclude in self._positions.get(endGroupType, {}):
+            # Pick from the other blocks by skipping over the excluded one
+            if n < 2:
+                return None
+            i = _random.randrange(n - 1)
+            if i >= self._positions[endGroupType][exclude]:
+                i += 1
+            return keys[i]
+        if not n:
+            return None
+        return keys[_random.randrange(n)]
+
+    def types(self):
+        """Return a list of the endGroup types that are free in at least one block, in the order registered"""
+        return list(self._keys.keys())
+
+
+class EndGroupTable(object):
+    """Table of all the endGroups of the blocks in a cell held as a struct of arrays.
+
+    Each endGroup occupies a row of a set of flat arrays holding the id of its endGroup type, the key of its block,
+    the id of its fragment, the block indices of its endGroup and cap atoms and a bitmask of its BONDED and
+    BLOCKED state, so queries over all the endGroups in the cell are vectorised filters of the arrays. The rows of
+    a block are in the order of its fragments and their endGroups, and the EndGroup objects are held in an object
+    array alongside so that rows can be turned back into endGroups.
+
+    As for the EndGroupIndex, blocks are queued when they are added and only flattened into rows when the table
+    is next queried, and the rows of removed blocks are dropped when there are enough of them. The number of free
+    endGroups is kept up to date as blocks are added and removed, so counting them never needs the rows.
+    """
+
+    def __init__(self):
+        self.typeNames = []  # endGroup type id -> endGroup type
+        self._typeIds = {}  # endGroup type -> endGroup type id
+        # Per-row data
+        self.typeId = np.empty(0, dtype=np.int32)
+        self.blockKey = np.empty(0, dtype=np.int64)
+        self.fragmentId = np.empty(0, dtype=np.int64)
+        self.endGroupIdx = np.empty(0, dtype=np.int64)
+        self.capIdx = np.empty(0, dtype=np.int64)
+        self.state = np.empty(0, dtype=np.uint8)
+        self.alive = np.empty(0, dtype=bool)
+        self.endGroups = np.empty(0, dtype=object)
+        self._size = 0  # Number of rows in use
+        self._numDead = 0
+        self._numFragments = 0  # Fragment ids are allocated as blocks are flattened
+        self._blockRows = {}  # block key -> (first row, number of rows)
+        self._pending = collections.OrderedDict()  # block key -> block waiting to be flattened
+        self._blockFree = {}  # block key -> number of free endGroups
+        self._numFree = 0
+        return
+
+    def __len__(self):
+        self.update()
+        return self._size - self._numDead
+
+    def __contains__(self, key):
+        return key in self._blockFree
+
+    def add(self, key, block):
+        """Queue the endGroups of the block with the given key for adding to the table"""
+        if key in self._blockFree:
+            raise RuntimeError("EndGroupTable already contains block: {0}".format(key))
+        self._pending[key] = block
+        self._blockFree[key] = block.numFreeEndGroups()
+        self._numFree += self._blockFree[key]
+        return
+
+    def remove(self, key):
+        """Remove the endGroups of the block with the given key"""
+        self._numFree -= self._blockFree.pop(key, 0)
+        if self._pending.pop(key, None) is None and key in self._blockRows:
+            start, nrows = self._blockRows.pop(key)
+            self.alive[start : start + nrows] = False
+            self._numDead += nrows
+        return
+
+    def numFree(self):
+        """Return the number of free endGroups"""
+        return self._numFree
+
+    def free(self, endGroupTypes=None):
+        """Return the rows of the free endGroups, optionally only those of the given endGroup types"""
+        self.update()
+        mask = self.alive[: self._size] & (self.state[: self._size] == 0)
+        if endGroupTypes is not None:
+            if isinstance(endGroupTypes, str):
+                endGroupTypes = [endGroupTypes]
+            ids = [self._typeIds[t] for t in endGroupTypes if t in self._typeIds]
+            mask &= np.isin(self.typeId[: self._size], ids)
+        return np.flatnonzero(mask)
+
+    def freeCounts(self):
+        """Return an OrderedDict mapping each endGroup type with free endGroups to the number that are free"""
+        # free() can reallocate the arrays, so it must be called before they are indexed
+        rows = self.free()
+        counts = np.bincount(self.typeId[rows], minlength=len(self.typeNames))
+        return collections.OrderedDict(
+            (self.typeNames[i], int(counts[i])) for i in np.flatnonzero(counts)
+        )
+
+    def update(self):
+        """Flatten the endGroups of all the queued blocks into rows"""
+        if not self._pending:
+            return
+        if self._numDead > max(MIN_REBUILD, self._size // 2):
+            self._compact()
+        rows = []
+        for key, block in self._pending.items():
+            start = self._size + len(rows)
+            for fragment in block.fragments:
+                fragmentId = self._numFragments
+                self._numFragments += 1
+                for endGroup in fragment.endGroups():
+                    endGroupType = endGroup.type()
+                    if endGroupType not in self._typeIds:
+                        self._typeIds[endGroupType] = len(self.typeNames)
+                        self.typeNames.append(endGroupType)
+                    rows.append(
+                        (
+                            self._typeIds[endGroupType],
+                            key,
+                            fragmentId,
+                            endGroup.endGroupIdx(),
+                            endGroup.capIdx(),
+                            BONDED * endGroup.bonded + BLOCKED * endGroup.blocked,
+                            endGroup,
+                        )
+                    )
+            self._blockRows[key] = (start, self._size + len(rows) - start)
+        self._pending.clear()
+        if not rows:
+            return
+        start, end = self._size, self._size + len(rows)
+        self._reserve(end)
+        columns = list(zip(*rows))
+        self.typeId[start:end] = columns[0]
+        self.blockKey[start:end] = columns[1]
+        self.fragmentId[start:end] = columns[2]
+        self.endGroupIdx[start:end] = columns[3]
+        self.capIdx[start:end] = columns[4]
+        self.state[start:end] = columns[5]
+        self.alive[start:end] = True
+        self.endGroups[start:end] = columns[6]
+        self._size = end
+        return
+
+    def _compact(self):
+        """Drop the rows of the removed blocks"""
+        keep = np.flatnonzero(self.alive[: self._size])
+        remap = np.full(self._size, -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        for key, (start, nrows) in self._blockRows.items():
+            if nrows:
+                self._blockRows[key] = (int(remap[start]), nrows)
+        for name in self._columns():
+            array = getattr(self, name)
+            array[: len(keep)] = array[keep]
+        self.endGroups[len(keep) : self._size] = None
+        self._size = len(keep)
+        self._numDead = 0
+        return
+
+    def _columns(self):
+        return [
+            "typeId",
+            "blockKey",
+            "fragmentId",
+            "endGroupIdx",
+            "capIdx",
+            "state",
+            "alive",
+            "endGroups",
+        ]
+
+    def _reserve(self, size):
+        """Make sure the row arrays can hold size endGroups"""
+        capacity = len(self.typeId)
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 64)
+        for name in self._columns():
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[: self._size] = old[: self._size]
+            setattr(self, name, new)
+        return
+
+
+class CellListPool(object):
+    """A pool of processes that search a read-only copy of a CellList held in shared memory.
+
+    The slot and box arrays of the CellList are copied into buffers that were shared with the processes when
+    they started, so a search only sends the processes the coordinates to search around. The copy is only
+    made when the CellList has changed since the last search. The buffers are sized for the CellList they
+    were created for and the processes are restarted with larger buffers when it outgrows them.
+
+    The pool can also be used to map functions that don't need the CellList (see map).
+    """
+
+    def __init__(self, processes):
+        self.processes = processes
+        self._pool = None
+        self._buffers = None
+        self._arrays = None
+        self._capacity = 0
+        self._numCells = 0
+        self._version = None  # The version of the CellList in the buffers
+        self._header = None
+        return
+
+    def close(self):
+        """Close the pool and wait for the processes to finish"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        return
+
+    def clashes(self, cellList, coords, radii, margin, backend=CELLS):
+        """Return the same result as cellList.clashes, splitting the coordinates across the processes"""
+        radii = np.asarray(radii, dtype=np.float64).reshape(-1)
+        header = self.publish(cellList)
+        chunks = self._chunks(len(radii))
+        results = self._pool.map(
+            _poolClashes,
+            [(header, coords[c], radii[c], margin, backend) for c in chunks],
+        )
+        idxCoord = np.concatenate([c[idx] for c, (idx, _) in zip(chunks, results)])
+        slots = np.concatenate([r[1] for r in results])
+        return idxCoord.astype(np.int64), slots.astype(np.int64)
+
+    def map(self, func, args):
+        """Call func with each of args in the processes and return the list of results"""
+        if self._pool is None:
+            self._start(0, 0)
+        return self._pool.map(func, args)
+
+    def publish(self, cellList):
+        """Copy the CellList into the shared buffers if it has changed and return the header describing it.
+
+        The sorted region is rebuilt first if it is due to be, so that the processes never need to change
+        their copy.
+        """
+        cellList._maybeRebuild()
+        if self._version == cellList._version and self._pool is not None:
+            return self._header
+        size, numSorted = cellList._size, cellList._numSorted
+        if size > self._capacity or cellList.numCells > self._numCells:
+            self._start(size, cellList.numCells)
+        arrays = self._arrays
+        arrays["coords"][:size] = cellList.coords[:size]
+        arrays["radius"][:size] = cellList.radius[:size]
+        arrays["box"][:size] = cellList.box[:size]
+        arrays["alive"][:size] = cellList.alive[:size]
+        arrays["order"][:numSorted] = cellList.order
+        arrays["cellStart"][: cellList.numCells] = cellList.cellStart
+        arrays["cellCount"][: cellList.numCells] = cellList.cellCount
+        self._version = cellList._version
+        self._header = {
+            "version": self._version,
+            "capacity": self._capacity,
+            "numCells": self._numCells,
+            "boxSize": cellList.boxSize,
+            "dim": cellList.dim,
+            "pbc": cellList.pbc,
+            "size": size,
+            "numSorted": numSorted,
+            "numDead": cellList._numDead,
+        }
+        return self._header
+
+    def within(self, cellList, coords, cutoff, backend=CELLS):
+        """Return the same result as cellList.within, splitting the coordinates across the processes"""
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        cutoff = np.broadcast_to(np.asarray(cutoff, dtype=np.float64), (len(coords),))
+        header = self.publish(cellList)
+        chunks = self._chunks(len(coords))
+        results = self._pool.map(
+            _poolWithin, [(header, coords[c], cutoff[c], backend) for c in chunks]
+        )
+        idxCoord = np.concatenate([c[idx] for c, (idx, _, _) in zip(chunks, results)])
+        slots = np.concatenate([r[1] for r in results])
+        distances = np.concatenate([r[2] for r in results])
+        return idxCoord.astype(np.int64), slots.astype(np.int64), distances
+
+    def _chunks(self, n):
+        """Split n coordinates into one contiguous chunk for each process"""
+        chunks = np.array_split(np.arange(n), self.processes)
+        return [c for c in chunks if len(c)] or [chunks[0]]
+
+    def _start(self, size, numCells):
+        """(Re)start the processes with buffers that can hold size slots and numCells boxes"""
+        self.close()
+        self._capacity = max(2 * size, 1024)
+        self._numCells = numCells
+        self._buffers = dict(
+            (name, multiprocessing.RawArray("b", nbytes))
+            for name, nbytes in _sharedLayout(self._capacity, self._numCells)
+        )
+        self._arrays = _sharedArrays(self._buffers, self._capacity, self._numCells)
+        self._version = None
+        self._pool = multiprocessing.Pool(
+            processes=self.processes,
+            initializer=_initPoolProcess,
+            initargs=(self._buffers,),
+        )
+        return
+
+
+# The buffers and the read-only CellList built on them in a CellListPool process
+_POOL_STATE = {}
+
+
+def _sharedLayout(capacity, numCells):
+    """Return (name, number of bytes) for each of the buffers a CellListPool shares with its processes"""
+    return [
+        (name, max(1, n * np.dtype(dtype).itemsize))
+        for name, dtype, n in _sharedShapes(capacity, numCells)
+    ]
+
+
+def _sharedShapes(capacity, numCells):
+    return [
+        ("coords", np.float64, 3 * capacity),
+        ("radius", np.float64, capacity),
+        ("box", np.int64, capacity),
+        ("alive", np.bool_, capacity),
+        ("order", np.int64, capacity),
+        ("cellStart", np.int64, numCells),
+        ("cellCount", np.int64, numCells),
+    ]
+
+
+def _sharedArrays(buffers, capacity, numCells):
+    """Return a dict of numpy arrays viewing the buffers shared by a CellListPool"""
+    arrays = {}
+    for name, dtype, n in _sharedShapes(capacity, numCells):
+        arrays[name] = np.frombuffer(buffers[name], dtype=dtype, count=n)
+    arrays["coords"] = arrays["coords"].reshape(-1, 3)
+    return arrays
+
+
+def _initPoolProcess(buffers):
+    """Keep the shared buffers when a CellListPool process starts"""
+    _POOL_STATE.clear()
+    _POOL_STATE["buffers"] = buffers
+    return
+
+
+def _poolCellList(header):
+    """Return the read-only CellList described by header in a CellListPool process"""
+    if _POOL_STATE.get("version") != header["version"]:
+        arrays = _sharedArrays(
+            _POOL_STATE["buffers"], header["capacity"], header["numCells"]
+        )
+        for array in arrays.values():
+            array.flags.writeable = False
+        size, numSorted = header["size"], header["numSorted"]
+        cellList = CellList(header["boxSize"], header["dim"], header["pbc"])
+        cellList.coords = arrays["coords"][:size]
+        cellList.radius = arrays["radius"][:size]
+        cellList.box = arrays["box"][:size]
+        cellList.alive = arrays["alive"][:size]
+        cellList.order = arrays["order"][:numSorted]
+        cellList.cellStart = arrays["cellStart"][: cellList.numCells]
+        cellList.cellCount = arrays["cellCount"][: cellList.numCells]
+        cellList._size = size
+        cellList._numSorted = numSorted
+        cellList._numDead = header["numDead"]
+        _POOL_STATE["cellList"] = cellList
+        _POOL_STATE["version"] = header["version"]
+    return _POOL_STATE["cellList"]
+
+
+def _poolClashes(args):
+    """Call CellList.clashes in a CellListPool process with a tuple of (header, coords, radii, margin, backend)"""
+    header, coords, radii, margin, backend = args
+    return _poolCellList(header).clashes(coords, radii, margin, backend=backend)
+
+
+def _poolWithin(args):
+    """Call CellList.within in a CellListPool process with a tuple of (header, coords, cutoff, backend)"""
+    header, coords, cutoff, backend = args
+    return _poolCellList(header).within(coords, cutoff, backend=backend)
+
+
+def slabDomains(coords, dim, pbc, ndomains, halo):
+    """Split the coordinates into slabs along the longest axis of the cell, each with a halo around it.
+
+    Args:
+    coords: (n, 3) array of coordinates
+    dim, pbc: the dimensions of the cell and whether each axis is periodic
+    ndomains: the number of slabs
+    halo: the thickness of the halo on either side of each slab
+
+    Returns:
+    A list with an (indices, owned) tuple of arrays for each slab that owns any coordinates. indices are the
+    coordinates in the slab or its halo and owned is True for those in the slab itself. Every coordinate is
+    owned by exactly one slab, and any coordinates closer than halo to one that a slab owns are in that slab.
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+    axis = int(np.argmax(dim))
+    length = float(dim[axis])
+    width = length / ndomains
+    halo += HALO_SLACK
+    periodic = bool(pbc[axis])
+    x = coords[:, axis]
+    if periodic:
+        x = np.remainder(x, length)
+    owner = np.clip(np.floor(x / width).astype(np.int64), 0, ndomains - 1)
+    domains = []
+    for d in range(ndomains):
+        lo, hi = d * width, (d + 1) * width
+        if periodic:
+            # Distance along the axis from the centre of the slab to the nearest image of each coordinate
+            dx = np.remainder(x - (lo + hi) / 2.0 + length / 2.0, length) - length / 2.0
+            inside = np.abs(dx) <= width / 2.0 + halo
+        else:
+            # The end slabs also take anything that has strayed outside the cell
+            inside = ((d == 0) | (x >= lo - halo)) & (
+                (d == ndomains - 1) | (x <= hi + halo)
+            )
+        inside |= owner == d
+        indices = np.flatnonzero(inside)
+        owned = owner[indices] == d
+        if np.any(owned):
+            domains.append((indices, owned))
+    return domains
@@ -11,6 +11,23 @@ logger = logging.getLogger()
 
 
 class EndGroup(object):
+    # EndGroups are numerous in large networks so they are kept small with slots rather than a __dict__
+    __slots__ = [
+        "blocked",
+        "bonded",
+        "_endGroupType",
+        "fragment",
+        "fragmentEndGroupIdx",
+        "blockEndGroupIdx",
+        "fragmentCapIdx",
+        "blockCapIdx",
+        "capBondLength",
+        "fragmentDihedralIdx",
+        "blockDihedralIdx",
+        "fragmentUwIdx",
+        "blockUwIdx",
+    ]
+
     def __init__(self):
 
         self.blocked = (
@@ -49,6 +66,30 @@ class EndGroup(object):
         """Return True if this endGroup belongs to a catalyst that is bonded to another catalyst"""
         return self.fragment.catalyst and self._endGroupType.endswith(ENDGROUPBONDED)
 
+    def __getstate__(self):
+        return dict((a, getattr(self, a)) for a in self.__slots__ if hasattr(self, a))
+
+    def __setstate__(self, d):
+        # Older versions kept the attributes in a __dict__ and may have old names for them
+        if isinstance(d, tuple):
+            d = d[1]
+        if "_isBonded" in d:
+            d["bonded"] = d.pop("_isBonded")
+        if "blocked" not in d:
+            d["blocked"] = False
+        for a, v in d.items():
+            if a in self.__slots__:
+                setattr(self, a, v)
+        return
+
+    def copy(self, fragment):
+        """Return a copy of ourselves that belongs to fragment"""
+        new = EndGroup.__new__(EndGroup)
+        for a in self.__slots__:
+            setattr(new, a, getattr(self, a))
+        new.fragment = fragment
+        return new
+
     def coord(self):
         """Need to think about an API for accessing coordinates for endGroups
         This just hacks in returning the endGroup.
@@ -60,6 +60,7 @@ class Fragment(object):
             "static": static,
             "_symbols": [],  # ordered array of symbols (in upper case)
             "_totalMass": -1,
+            "_topologyTemplate": None,  # angles, propers and impropers of all atoms (see topologyTemplate)
             "_individualAttrs": None,
             "_sharedAttrs": None,
         }
@@ -252,8 +253,13 @@ class Fragment(object):
             if isinstance(coord, list):
                 coord = np.array(coord)
             self._coords[self._ext2int[idxAtom]] = coord
+            self._changed = True
         return self._coords[self._ext2int[idxAtom]]
 
+    def coords(self):
+        """Return an array of the coordinates of the unmasked atoms in external indices"""
+        return self._coords[~np.asarray(self.masked, dtype=bool)]
+
     def clearUnbonded(self):
         self.unBonded = [False] * len(self.unBonded)
 
@@ -261,24 +267,39 @@ class Fragment(object):
         """Create a copy of ourselves.
         Those attributes in shared are just copied as references as they do not change between fragments
         of the same fragmentType
-        Those in single are deep-copied as each fragment has its own"""
+        Those in single are copied as each fragment has its own (see _copyIndividualAttr)"""
 
         f = Fragment()
         for a in f.__dict__:
             if a in self._sharedAttrs.keys():
                 setattr(f, a, getattr(self, a))
             elif a in self._individualAttrs.keys():
-                setattr(f, a, copy.deepcopy(getattr(self, a)))
+                setattr(f, a, self._copyIndividualAttr(a, f))
+            elif a == "_topologyTemplate":
+                # Older versions didn't have topology templates - it is calculated when needed
+                setattr(f, a, None)
             else:
                 # HACKS FOR DEALING WITH OLD FILES
                 msg = "Missing attribute in fragment copy: {0}".format(a)
                 logger.critical(msg)
                 raise RuntimeError(msg)
-            # Update fragment references in the endGroups
-            for e in f._endGroups:
-                e.fragment = f
         return f
 
+    def _copyIndividualAttr(self, a, fragment):
+        """Return a copy of the individual attribute a for the new fragment from copy.
+
+        The arrays and the containers of immutable values are copied one level deep rather than with deepcopy, which
+        would also copy the fragment (and so all the shared data) that each endGroup refers to. The endGroups are
+        copied to belong to the new fragment, and the copy doesn't belong to a block until it is added to one."""
+        value = getattr(self, a)
+        if a == "block":
+            return None
+        elif a == "_endGroups":
+            return [endGroup.copy(fragment) for endGroup in value]
+        elif isinstance(value, (np.ndarray, list, dict)):
+            return value.copy()
+        return copy.deepcopy(value)
+
     def endGroups(self):
         return self._endGroups
 
@@ -547,6 +568,22 @@ class Fragment(object):
     def radius(self, idxAtom):
         return self._radii[self._ext2int[idxAtom]]
 
+    def topologyTemplate(self):
+        """Return the angles, proper and improper dihedrals of the fragment in internal indices.
+
+        The template includes the cap and uw atoms, so it is only the topology of a fragment until they are
+        masked by bonding. It is the same for every fragment of the fragmentType so it is shared by the
+        copies of a library fragment (see Cell.libraryAddFragment).
+        """
+        if getattr(self, "_topologyTemplate", None) is None:
+            template = xyz_core.bondTopology(
+                *xyz_core.bondGraph(self._bonds, len(self._coords))
+            )
+            for a in template:
+                a.flags.writeable = False
+            self._topologyTemplate = template
+        return self._topologyTemplate
+
     def totalRadius(self):
 
         if self._changed:
@@ -556,12 +593,9 @@ class Fragment(object):
     def rotate(self, rotationMatrix, center):
         """ Rotate the molecule about the given axis by the angle in radians
         """
-        self._coords = self._coords - center
-        # self._coords = np.array([ np.dot(rotationMatrix, c) for c in self._coords ])
-        # I don't actually undestand why this works at all...
         # From: http://stackoverflow.com/questions/12148351/efficiently-rotate-a-set-of-points-with-a-rotation-matrix-in-numpy
-        self._coords = np.dot(self._coords, rotationMatrix.T)
-        self._coords = self._coords + center
+        # Update in place as the coordinates may be a view into the block's coordinate array
+        self._coords[:] = np.dot(self._coords - center, rotationMatrix.T) + center
         self._changed = True
         return
 
@@ -663,6 +697,28 @@ class Fragment(object):
         self._maxBonds[endGroupType] = maxBond
         return
 
+    def bondsAvailable(self, endGroupType):
+        """Return how many more bonds endGroups of endGroupType can make before reaching the maxBond limit.
+
+        Returns None if there is no limit for the endGroupType."""
+        if (
+            endGroupType.endswith(ab_endgroup.ENDGROUPBONDED)
+            or self._maxBonds.get(endGroupType) is None
+        ):
+            return None
+        return max(0, self._maxBonds[endGroupType] - self._endGroupBonded[endGroupType])
+
+    def shareCoords(self, coords):
+        """Copy our coordinates into coords and use it to hold them from now on.
+
+        Args:
+        coords: an array with a row for every atom (including masked atoms) - usually a slice of the
+        coordinate array of the block we belong to
+        """
+        coords[:] = self._coords
+        self._coords = coords
+        return
+
     def symbol(self, idxAtom):
         return self._symbols[self._ext2int[idxAtom]]
 
@@ -164,6 +164,21 @@ def cellFromPickle(pickleFile, paramsDir=None):
             del block._fragments
         for fragment in block.fragments:
             fixFragment(fragment)
+    if not all(
+        hasattr(myCell, attr)
+        for attr in [
+            "cellList",
+            "endGroupIndex",
+            "blockIndex",
+            "endGroupRegistry",
+            "endGroupTable",
+        ]
+    ):
+        # Older versions kept the atoms in dictionaries of boxes and had no endGroup or block indexes
+        for attr in ["box1", "box3"]:
+            if hasattr(myCell, attr):
+                delattr(myCell, attr)
+        myCell.repopulateCells()
     return myCell
 
 
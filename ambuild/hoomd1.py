@@ -755,7 +755,7 @@ class Hoomd1(FFIELD):
             )
 
         # If we are running (e.g.) an NPT simulation, the cell size may have changed. In this case we need to update
-        # our cell parameters. Repopulate cells will then update the halo cells and add the new blocks
+        # our cell parameters and repopulate the cells, which also updates the halo cells
         if not np.allclose(box, cell.dim):
             logger.info(
                 "Changing cell dimensions after HOOMD-blue simulation from: {0} to: {1}".format(
@@ -763,9 +763,10 @@ class Hoomd1(FFIELD):
                 )
             )
             cell.dim = box
-
-        # Now have the new coordinates, so we need to put the atoms in their new cells
-        cell.repopulateCells()
+            cell.repopulateCells()
+        else:
+            # Now have the new coordinates, so we only need to move the atoms that have changed cell
+            cell.rebin()
         return
 
     def writeCar(self, system, filename, unwrap=True, pbc=True):
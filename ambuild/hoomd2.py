@@ -4,6 +4,7 @@
 import itertools
 import logging
 import sys
+import time
 
 # 3rd-party imports
 import hoomd
@@ -39,6 +40,12 @@ class Hoomd2(object):
         self.system = None
         self.rigidBody = False
         self.exclusions = set()  # particle tags to be ignored in pair-pair interactions
+        # In a session the simulation is kept alive between runs and only the snapshot is replaced
+        self.session = False
+        self.rigid = None
+        self._sessionKey = None
+        self._fullSetupTime = 0.0
+        self.setupTimeSaved = 0.0
 
     def checkParameters(self, skipDihedrals=False):
         assert self.ffield
@@ -109,20 +116,19 @@ class Hoomd2(object):
             overlap = atomTypes.intersection(rigidCenters)
             if overlap:
                 raise RuntimeError("Clashing atomTypes/rigidCenters".format(overlap))
-            self.particleTypes = list(atomTypes.union(rigidCenters))
+            self.particleTypes = sorted(atomTypes.union(rigidCenters))
             self.exclusions = set(rigidCenters)
         else:
+            nRigidParticles = 0
             nparticles = len(data.coords)
-            self.particleTypes = list(set(data.atomTypes))
+            self.particleTypes = list(data.atomTypeNames)
 
         assert nparticles > 0, "Simulation needs some particles!"
         # NEED TO THINK ABOUT WHAT TO DO ABOUT MASKED ATOMS - set particleTypes?
         # self.masked = data.masked
-        self.bond_types = list(set(data.bondLabels)) if len(data.bonds) else []
-        self.angle_types = list(set(data.angleLabels)) if len(data.angles) else []
-        self.dihedral_types = (
-            list(set(data.properLabels)) if len(data.propers) and doDihedral else []
-        )
+        self.bond_types = list(data.bondTypeNames)
+        self.angle_types = list(data.angleTypeNames)
+        self.dihedral_types = list(data.properTypeNames) if doDihedral else []
         snapshot = hoomd.data.make_snapshot(
             N=nparticles,
             box=hoomd.data.boxdim(Lx=data.cell[0], Ly=data.cell[1], Lz=data.cell[2]),
@@ -131,94 +137,90 @@ class Hoomd2(object):
             angle_types=self.angle_types,
             dihedral_types=self.dihedral_types,
         )
-        # Add Bonds
+        # Add Bonds, Angles and Dihedrals. With rigid bodies the center particles are at the front of the
+        # arrays, so all the atom indices get shifted up.
+        shift = nRigidParticles
         if len(self.bond_types):
-            snapshot.bonds.resize(len(data.bonds))
-            for i, b in enumerate(data.bonds):
-                if (
-                    self.rigidBody
-                ):  # center particles are at the front of the arrays, so everything gets shifted up
-                    b0 = b[0] + nRigidParticles
-                    b1 = b[1] + nRigidParticles
-                else:
-                    b0, b1 = b
-                snapshot.bonds.group[i] = [b0, b1]
-                snapshot.bonds.typeid[i] = self.bond_types.index(data.bondLabels[i])
-        # Add Angles
+            self._setTopology(snapshot.bonds, data.bonds, data.bondTypeIds, shift)
         if len(self.angle_types):
-            snapshot.angles.resize(len(data.angles))
-            for i, a in enumerate(data.angles):
-                if (
-                    self.rigidBody
-                ):  # center particles are at the front of the arrays, so everything gets shifted up
-                    a0 = a[0] + nRigidParticles
-                    a1 = a[1] + nRigidParticles
-                    a2 = a[2] + nRigidParticles
-                else:
-                    a0, a1, a2 = a
-                snapshot.angles.group[i] = [a0, a1, a2]
-                snapshot.angles.typeid[i] = self.angle_types.index(data.angleLabels[i])
-        # Add Dihedrals
+            self._setTopology(snapshot.angles, data.angles, data.angleTypeIds, shift)
         if doDihedral and len(self.dihedral_types):
-            snapshot.dihedrals.resize(len(data.propers))
-            for i, d in enumerate(data.propers):
-                if (
-                    self.rigidBody
-                ):  # center particles are at the front of the arrays, so everything gets shifted up
-                    d0 = d[0] + nRigidParticles
-                    d1 = d[1] + nRigidParticles
-                    d2 = d[2] + nRigidParticles
-                    d3 = d[3] + nRigidParticles
-                else:
-                    d0, d1, d2, d3 = d
-                snapshot.dihedrals.group[i] = [d0, d1, d2, d3]
-                snapshot.dihedrals.typeid[i] = self.dihedral_types.index(
-                    data.properLabels[i]
-                )
+            self._setTopology(
+                snapshot.dihedrals, data.propers, data.properTypeIds, shift
+            )
         # Populate  particle data
+        particles = snapshot.particles
         if self.rigidBody:
+            typeIds = dict((t, i) for i, t in enumerate(self.particleTypes))
+            rigidParticles = data.rigidParticles
+            bodies = np.arange(nRigidParticles)
+            bodySizes = [rp.natoms for rp in rigidParticles]
             # Central particles need to be first in the list before any constituent particles.
-            for i, rp in enumerate(data.rigidParticles):
-                snapshot.particles.body[i] = i
-                # Wrap central paticle into the cell. We use the image of this for all the constituent particles
-                position, rp_image = xyz_core.wrapCoord3(
-                    rp.position, dim=data.cell, center=True
-                )
-                snapshot.particles.position[i] = position
-                snapshot.particles.image[i] = rp_image
-                snapshot.particles.mass[i] = rp.mass
-                snapshot.particles.orientation[i] = rp.orientation
-                # print "GOT ORIENT ",rp.type, repr( rp.orientation)
-                snapshot.particles.typeid[i] = snapshot.particles.types.index(rp.type)
-                snapshot.particles.moment_inertia[i] = rp.principalMoments
+            centers = slice(0, nRigidParticles)
+            # Wrap central paticles into the cell. We use the image of these for all the constituent particles
+            positions, images = xyz_core.wrapCoord3(
+                np.array([rp.position for rp in rigidParticles]),
+                dim=data.cell,
+                center=True,
+            )
+            particles.body[centers] = bodies
+            particles.position[centers] = positions
+            particles.image[centers] = images
+            particles.mass[centers] = [rp.mass for rp in rigidParticles]
+            particles.orientation[centers] = [rp.orientation for rp in rigidParticles]
+            particles.typeid[centers] = [typeIds[rp.type] for rp in rigidParticles]
+            particles.moment_inertia[centers] = [
+                rp.principalMoments for rp in rigidParticles
+            ]
             # Then add in the constituent molecule particles
-            idx = i + 1
-            for i, rp in enumerate(data.rigidParticles):
-                for j in range(rp.natoms):
-                    snapshot.particles.body[idx] = i  # to match central particle
-                    if doCharges:
-                        snapshot.particles.charge[idx] = rp.b_charges[j]
-                    snapshot.particles.diameter[idx] = rp.b_diameters[j]
-                    snapshot.particles.image[idx] = rp_image
-                    snapshot.particles.mass[idx] = rp.b_masses[j]
-                    snapshot.particles.position[idx] = rp.b_positions[j]
-                    snapshot.particles.typeid[idx] = snapshot.particles.types.index(
-                        rp.b_atomTypes[j]
-                    )
-                    idx += 1
-        else:
-            for i in range(nparticles):
-                if doCharges:
-                    snapshot.particles.charge[i] = data.charges[i]
-                snapshot.particles.diameter[i] = data.diameters[i]
-                snapshot.particles.image[i] = data.images[i]
-                snapshot.particles.mass[i] = data.masses[i]
-                snapshot.particles.position[i] = data.coords[i]
-                snapshot.particles.typeid[i] = self.particleTypes.index(
-                    data.atomTypes[i]
+            constituents = slice(nRigidParticles, nparticles)
+            atomTypes, inverse = np.unique(
+                np.concatenate([rp.b_atomTypes for rp in rigidParticles]),
+                return_inverse=True,
+            )
+            atomTypeIds = np.array([typeIds[t] for t in atomTypes])
+            particles.body[constituents] = np.repeat(bodies, bodySizes)
+            if doCharges:
+                particles.charge[constituents] = np.concatenate(
+                    [rp.b_charges for rp in rigidParticles]
                 )
+            particles.diameter[constituents] = np.concatenate(
+                [rp.b_diameters for rp in rigidParticles]
+            )
+            particles.image[constituents] = np.repeat(images, bodySizes, axis=0)
+            particles.mass[constituents] = np.concatenate(
+                [rp.b_masses for rp in rigidParticles]
+            )
+            particles.position[constituents] = np.concatenate(
+                [rp.b_positions for rp in rigidParticles]
+            )
+            particles.typeid[constituents] = atomTypeIds[inverse.reshape(-1)]
+        else:
+            if doCharges:
+                particles.charge[:] = data.charges
+            particles.diameter[:] = data.diameters
+            particles.image[:] = data.images
+            particles.mass[:] = data.masses
+            particles.position[:] = data.coords
+            particles.typeid[:] = data.atomTypeIds
         return snapshot
 
+    @staticmethod
+    def _setTopology(snapshotGroup, indices, typeIds, shift=0):
+        """Copy an array of bonds, angles or dihedrals into the corresponding snapshot group
+
+        Args:
+        snapshotGroup: the snapshot.bonds, snapshot.angles or snapshot.dihedrals object
+        indices: (n, k) array of the atom indices in the cell data
+        typeIds: (n,) array of the type ids
+        shift: offset to add to the atom indices
+        """
+        snapshotGroup.resize(len(indices))
+        if len(indices):
+            snapshotGroup.group[:] = indices + shift
+            snapshotGroup.typeid[:] = typeIds
+        return
+
     def optimiseGeometry(
         self,
         data,
@@ -237,9 +239,14 @@ class Hoomd2(object):
         if doDihedral and doImproper:
             raise RuntimeError("Cannot have impropers and dihedrals at the same time")
         self.rigidBody = rigidBody
-        self.setupContext(quiet=quiet)
-        snapshot = self.createSnapshot(data, doCharges=doCharges, doDihedral=doDihedral)
-        self.setupSimulation(snapshot, data, walls=walls, wallAtomType=wallAtomType)
+        self.setupSystem(
+            data,
+            doCharges=doCharges,
+            doDihedral=doDihedral,
+            quiet=quiet,
+            walls=walls,
+            wallAtomType=wallAtomType,
+        )
         hlog = self._createLog("geomopt.tsv")
         if "stepwise" in kw and kw["stepwise"]:
             optimised = self._optimiseGeometryStepwise(**kw)
@@ -249,6 +256,7 @@ class Hoomd2(object):
         if "d" in kw and kw["d"] is not None:
             for i in ["potential_energy"]:
                 kw["d"][i] = hlog.query(i)
+        hlog.disable()
         return True
         return optimised
 
@@ -322,6 +330,7 @@ class Hoomd2(object):
                         )
                         if j + 1 < max_tries:
                             logger.info("Attempting another optimisation macrocycle")
+                integrate_nve.disable()
                 break  # Break out of try/except loop
             except RuntimeError as e:
                 logger.info("Optimisation step {0} failed!\n{1}".format(i, e))
@@ -399,6 +408,7 @@ class Hoomd2(object):
                 break
             dt *= multiplier
             optCycles *= multiplier
+        integrate_nve.disable()
 
         if dump and False:
             dgsd.disable()
@@ -423,15 +433,21 @@ class Hoomd2(object):
         if doDihedral and doImproper:
             raise RuntimeError("Cannot have impropers and dihedrals at the same time")
         self.rigidBody = rigidBody
-        self.setupContext(quiet=quiet)
-        snapshot = self.createSnapshot(data, doCharges=doCharges, doDihedral=doDihedral)
-        self.setupSimulation(snapshot, data, walls=walls, wallAtomType=wallAtomType)
+        self.setupSystem(
+            data,
+            doCharges=doCharges,
+            doDihedral=doDihedral,
+            quiet=quiet,
+            walls=walls,
+            wallAtomType=wallAtomType,
+        )
         hlog = self._createLog("runmd.log")
         self._runMD(**kw)
         # Extract the energy
         if "d" in kw and kw["d"] is not None:
             for i in ["potential_energy"]:
                 kw["d"][i] = hlog.query(i)
+        hlog.disable()
         return True
 
     def _runMD(
@@ -578,6 +594,61 @@ class Hoomd2(object):
                 self.groupActive = self.groupAll
         return
 
+    def setupSystem(
+        self,
+        data,
+        doCharges=True,
+        doDihedral=True,
+        quiet=False,
+        walls=None,
+        wallAtomType=None,
+    ):
+        """Create the simulation for the cell data.
+
+        In a session the simulation from the last call is reused if the particle, bond, angle and dihedral types
+        and the potentials are unchanged: the snapshot is restored into the running system and only the groups and
+        rigid bodies are updated. Otherwise the context is re-initialised and everything is set up from scratch.
+        """
+        start = time.time()
+        live = self.session and self.system is not None
+        if not live:
+            self.setupContext(quiet=quiet)
+        snapshot = self.createSnapshot(data, doCharges=doCharges, doDihedral=doDihedral)
+        key = (
+            tuple(self.particleTypes),
+            tuple(sorted(self.exclusions)),
+            tuple(self.bond_types),
+            tuple(self.angle_types),
+            tuple(self.dihedral_types),
+            self.rigidBody,
+            self.rCut,
+            tuple(walls) if walls else None,
+            wallAtomType,
+        )
+        if live and key == self._sessionKey:
+            self.system.restore_snapshot(snapshot)
+            self.setupRigidBody(data, rigid=self.rigid)
+            self.setupGroups(data)
+            setupTime = time.time() - start
+            saved = max(self._fullSetupTime - setupTime, 0.0)
+            self.setupTimeSaved += saved
+            logger.info(
+                "Reused HOOMD-blue simulation: setup took {0:.3f}s, saving {1:.3f}s ({2:.3f}s in total)".format(
+                    setupTime, saved, self.setupTimeSaved
+                )
+            )
+            return
+        if live:
+            logger.info("HOOMD-blue types have changed - rebuilding the simulation")
+            self.setupContext(quiet=quiet)
+            snapshot = self.createSnapshot(
+                data, doCharges=doCharges, doDihedral=doDihedral
+            )
+        self.setupSimulation(snapshot, data, walls=walls, wallAtomType=wallAtomType)
+        self._sessionKey = key
+        self._fullSetupTime = time.time() - start
+        return
+
     def setupSimulation(self, snapshot, data, walls=None, wallAtomType=None):
         self.system = hoomd.init.read_snapshot(snapshot)
         self.setupRigidBody(data)
@@ -590,13 +661,17 @@ class Hoomd2(object):
         self.setupWalls(walls, wallAtomType)
         return
 
-    def setupRigidBody(self, data):
+    def setupRigidBody(self, data, rigid=None):
+        """Set the reference particles of the rigid bodies, creating the constraint if rigid is None"""
         if not self.rigidBody:
             return
-        rigid = hoomd.md.constrain.rigid()
+        if rigid is None:
+            rigid = hoomd.md.constrain.rigid()
+        # The reference particles are recreated with the cell data so always need to be set
         for rtype, m_positions, m_types in data.rigidParticleMgr.referenceParticles:
             rigid.set_param(rtype, positions=m_positions, types=m_types)
         rigid.validate_bodies()
+        self.rigid = rigid
         return
 
     def setupWalls(self, walls, wallAtomType):
@@ -671,23 +746,26 @@ class Hoomd2(object):
             atomIdx = len(hoomd.group.rigid_center())
         else:
             atomIdx = 0
-        for block in cell.blocks.values():
-            for i in range(block.numAtoms()):
-                coord = snapshot.particles.position[atomIdx]
-                coord = xyz_core.unWrapCoord3(
-                    coord, snapshot.particles.image[atomIdx], box, centered=True
-                )
-                block.coord(i, coord)
-                atomIdx += 1
-        if atomIdx != snapshot.particles.N:
+        numAtoms = atomIdx + sum(block.numAtoms() for block in cell.blocks.values())
+        if numAtoms != snapshot.particles.N:
             raise RuntimeError(
                 "Read {0} positions but there were {1} particles!".format(
-                    atomIdx, len(self.system.particles)
+                    numAtoms, len(self.system.particles)
                 )
             )
+        coords = xyz_core.unWrapCoord3(
+            snapshot.particles.position[atomIdx:],
+            snapshot.particles.image[atomIdx:],
+            box,
+            centered=True,
+        )
+        atomIdx = 0
+        for block in cell.blocks.values():
+            block.setCoords(coords[atomIdx : atomIdx + block.numAtoms()])
+            atomIdx += block.numAtoms()
 
         # If we are running (e.g.) an NPT simulation, the cell size may have changed. In this case we need to update
-        # our cell parameters. Repopulate cells will then update the halo cells and add the new blocks
+        # our cell parameters and repopulate the cells, which also updates the halo cells
         if not np.allclose(box, cell.dim):
             logger.info(
                 "Changing cell dimensions after HOOMD-blue simulation from: {0} to: {1}".format(
@@ -695,8 +773,10 @@ class Hoomd2(object):
                 )
             )
             cell.dim = box
-        # Now have the new coordinates, so we need to put the atoms in their new cells
-        cell.repopulateCells()
+            cell.repopulateCells()
+        else:
+            # Now have the new coordinates, so we only need to move the atoms that have changed cell
+            cell.rebin()
         return
 
     def _createLog(self, filename):
@@ -1,9 +1,16 @@
 #!/usr/bin/env python
 
+import itertools
 import logging
 import numpy as np
 import math
 
+# scipy is only needed for the kdtree neighbour search
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
 logger = logging.getLogger()
 
 
@@ -674,6 +681,131 @@ def angle(c1, c2, c3, dim=None, pbc=None):
     return theta
 
 
+def angles(c1, c2, c3, dim=None, pbc=None):
+    """Return an array of the angles in radians c1---c2---c3
+    where c1, c2 and c3 are (n, 3) arrays of coordinates
+    """
+    r1 = distance(c2, c1, dim=dim, pbc=pbc)
+    r2 = distance(c3, c2, dim=dim, pbc=pbc)
+    r3 = distance(c3, c1, dim=dim, pbc=pbc)
+    x = (r1 * r1 + r2 * r2 - r3 * r3) / (2.0 * r1 * r2)
+    assert not np.any(np.isnan(x))
+    theta = np.arccos(np.clip(x, -1.0, 1.0))
+    theta[np.isclose(x, 1.0)] = 0.0
+    theta[np.isclose(x, -1.0)] = math.pi
+    return theta
+
+
+def bondGraph(bonds, numAtoms):
+    """Return the adjacency of the atoms in bonds in compressed sparse row (CSR) form.
+
+    Args:
+    bonds: (n, 2) array or list of pairs of bonded atom indices
+    numAtoms: the number of atoms
+
+    Returns:
+    A tuple of the (numAtoms + 1,) array of where the neighbours of each atom start and the array of
+    neighbours, which are sorted for each atom
+    """
+    bonds = np.asarray(bonds, dtype=np.int64).reshape(-1, 2)
+    # Encode both directions of each bond as a single integer so duplicates go with a 1D unique
+    keys = np.unique(
+        np.concatenate(
+            [bonds[:, 0] * numAtoms + bonds[:, 1], bonds[:, 1] * numAtoms + bonds[:, 0]]
+        )
+    )
+    atoms, neighbours = np.divmod(keys, numAtoms)
+    indptr = np.zeros(numAtoms + 1, dtype=np.int64)
+    np.cumsum(np.bincount(atoms, minlength=numAtoms), out=indptr[1:])
+    return indptr, neighbours
+
+
+def _graphEntries(indptr, atoms):
+    """Return the index in atoms and the position in the neighbour array of every neighbour of atoms"""
+    starts = indptr[atoms]
+    counts = indptr[atoms + 1] - starts
+    owners = np.repeat(np.arange(len(atoms)), counts)
+    offsets = starts - np.cumsum(counts) + counts
+    entries = np.arange(len(owners)) + np.repeat(offsets, counts)
+    return owners, entries
+
+
+def _uniqueRows(a, numAtoms):
+    """Return the unique rows of the (n, 4) array a of atom indices sorted lexicographically"""
+    if not len(a):
+        return a
+    # Sorting on pairs of atoms encoded as single integers is much faster than on each column
+    first = a[:, 0] * numAtoms + a[:, 1]
+    second = a[:, 2] * numAtoms + a[:, 3]
+    order = np.lexsort((second, first))
+    first, second = first[order], second[order]
+    keep = np.ones(len(a), dtype=bool)
+    keep[1:] = (first[1:] != first[:-1]) | (second[1:] != second[:-1])
+    return a[order[keep]]
+
+
+def bondTopology(indptr, neighbours):
+    """Return the angles, proper and improper dihedrals of a bond graph from bondGraph.
+
+    Angles are (i, j, k) with i < k and propers (i, j, k, l) with i < l, both sorted. Impropers are
+    (j, i, k, l) for each combination of three neighbours i < k < l of an atom j in order of j.
+
+    Args:
+    indptr: the (numAtoms + 1,) array of where the neighbours of each atom start
+    neighbours: the array of neighbours
+
+    Returns:
+    A tuple of (n, 3) angles, (n, 4) propers and (n, 4) impropers arrays of atom indices
+    """
+    numAtoms = len(indptr) - 1
+    degree = np.diff(indptr)
+    centres = np.repeat(np.arange(numAtoms), degree)
+    # Each angle pairs a neighbour of the centre with every later one as the neighbours are sorted
+    counts = indptr[centres + 1] - np.arange(len(neighbours)) - 1
+    first = np.repeat(np.arange(len(neighbours)), counts)
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    second = first + 1 + np.arange(len(first)) - offsets
+    angles = np.column_stack(
+        [neighbours[first], centres[first], neighbours[second]]
+    ).astype(np.int64)
+    angles = angles[np.lexsort((angles[:, 2], angles[:, 0] * numAtoms + angles[:, 1]))]
+
+    # Each proper i-j-k-l is found twice, by extending the angles centred on j and on k by a neighbour
+    # of their other end atom. They are written the way round that starts with the lower index and only
+    # kept when found from the angle centred on their second atom, other than those of three-membered
+    # rings that start and end with the same atom.
+    propers = []
+    for end, other in [(0, 2), (2, 0)]:
+        owners, entries = _graphEntries(indptr, angles[:, end])
+        atom = neighbours[entries]
+        angle = angles[owners]
+        keep = atom != angle[:, 1]
+        atom, angle = atom[keep], angle[keep]
+        proper = np.column_stack([atom, angle[:, end], angle[:, 1], angle[:, other]])
+        if end == 0:
+            flip = proper[:, 0] >= proper[:, 3]
+        else:
+            flip = proper[:, 0] > proper[:, 3]
+        proper[flip] = proper[flip, ::-1]
+        keep = (proper[:, 1] == angle[:, 1]) | (proper[:, 0] == proper[:, 3])
+        propers.append(proper[keep])
+    propers = _uniqueRows(np.concatenate(propers).reshape(-1, 4), numAtoms)
+
+    # Impropers for the atoms with each number of neighbours above 2 in turn
+    impropers = [np.empty((0, 4), dtype=np.int64)]
+    for d in np.unique(degree[degree > 2]).tolist():
+        atoms = np.flatnonzero(degree == d)
+        combinations = np.array(list(itertools.combinations(range(d), 3)))
+        positions = indptr[atoms][:, np.newaxis, np.newaxis] + combinations
+        improper = np.empty((len(atoms), len(combinations), 4), dtype=np.int64)
+        improper[:, :, 0] = atoms[:, np.newaxis]
+        improper[:, :, 1:] = neighbours[positions]
+        impropers.append(improper.reshape(-1, 4))
+    impropers = np.concatenate(impropers)
+    impropers = impropers[np.argsort(impropers[:, 0], kind="stable")]
+    return angles.reshape(-1, 3), propers, impropers
+
+
 def centroid(coords):
     return np.sum(coords, axis=0) / np.size(coords, axis=0)
 
@@ -732,6 +864,27 @@ def distance(v1, v2, dim=None, pbc=[True, True, True]):
     return np.sqrt((vecDiff(v1, v2, dim=dim, pbc=pbc) ** 2).sum(axis=-1))
 
 
+def kdTree(coords, dim=None, pbc=[True, True, True]):
+    """Return a scipy cKDTree of the coordinates that is periodic along the periodic axes of dim.
+
+    Coordinates along the periodic axes are wrapped into the cell, so distances between points in the tree
+    are the same as those returned by distance.
+    """
+    if cKDTree is None:
+        msg = "The kdtree neighbour search requires scipy to be installed"
+        logger.critical(msg)
+        raise RuntimeError(msg)
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+    if dim is None or not np.any(pbc):
+        return cKDTree(coords)
+    dim = np.asarray(dim, dtype=np.float64)
+    pbc = np.asarray(pbc, dtype=bool)
+    coords = np.where(pbc, np.remainder(coords, dim), coords)
+    # remainder can round tiny negative values up to dim, which cKDTree won't accept
+    coords = np.where(pbc & (coords >= dim), 0.0, coords)
+    return cKDTree(coords, boxsize=np.where(pbc, dim, 0.0))
+
+
 def momentOfInertia(coords, masses):
     """Moment of Inertia Tensor"""
     totalMass = np.sum(masses)
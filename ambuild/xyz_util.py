@@ -14,6 +14,7 @@ import warnings
 import xml.etree.ElementTree as ET
 import xml.dom.minidom
 
+from ambuild import ab_celllist
 from ambuild import xyz_core
 from ambuild.ab_ffield import read_bond_params
 
@@ -123,15 +124,22 @@ def calcBondsHACK(coords, symbols, bondMargin=0.2):
 
 
 def calcBonds(
-    coords, symbols, dim=None, maxAtomRadius=None, bondMargin=0.2, boxMargin=1.0
+    coords,
+    symbols,
+    dim=None,
+    maxAtomRadius=None,
+    bondMargin=0.2,
+    boxMargin=1.0,
+    backend=ab_celllist.CELLS,
 ):
     """Calculate the bonds for the fragments. This is done at the start when the only coordinates
     are those in the fragment.
     symbols can be chemical elements or atomTypes
     If supplied cell is a list/numpy array with the dimensions of the simulation cell, in which case
     PBC will be applied
+    backend is the neighbour search backend used to find the close atoms (see closeAtoms)
     """
-    close = closeAtoms(coords, symbols, dim, maxAtomRadius, boxMargin)
+    close = closeAtoms(coords, symbols, dim, maxAtomRadius, boxMargin, backend=backend)
     v1 = []
     v2 = []
     for idxAtom1, idxAtom2 in close:
@@ -162,9 +170,20 @@ def calcBonds(
     return sorted(bonds)
 
 
-def closeAtoms(coords, symbols, dim=None, maxAtomRadius=None, boxMargin=1.0):
+def closeAtoms(
+    coords,
+    symbols,
+    dim=None,
+    maxAtomRadius=None,
+    boxMargin=1.0,
+    backend=ab_celllist.CELLS,
+):
     """Return a list of which atoms in the cell are close to each other.
-    Close is defined by the maxAtomRadius and boxMargin"""
+    Close is defined by the maxAtomRadius and boxMargin, which set the size of the boxes the atoms are
+    sorted into. With the "cells" backend all pairs of atoms in neighbouring boxes are returned, while the
+    "kdtree" backend (which requires scipy) returns the (sorted) pairs that are within a box size of each other.
+    """
+    ab_celllist.checkBackend(backend)
     if maxAtomRadius is None:
         maxAtomRadius = max(
             [
@@ -175,6 +194,11 @@ def closeAtoms(coords, symbols, dim=None, maxAtomRadius=None, boxMargin=1.0):
         )
 
     boxSize = (maxAtomRadius * 2) + boxMargin
+    if backend == ab_celllist.KDTREE:
+        tree = xyz_core.kdTree(coords, dim=dim)
+        pairs = tree.query_pairs(boxSize, output_type="ndarray")
+        return sorted((int(i), int(j)) for i, j in pairs)
+
     # If we are under PBC calculate the number of boxes in each dimenson
     boxNum = None
     if dim is not None:
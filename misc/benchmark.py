@@ -0,0 +1,493 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the core cell building operations.
+
+A cell is built from one of the test fragments in tests/blocks and each stage of the build is timed in turn:
+seed, growBlocks, joinBlocks, zipBlocks, closeAtoms, cellData, writePickle, cellFromPickle, writeXyz and
+writeCml. No MD engine is required. The random number generators are seeded so that the same cell is built
+on each repeat and on each commit.
+
+To record the timings for the current commit:
+python misc/benchmark.py --blocks 100 --repeat 3 --output before.json
+
+To compare two sets of timings (exits with status 1 if any stage is slower by more than the threshold):
+python misc/benchmark.py --compare before.json after.json
+
+To build the cell with the KD-tree neighbour search backend (requires scipy):
+python misc/benchmark.py --backend kdtree
+
+To time the neighbour searches of each backend on the same cell over a range of zip bond margins:
+python misc/benchmark.py --backends --blocks 200 --zipBondMargins 0.5 2.0 5.0
+
+To time the searches that can use a process pool in the parent and in a pool of 4 processes:
+python misc/benchmark.py --processes 4 --blocks 700 --box 60 --repeat 20
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT_DIR)
+from ambuild import ab_cell
+from ambuild import ab_celllist
+from ambuild import ab_util
+from ambuild.version import __version__
+
+BLOCKS_DIR = os.path.join(ROOT_DIR, "tests", "blocks")
+PARAMS_DIR = os.path.join(ROOT_DIR, "tests", "params")
+STAGES = [
+    "seed",
+    "growBlocks",
+    "joinBlocks",
+    "zipBlocks",
+    "closeAtoms",
+    "cellData",
+    "writePickle",
+    "cellFromPickle",
+    "writeXyz",
+    "writeCml",
+]
+
+
+def buildCell(args):
+    """Build a cell timing each stage in turn.
+
+    Args:
+    args: the parsed command-line arguments
+
+    Returns:
+    A tuple of a dictionary mapping each stage to a (time, result) tuple and the final cell
+    """
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    mycell = ab_cell.Cell([args.box] * 3, paramsDir=PARAMS_DIR)
+    mycell.setNeighbourBackend(args.backend)
+    mycell.libraryAddFragment(
+        filename=os.path.join(BLOCKS_DIR, args.fragment + ".car"), fragmentType="A"
+    )
+    mycell.addBondType("A:a-A:a")
+    timings = {}
+
+    def timeStage(stage, func, *fargs, **kw):
+        start = time.time()
+        result = func(*fargs, **kw)
+        timings[stage] = (time.time() - start, result)
+        return result
+
+    timeStage("seed", mycell.seed, args.blocks, fragmentType="A")
+    timeStage("growBlocks", mycell.growBlocks, args.grow, maxTries=args.maxTries)
+    timeStage("joinBlocks", mycell.joinBlocks, args.join, maxTries=args.maxTries)
+    timeStage(
+        "zipBlocks",
+        mycell.zipBlocks,
+        bondMargin=args.zipBondMargin,
+        bondAngleMargin=args.zipBondAngleMargin,
+        processes=args.zipProcesses,
+    )
+    timeStage(
+        "closeAtoms",
+        lambda: sum(len(mycell.closeAtoms(idx)[0]) for idx in mycell.blocks),
+    )
+    timeStage(
+        "cellData",
+        lambda: mycell.cellData(rigidBody=False, noRigidParticles=True).natoms,
+    )
+    pickleFile = timeStage("writePickle", mycell.writePickle, "benchmark")
+    timeStage(
+        "cellFromPickle",
+        lambda: ab_util.cellFromPickle(pickleFile, paramsDir=PARAMS_DIR).numAtoms(),
+    )
+    timeStage("writeXyz", mycell.writeXyz, "benchmark.xyz", periodic=True)
+    timeStage("writeCml", mycell.writeCml, "benchmark.cml", rigidBody=False)
+    return timings, mycell
+
+
+def builtCell(args):
+    """Return a cell that has been seeded, grown and joined as for the build benchmark"""
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    mycell = ab_cell.Cell([args.box] * 3, paramsDir=PARAMS_DIR)
+    mycell.libraryAddFragment(
+        filename=os.path.join(BLOCKS_DIR, args.fragment + ".car"), fragmentType="A"
+    )
+    mycell.addBondType("A:a-A:a")
+    mycell.seed(args.blocks, fragmentType="A")
+    mycell.growBlocks(args.grow, maxTries=args.maxTries)
+    mycell.joinBlocks(args.join, maxTries=args.maxTries)
+    return mycell
+
+
+def benchmarkProcesses(args):
+    """Time the searches that can be split across a process pool with and without the pool.
+
+    Each operation is timed in the parent (as with processes=None) and with an ab_celllist.CellListPool of
+    args.processes processes. The pool is timed both with the cell unchanged between searches, when its
+    shared copy of the cell is reused, and with the copy refreshed before every search, as when a block
+    has been added to the cell since the last one. The CPU time the parent spends on each search with the
+    pool is also given, as this is the part of the search that isn't shared by the processes.
+
+    Args:
+    args: the parsed command-line arguments
+
+    Returns:
+    A list of (operation, {mode: time}) tuples
+    """
+    mycell = builtCell(args)
+    growBlock = mycell.getLibraryBlock("A")
+    batches = [
+        growBlock.coords()
+        + np.random.uniform(0.0, args.box, size=(args.batchSize, 1, 3))
+        for _ in range(args.repeat)
+    ]
+    # The bonds zipBlocks would check for clashes
+    bondMargin = args.zipBondMargin
+    bonds = mycell._zipPossibleBonds(
+        ab_cell.MAX_BOND_LENGTH + bondMargin,
+        bondMargin,
+        np.radians(args.zipBondAngleMargin),
+        True,
+    )
+    operations = [
+        (
+            "screenPlacements",
+            batches,
+            lambda batch, pool: int(
+                np.sum(mycell._screenPlacements(growBlock, batch, pool=pool))
+            ),
+        ),
+        (
+            "bondClashes ({0})".format(len(bonds)),
+            [bonds] * args.repeat,
+            lambda bonds, pool: mycell.bondClashes(bonds, 1.6, pool=pool).tolist(),
+        ),
+    ]
+    modes = ["serial", "pool", "pool (refresh)"]
+    pool = ab_celllist.CellListPool(args.processes)
+    results = []
+    try:
+        for name, searches, func in operations:
+            times, counts = {}, {}
+            func(searches[0], pool)  # Start the processes and fill the shared copy of the cell
+            for mode in modes:
+                start, cpuStart = time.time(), time.process_time()
+                counts[mode] = []
+                for search in searches:
+                    if mode == "pool (refresh)":
+                        pool._version = None  # Copy the cell again as if it had changed
+                    searchPool = None if mode == "serial" else pool
+                    counts[mode].append(func(search, searchPool))
+                times[mode] = (time.time() - start) / len(searches)
+                if mode != "serial":
+                    # The time the parent spends on each search, which can't be spread over the processes
+                    times[mode + " parent"] = (time.process_time() - cpuStart) / len(
+                        searches
+                    )
+            if any(counts[mode] != counts["serial"] for mode in modes):
+                print("WARNING: the pool found different results for: {0}".format(name))
+            results.append((name, times))
+    finally:
+        pool.close()
+    print(
+        "Cell of {0} atoms, {1} processes, time per search".format(
+            mycell.numAtoms(), args.processes
+        )
+    )
+    modes = ["serial", "pool", "pool parent", "pool (refresh)", "pool (refresh) parent"]
+    print("{0:<24}".format("operation") + "".join("{0:>23}".format(m) for m in modes))
+    for name, times in results:
+        row = "".join("{0:>23.4f}".format(times[m]) for m in modes)
+        print("{0:<24}{1}".format(name, row))
+    return results
+
+
+def benchmarkBackends(args):
+    """Time the neighbour searches made by each operation with each backend on the same cell.
+
+    Args:
+    args: the parsed command-line arguments
+
+    Returns:
+    A list of (operation, {backend: time}) tuples
+    """
+    mycell = builtCell(args)
+    growBlock = mycell.getLibraryBlock("A")
+    placements = growBlock.coords() + np.random.uniform(
+        0.0, args.box, size=(1000, 1, 3)
+    )
+    operations = [
+        (
+            "closeAtoms",
+            "closeAtoms",
+            lambda: sum(len(mycell.closeAtoms(idx)[0]) for idx in mycell.blocks),
+        ),
+        (
+            "screenPlacements",
+            "screenPlacements",
+            lambda: int(np.sum(mycell._screenPlacements(growBlock, placements))),
+        ),
+    ]
+    for margin in args.zipBondMargins:
+        cutoff = ab_cell.MAX_BOND_LENGTH + margin
+        operations.append(
+            (
+                "zipPairs ({0})".format(margin),
+                "zipBlocks",
+                lambda cutoff=cutoff: len(
+                    mycell.endGroupIndex.pairs(
+                        cutoff, backend=mycell.neighbourBackends["zipBlocks"]
+                    )[0]
+                ),
+            )
+        )
+    results = []
+    for name, operation, func in operations:
+        times, counts = {}, {}
+        for backend in ["cells", "kdtree"]:
+            mycell.setNeighbourBackend(backend, operations=operation)
+            func()  # Make sure any KD-tree is built before the timing
+            start = time.time()
+            for _ in range(args.repeat):
+                counts[backend] = func()
+            times[backend] = (time.time() - start) / args.repeat
+        if counts["cells"] != counts["kdtree"]:
+            print("WARNING: the backends found different results for: {0}".format(name))
+        results.append((name, times))
+    print("Cell of {0} atoms".format(mycell.numAtoms()))
+    print("{0:<24}{1:>12}{2:>12}{3:>10}".format("operation", "cells", "kdtree", "ratio"))
+    for name, times in results:
+        print(
+            "{0:<24}{1:>12.4f}{2:>12.4f}{3:>10.2f}".format(
+                name, times["cells"], times["kdtree"], times["kdtree"] / times["cells"]
+            )
+        )
+    return results
+
+
+def gitCommit():
+    """Return the commit of the ambuild repository or None if it can't be determined"""
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.STDOUT
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit.decode().strip()
+
+
+def runBenchmarks(args):
+    """Run all the repeats of the benchmark and return the results as a dictionary"""
+    results = dict((stage, {"times": []}) for stage in STAGES)
+    cellStats = None
+    workDir = tempfile.mkdtemp(prefix="ambuild_benchmark_")
+    cwd = os.getcwd()
+    os.chdir(workDir)
+    try:
+        for i in range(args.repeat):
+            timings, mycell = buildCell(args)
+            for stage, (elapsed, result) in timings.items():
+                results[stage]["times"].append(elapsed)
+                if stage != "writePickle":
+                    results[stage]["result"] = result
+            cellStats = {
+                "num_atoms": mycell.numAtoms(),
+                "num_blocks": mycell.numBlocks(),
+                "num_fragments": mycell.numFragments(),
+                "num_free_endGroups": mycell.numFreeEndGroups(),
+            }
+            print(
+                "Repeat {0}: {1:.3f}s for {2} atoms".format(
+                    i, sum(t for t, _ in timings.values()), cellStats["num_atoms"]
+                )
+            )
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workDir, ignore_errors=True)
+    for stage in STAGES:
+        times = results[stage]["times"]
+        results[stage]["min"] = min(times)
+        results[stage]["median"] = float(np.median(times))
+    return {
+        "metadata": {
+            "ambuild_version": __version__,
+            "commit": gitCommit(),
+            "date": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "arguments": vars(args),
+        },
+        "cell": cellStats,
+        "results": results,
+    }
+
+
+def compareResults(before, after, threshold=1.1):
+    """Print the ratio of the minimum times for each stage in two sets of results.
+
+    Args:
+    before, after: dictionaries of results as written by runBenchmarks
+    threshold: the ratio of after/before above which a stage counts as a regression
+
+    Returns:
+    A list of the stages that have regressed
+    """
+    if before["metadata"]["arguments"] != after["metadata"]["arguments"]:
+        print("WARNING: the benchmarks were run with different arguments")
+    if before["cell"] != after["cell"]:
+        print(
+            "WARNING: different cells were built: {0} -> {1}".format(
+                before["cell"], after["cell"]
+            )
+        )
+    print("{0:<16}{1:>12}{2:>12}{3:>10}".format("stage", "before", "after", "ratio"))
+    regressions = []
+    for stage in STAGES:
+        if stage not in before["results"] or stage not in after["results"]:
+            continue
+        tbefore = before["results"][stage]["min"]
+        tafter = after["results"][stage]["min"]
+        ratio = tafter / tbefore if tbefore > 0 else float("inf")
+        flag = ""
+        if ratio > threshold:
+            regressions.append(stage)
+            flag = " *"
+        print(
+            "{0:<16}{1:>12.4f}{2:>12.4f}{3:>10.2f}{4}".format(
+                stage, tbefore, tafter, ratio, flag
+            )
+        )
+    return regressions
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the core ambuild cell building operations"
+    )
+    parser.add_argument(
+        "--fragment",
+        default="benzene2",
+        help="name of the .car file in tests/blocks to build the cell from (must have 'a' endGroups)",
+    )
+    parser.add_argument("--box", type=float, default=35.0, help="cell dimension [A]")
+    parser.add_argument("--blocks", type=int, default=50, help="blocks to seed")
+    parser.add_argument(
+        "--grow", type=int, default=None, help="blocks to grow (default: --blocks)"
+    )
+    parser.add_argument(
+        "--join", type=int, default=None, help="blocks to join (default: --blocks/5)"
+    )
+    parser.add_argument("--maxTries", type=int, default=50)
+    parser.add_argument("--zipBondMargin", type=float, default=3.0)
+    parser.add_argument("--zipBondAngleMargin", type=float, default=60.0)
+    parser.add_argument(
+        "--zipProcesses",
+        type=int,
+        default=None,
+        help="number of processes used to screen the zipBlocks bonds",
+    )
+    parser.add_argument(
+        "--backend",
+        default="cells",
+        choices=["cells", "kdtree"],
+        help="neighbour search backend used for all the operations",
+    )
+    parser.add_argument(
+        "--backends",
+        action="store_true",
+        help="compare the neighbour searches of the two backends instead of timing the build",
+    )
+    parser.add_argument(
+        "--zipBondMargins",
+        type=float,
+        nargs="+",
+        default=[0.5, 2.0, 5.0],
+        help="bondMargins to time the zipBlocks endGroup search with when comparing the backends",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="compare the searches made in the parent with those made by a pool of this many processes",
+    )
+    parser.add_argument(
+        "--batchSize",
+        type=int,
+        default=64,
+        help="placements screened in each search when comparing the pool with the parent",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42, help="random number seed")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument(
+        "--log", action="store_true", help="keep the ambuild logging turned on"
+    )
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BEFORE", "AFTER"),
+        help="compare two JSON results files instead of running the benchmarks",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.1,
+        help="after/before ratio that counts as a regression when comparing",
+    )
+    args = parser.parse_args(argv)
+    if args.grow is None:
+        args.grow = args.blocks
+    if args.join is None:
+        args.join = max(args.blocks // 5, 1)
+    return args
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    if args.compare:
+        with open(args.compare[0]) as f:
+            before = json.load(f)
+        with open(args.compare[1]) as f:
+            after = json.load(f)
+        regressions = compareResults(before, after, threshold=args.threshold)
+        if regressions:
+            print("Regressions in: {0}".format(", ".join(regressions)))
+            return 1
+        return 0
+    if not args.log:
+        logging.disable(logging.CRITICAL)
+    if args.backends or args.processes:
+        workDir = tempfile.mkdtemp(prefix="ambuild_benchmark_")
+        cwd = os.getcwd()
+        os.chdir(workDir)
+        try:
+            if args.processes:
+                benchmarkProcesses(args)
+            else:
+                benchmarkBackends(args)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workDir, ignore_errors=True)
+        return 0
+    results = runBenchmarks(args)
+    for stage in STAGES:
+        print("{0:<16}{1:>12.4f}".format(stage, results["results"][stage]["min"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("Wrote results to: {0}".format(args.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,7 @@ import os
 from ambuild import ab_block
 from ambuild import ab_bond
 from ambuild import ab_cell
+from ambuild import ab_celllist
 from ambuild import ab_ffield
 from ambuild import ab_fragment
 from ambuild import ab_poreblazer
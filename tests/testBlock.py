@@ -162,18 +162,39 @@ class Test(unittest.TestCase):
                 (9, 4, 5, 11),
             ],
             [
-                (0, 8, 1, 5),
+                (0, 1, 5, 8),
                 (1, 0, 2, 6),
-                (2, 1, 10, 3),
+                (2, 1, 3, 10),
                 (3, 2, 4, 7),
-                (4, 9, 3, 5),
-                (5, 0, 11, 4),
+                (4, 3, 5, 9),
+                (5, 0, 4, 11),
             ],
         )
 
         self.assertEqual(ad, ref, "untested angles and dihedrals")
         return
 
+    def testTopologyCache(self):
+        """The topology is cached until the block is bonded"""
+        ch4_1 = Block(filePath=self.ch4Car, fragmentType="A")
+        ch4_2 = Block(filePath=self.ch4Car, fragmentType="A")
+        topology = ch4_1.topology()
+        self.assertIs(topology, ch4_1.topology())
+        self.assertEqual([len(t) for t in topology], [6, 0, 4])
+        eg1 = ch4_1.freeEndGroups()[0]
+        eg2 = ch4_2.freeEndGroups()[0]
+        ch4_1.positionGrowBlock(eg1, eg2)
+        bond = Bond(eg1, eg2)
+        bond.engage()
+        topology = ch4_1.topology()
+        # The carbons each replace a cap hydrogen with the other carbon, giving H-C-C-H propers
+        self.assertEqual([len(t) for t in topology], [12, 9, 8])
+        other = ch4_1.copy()
+        other._update()
+        for t1, t2 in zip(topology, other.topology()):
+            self.assertTrue(np.array_equal(t1, t2))
+        return
+
     def testBond1(self):
         """First pass"""
 
@@ -227,6 +248,37 @@ class Test(unittest.TestCase):
         bond.engage()
         return
 
+    def testBondUpdate(self):
+        """The data updated after each bond must match that from a full update of the block"""
+
+        def chain(car, length):
+            block = Block(filePath=car, fragmentType="A")
+            for _ in range(length - 1):
+                other = Block(filePath=car, fragmentType="A")
+                bond = Bond(block.freeEndGroups()[-1], other.freeEndGroups()[0])
+                bond.engage()
+                self.assertEqual([], block.checkUpdate())
+            return block
+
+        # Bond blocks with a single and with multiple bodies through fragments in the middle of each
+        block1 = chain(self.ch4Car, 4)
+        block2 = chain(self.ch4Ca2Car, 3)
+        eg1 = [eg for eg in block1.freeEndGroups() if eg.fragment == block1.fragments[1]][0]
+        eg2 = [eg for eg in block2.freeEndGroups() if eg.fragment == block2.fragments[1]][0]
+        bond = Bond(eg1, eg2)
+        bond.engage()
+        self.assertEqual(len(block1.fragments), 7)
+        self.assertEqual([], block1.checkUpdate())
+
+        # Bonds within the block
+        for i, j in [(0, 2), (4, 6), (3, 5)]:
+            eg1 = block1.fragments[i].freeEndGroups()[0]
+            eg2 = block1.fragments[j].freeEndGroups()[-1]
+            bond = Bond(eg1, eg2)
+            bond.engage()
+            self.assertEqual([], block1.checkUpdate())
+        return
+
     def testDeleteBondSimple(self):
         """Bfoo"""
         ch4_1 = Block(filePath=self.ch4Car, fragmentType="A")
@@ -373,6 +425,33 @@ class Test(unittest.TestCase):
 
         return
 
+    def testDeleteFragmentRing(self):
+        """Deleting a fragment from a ring leaves the rest of the ring as one block"""
+        blocks = [Block(filePath=self.ch4Car, fragmentType="A") for _ in range(5)]
+        frags = [b.fragments[0] for b in blocks]
+        ch4_1 = blocks[0]
+        for i in range(1, 5):
+            eg1 = [eg for eg in ch4_1.freeEndGroups() if eg.fragment == frags[i - 1]][0]
+            eg2 = blocks[i].freeEndGroups()[0]
+            ch4_1.positionGrowBlock(eg1, eg2)
+            Bond(eg1, eg2).engage()
+        eg1 = [eg for eg in ch4_1.freeEndGroups() if eg.fragment == frags[0]][0]
+        eg2 = [eg for eg in ch4_1.freeEndGroups() if eg.fragment == frags[4]][0]
+        Bond(eg1, eg2).engage()
+
+        result = ch4_1.deleteFragment(frags[2])
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0].fragments, [frags[1], frags[0], frags[3], frags[4]])
+        self.assertEqual(len(result[0]._blockBonds), 3)
+        self.assertEqual(result[0].numAtoms(), 4 * 5 - 3 * 2)
+        self.assertEqual(ch4_1.fragments, [frags[2]])
+        self.assertEqual(ch4_1.numAtoms(), 5)
+
+        # The search doesn't recurse so long chains are fine
+        adjacency = {i: set([i - 1, i + 1]) for i in range(1, 9999)}
+        self.assertEqual(len(Block._connectedFragments(5000, adjacency)), 10000)
+        return
+
     def XtestAlignBlocks(self):
         """Test we can align two _blocks correctly"""
 
@@ -675,6 +754,48 @@ class Test(unittest.TestCase):
         self.assertTrue(np.allclose(p, c, rtol=1e-9, atol=1e-9), "simple move")
         return
 
+    def testCoordsArray(self):
+        """The block coordinate array must stay in step with the fragment coordinates"""
+
+        def checkCoords(block):
+            fragmentCoords = np.concatenate([f.coords() for f in block.fragments])
+            self.assertTrue(np.array_equal(block.coords(), fragmentCoords))
+            self.assertTrue(np.array_equal(block.coords(), list(block.iterCoord())))
+            atoms = range(block.numAtoms())
+            self.assertTrue(np.array_equal(block.radii(), [block.radius(i) for i in atoms]))
+            self.assertEqual(list(block.symbols()), [block.symbol(i) for i in atoms])
+            self.assertEqual(list(block.types()), [block.type(i) for i in atoms])
+            return
+
+        block1 = Block(filePath=self.benzeneCar, fragmentType="A")
+        block2 = Block(filePath=self.benzeneCar, fragmentType="A")
+        block1.translate([1, 2, 3])
+        block2.rotate([1, 2, 3], 2)
+        checkCoords(block1)
+        checkCoords(block2)
+
+        bond = Bond(block1.freeEndGroups()[0], block2.freeEndGroups()[0])
+        bond.engage()
+        checkCoords(block1)
+        # Moving the block moves the fragments
+        centroid = block1.fragments[1].centroid()
+        block1.translate([1, 0, 0])
+        self.assertTrue(np.allclose(block1.fragments[1].centroid(), centroid + [1, 0, 0]))
+        block1.rotate([0, 0, 1], 1.0, center=block1.centroid())
+        checkCoords(block1)
+        # Setting a coordinate through the block or fragment changes both
+        block1.coord(3, [1.0, 2.0, 3.0])
+        self.assertTrue(np.array_equal(block1.fragments[0].coord(3), [1.0, 2.0, 3.0]))
+        checkCoords(block1)
+
+        # Copies are independent of the original
+        copy = block1.copy()
+        copy.translate([5, 5, 5])
+        checkCoords(copy)
+        checkCoords(block1)
+        self.assertTrue(np.allclose(copy.coords() - block1.coords(), 5))
+        return
+
     def testPositionGrowBlock(self):
 
         blockS = Block(filePath=self.benzeneCar, fragmentType="A")
@@ -2,12 +2,14 @@
 import sys
 import math
 import os
+import random
 import unittest
 
 import numpy as np
 
 import context
 from context import ab_block
+from context import ab_bond
 from context import ab_subunit
 from context import ab_util
 from context import dlpoly
@@ -104,6 +106,47 @@ class Test(unittest.TestCase):
         self.assertEqual(added, 3)
         return
 
+    def testAttachBlockBatchRotations(self):
+        """Screening all the rotations at once must pick the same orientation as trying them in turn"""
+
+        def attach(batchRotations):
+            mycell = Cell([30, 30, 30], paramsDir=PARAMS_DIR)
+            mycell.libraryAddFragment(filename=self.benzene2Car, fragmentType="A")
+            mycell.libraryAddFragment(filename=self.ch4CarQ, fragmentType="B")
+            mycell.addBondType("A:a-A:a")
+            staticBlock = mycell.getLibraryBlock("A")
+            staticBlock.translateCentroid([15, 15, 15])
+            mycell.addBlock(staticBlock)
+            growBlock = mycell.getLibraryBlock("A")
+            staticEndGroup = staticBlock.freeEndGroups()[0]
+            growEndGroup = growBlock.freeEndGroups()[0]
+            # Put an obstacle on the atom furthest from the bond so the first orientation clashes
+            staticBlock.positionGrowBlock(staticEndGroup, growEndGroup)
+            coords = np.array(list(growBlock.iterCoord()))
+            endGroupCoord = coords[growEndGroup.endGroupIdx()]
+            axis = staticBlock.coord(staticEndGroup.endGroupIdx()) - endGroupCoord
+            offAxis = np.linalg.norm(np.cross(coords - endGroupCoord, axis), axis=1)
+            obstacle = mycell.getLibraryBlock("B")
+            obstacle.translateCentroid(coords[np.argmax(offAxis)])
+            mycell.addBlock(obstacle)
+            firstFits = mycell._screenPlacements(growBlock, coords[np.newaxis])[0]
+            ok = mycell.attachBlock(
+                growEndGroup, staticEndGroup, batchRotations=batchRotations
+            )
+            bonded = np.array(list(staticEndGroup.block().iterCoord()))
+            return ok, len(mycell.blocks), firstFits, bonded
+
+        ok1, nblocks1, firstFits, coords1 = attach(False)
+        ok2, nblocks2, _, coords2 = attach(True)
+        self.assertTrue(ok1)
+        self.assertTrue(ok2)
+        self.assertEqual(nblocks1, 2)
+        self.assertEqual(nblocks1, nblocks2)
+        # The block had to be rotated to fit
+        self.assertFalse(firstFits)
+        self.assertTrue(np.allclose(coords1, coords2))
+        return
+
     def testBond(self):
         """First pass"""
         boxDim = [30, 30, 30]
@@ -283,6 +326,33 @@ class Test(unittest.TestCase):
         os.unlink(fileName)
         return
 
+    def testCellData(self):
+        """The cell data arrays match the data of the atoms in each block"""
+        mycell = self.createTestCell()
+        blocks = list(mycell.blocks.values())
+        atoms = [(block, i) for block in blocks for i in range(block.numAtoms())]
+        for rigidBody in [True, False]:
+            d = mycell.cellData(rigidBody=rigidBody, noRigidParticles=True)
+            self.assertEqual(d.natoms, len(atoms))
+            self.assertEqual(d.atomTypes, [b.type(i) for b, i in atoms])
+            self.assertEqual(list(d.symbols), [b.symbol(i) for b, i in atoms])
+            self.assertTrue(np.allclose(d.masses, [b.mass(i) for b, i in atoms]))
+            coords = np.array([b.coord(i) for b, i in atoms])
+            self.assertTrue(np.allclose(d.coords + d.images * mycell.dim, coords))
+            self.assertEqual(len(d.bondLabels), len(d.bonds))
+            for (a1, a2), label in zip(d.bonds, d.bondLabels):
+                types = (d.atomTypes[a1], d.atomTypes[a2])
+                self.assertEqual(label, "{0}-{1}".format(*types))
+            for angle, label in zip(d.angles, d.angleLabels):
+                self.assertEqual(label, "-".join(d.atomTypes[a] for a in angle))
+            # The topology of each block only refers to that block's atoms
+            for i in range(len(blocks)):
+                bonds = d.bonds[d.bondOffsets[i] : d.bondOffsets[i + 1]]
+                self.assertTrue(np.all(bonds >= d.blockOffsets[i]))
+                self.assertTrue(np.all(bonds < d.blockOffsets[i + 1]))
+        self.assertEqual(len(d.bonds), sum(len(b.bonds()) for b in blocks))
+        return
+
     def testCloseAtoms(self):
         mycell = Cell(
             [30, 30, 30],
@@ -314,6 +384,11 @@ class Test(unittest.TestCase):
         # mycell.writeXyz("close1.xyz", label=False)
 
         self.assertEqual(closePairs, refPairs, "Many contacts: {0}".format(closePairs))
+        self.assertTrue(all(closeList["idxBlock2"] == block2_id))
+        for iatom, ioatom, distance in closeList[["idxAtom1", "idxAtom2", "distance"]]:
+            self.assertAlmostEqual(
+                distance, mycell.distance(block1.coord(iatom), block2.coord(ioatom))
+            )
 
         # Too far for any contacts
         mycell.delBlock(block2_id)
@@ -323,7 +398,7 @@ class Test(unittest.TestCase):
 
         close, wallClash = mycell.closeAtoms(block1_id)
         self.assertFalse(wallClash, "Wallclash")
-        self.assertFalse(close, "No contacts: ".format(close))
+        self.assertEqual(0, len(close), "No contacts: {0}".format(close))
 
         # Now check across periodic boundary
         mycell.delBlock(block2_id)
@@ -349,6 +424,91 @@ class Test(unittest.TestCase):
 
         return
 
+    def testRebin(self):
+        """Test rebinning moved blocks finds the same atoms as repopulating the cells"""
+        mycell = Cell([20, 20, 20], paramsDir=PARAMS_DIR)
+        mycell.libraryAddFragment(filename=self.benzeneCar, fragmentType="A")
+        mycell.addBondType("A:a-A:a")
+        mycell.seed(20, fragmentType="A")
+        rng = np.random.RandomState(17)
+        for block in mycell.blocks.values():
+            block.setCoords(
+                block.coords() + rng.normal(0.0, 0.5, size=(block.numAtoms(), 3))
+            )
+
+        def closeAndPairs():
+            close = dict(
+                (idxBlock, sorted(mycell.closeAtoms(idxBlock)[0].tolist()))
+                for idxBlock in mycell.blocks
+            )
+            pairs = mycell.endGroupIndex.pairs(6.0)
+            pairs = sorted(
+                tuple(sorted([(k1, a1), (k2, a2)]))
+                for k1, a1, k2, a2 in zip(*[p.tolist() for p in pairs[:4]])
+            )
+            return close, pairs
+
+        self.assertTrue(mycell.rebin() > 0)
+        rebinned = closeAndPairs()
+        mycell.repopulateCells()
+        self.assertEqual(rebinned, closeAndPairs())
+        return
+
+    @unittest.skipIf(xyz_core.cKDTree is None, "scipy is not installed")
+    def testNeighbourBackends(self):
+        """Test the cell list and KD-tree backends find the same atoms"""
+        mycell = Cell([20, 20, 20], paramsDir=PARAMS_DIR)
+        mycell.libraryAddFragment(filename=self.benzeneCar, fragmentType="A")
+        mycell.addBondType("A:a-A:a")
+        mycell.seed(15, fragmentType="A")
+        mycell.growBlocks(10, maxTries=20)
+        growBlock = mycell.getLibraryBlock("A")
+        rng = np.random.RandomState(29)
+        placements = growBlock.coords() + rng.uniform(0.0, 20.0, size=(50, 1, 3))
+        possibleBonds = []
+
+        def search():
+            close = dict(
+                (idxBlock, sorted(mycell.closeAtoms(idxBlock)[0].tolist()))
+                for idxBlock in mycell.blocks
+            )
+            pairs = mycell.endGroupIndex.pairs(
+                6.5, backend=mycell.neighbourBackends["zipBlocks"]
+            )
+            pairs = [p.tolist() for p in pairs]
+            if not possibleBonds:
+                for k1, a1, k2, a2 in zip(*pairs[:4]):
+                    if k1 == k2:
+                        continue
+                    eg1 = mycell.blocks[k1].freeEndGroups()
+                    eg2 = mycell.blocks[k2].freeEndGroups()
+                    eg1 = [e for e in eg1 if e.endGroupIdx() == a1][0]
+                    eg2 = [e for e in eg2 if e.endGroupIdx() == a2][0]
+                    possibleBonds.append(ab_bond.Bond(eg1, eg2))
+            clashes = mycell.bondClashes(possibleBonds, 3.0).tolist()
+            possible = mycell._screenPlacements(growBlock, placements).tolist()
+            return close, pairs, clashes, possible
+
+        cells = search()
+        mycell.setNeighbourBackend("kdtree")
+        kdtree = search()
+        self.assertEqual(cells[0], kdtree[0])
+        self.assertEqual(cells[1][:4], kdtree[1][:4])
+        self.assertTrue(np.allclose(cells[1][4], kdtree[1][4]))
+        self.assertEqual(cells[2:], kdtree[2:])
+        self.assertTrue(len(possibleBonds) > 0 and any(cells[2]))
+        self.assertTrue(mycell.zipBlocks(bondMargin=4.0, bondAngleMargin=60) > 0)
+
+        mycell = Cell([20, 20, 20], paramsDir=PARAMS_DIR)
+        mycell.setNeighbourBackend("kdtree", operations="zipBlocks")
+        self.assertEqual(mycell.neighbourBackends["zipBlocks"], "kdtree")
+        self.assertEqual(mycell.neighbourBackends["closeAtoms"], "cells")
+        self.assertRaises(RuntimeError, mycell.setNeighbourBackend, "octree")
+        self.assertRaises(
+            RuntimeError, mycell.setNeighbourBackend, "kdtree", operations="seed"
+        )
+        return
+
     def testCloseAtoms2(self):
         mycell = Cell(
             [2.1, 2.1, 2.1],
@@ -368,7 +528,7 @@ class Test(unittest.TestCase):
         block1Idx = mycell.addBlock(block1)
         # Alone in cell but in center
         close, wallClash = mycell.closeAtoms(block1Idx)
-        self.assertFalse(close)
+        self.assertEqual(0, len(close))
         self.assertFalse(wallClash)
         # Add second block overlapping first but in other image
         block2 = mycell.getLibraryBlock("A")
@@ -686,6 +846,18 @@ class Test(unittest.TestCase):
 
         return
 
+    def testFreeEndGroupCounts(self):
+        """Test the free endGroups of each type are counted straight after the blocks are added"""
+        mycell = Cell([30, 30, 30], paramsDir=PARAMS_DIR)
+        mycell.libraryAddFragment(fragmentType="A", filename=self.ch4Car)
+        mycell.libraryAddFragment(fragmentType="B", filename=self.ch4Car)
+        mycell.addBondType("A:a-B:a")
+        mycell.seed(3, fragmentType="A")
+        mycell.seed(2, fragmentType="B")
+        self.assertEqual(mycell.freeEndGroupCounts(), {"A:a": 12, "B:a": 8})
+        self.assertEqual(mycell.numFreeEndGroups(), 20)
+        return
+
     @unittest.skip("Broken test")
     def testFragMaxEnergy(self):
         """
@@ -821,6 +993,28 @@ class Test(unittest.TestCase):
 
         return
 
+    def testGrowBlocksBatch(self):
+        """Growing in speculative batches adds clash-free blocks and is reproducible"""
+
+        def grow():
+            random.seed(5)
+            mycell = Cell([20, 20, 20], paramsDir=PARAMS_DIR)
+            mycell.libraryAddFragment(filename=self.benzeneCar, fragmentType="A")
+            mycell.addBondType("A:a-A:a")
+            mycell.seed(10)
+            added = mycell.growBlocks(20, maxTries=100, batchSize=8)
+            coords = [np.array(list(b.iterCoord())) for b in mycell.blocks.values()]
+            return added, mycell, np.concatenate(coords)
+
+        added1, mycell, coords1 = grow()
+        added2, _, coords2 = grow()
+        self.assertEqual(added1, 20)
+        self.assertEqual(added2, 20)
+        self.assertEqual(mycell.numAtoms(), 30 * 12 - 20 * 2)
+        self.assertTrue(np.array_equal(coords1, coords2))
+        self.assertFalse(self.clashes(mycell))
+        return
+
     def testGrowLimited(self):
         """Test we can add blocks correctly"""
         boxDim = [30, 30, 30]
@@ -1087,6 +1281,131 @@ class Test(unittest.TestCase):
 
         return
 
+    def testLibraryBlockReuse(self):
+        """Library blocks are independent copies of the prototype and discarded ones are reset for reuse"""
+        mycell = Cell([30, 30, 30], paramsDir=PARAMS_DIR)
+        mycell.libraryAddFragment(filename=self.benzene2Car, fragmentType="A")
+        mycell.addBondType("A:a-A:a")
+        libraryCoords = mycell._fragmentLibrary["A"].coords()
+
+        block1 = mycell.getLibraryBlock("A")
+        block2 = mycell.getLibraryBlock("A")
+        self.assertEqual(block1.checkUpdate(), [])
+        block1.translate([1.0, 2.0, 3.0])
+        self.assertTrue(np.allclose(block2.coords(), libraryCoords))
+        endGroups1 = block1.freeEndGroups()
+        self.assertTrue(all(eg.block() is block1 for eg in endGroups1))
+        self.assertTrue(all(eg.block() is block2 for eg in block2.freeEndGroups()))
+        # The per-atom arrays are shared with the prototype, so mustn't be changeable through one block
+        for a in (block1.radii(), block1.symbols(), block1.types()):
+            self.assertRaises(ValueError, a.__setitem__, 0, a[1])
+
+        # A block that has been bonded can't be reused
+        mycell.seed(1, center=True)
+        self.assertEqual(mycell.growBlocks(1), 1)
+        bonded = list(mycell.blocks.values())[0]
+        mycell.delBlock(bonded.id)
+        pooled = len(mycell._libraryBlockPool.get("A", []))
+        mycell._releaseLibraryBlock(bonded)
+        self.assertEqual(len(mycell._libraryBlockPool.get("A", [])), pooled)
+
+        mycell._releaseLibraryBlock(block1)
+        block3 = mycell.getLibraryBlock("A")
+        self.assertIs(block3, block1)
+        self.assertTrue(np.allclose(block3.coords(), libraryCoords))
+        self.assertEqual(block3.numFreeEndGroups(), 2)
+        self.assertFalse(set(block3.freeEndGroups()) & set(endGroups1))
+        self.assertEqual(block3.checkUpdate(), [])
+        return
+
+    def testTopologyTemplate(self):
+        """Unbonded blocks share their fragment's topology template and bonded ones don't"""
+        mycell = Cell([30, 30, 30], paramsDir=PARAMS_DIR)
+        mycell.libraryAddFragment(filename=self.benzene2Car, fragmentType="A")
+        mycell.addBondType("A:a-A:a")
+        template = mycell._fragmentLibrary["A"].topologyTemplate()
+        self.assertEqual([len(t) for t in template], [18, 24, 6])
+
+        mycell.seed(2, center=True)
+        for block in mycell.blocks.values():
+            self.assertIs(block.topology(), template)
+
+        self.assertEqual(mycell.growBlocks(1), 1)
+        for block in mycell.blocks.values():
+            if len(block.fragments) == 1:
+                self.assertIs(block.topology(), template)
+                continue
+            topology = block.topology()
+            self.assertIsNot(topology, template)
+            graph = xyz_core.bondGraph(block.bonds(), block.numAtoms())
+            ref = xyz_core.bondTopology(*graph)
+            for result, expected in zip(topology, ref):
+                self.assertTrue(np.array_equal(result, expected))
+            self.assertTrue(max(t.max() for t in topology) < block.numAtoms())
+        return
+
+    @unittest.skipUnless(
+        ab_util.HOOMDVERSION and ab_util.HOOMDVERSION[0] > 1,
+        "Need HOOMD-BLUE 2 to run",
+    )
+    def testCreateSnapshotRigid(self):
+        from ambuild import hoomd2
+
+        mycell = self.createTestCell(boxWidth=30)
+        data = mycell.cellData(rigidBody=True)
+        mdEngine = hoomd2.Hoomd2(mycell.paramsDir)
+        mdEngine.rigidBody = True
+        snapshot = mdEngine.createSnapshot(data)
+        nbodies = len(data.rigidParticles)
+        bodySizes = [rp.natoms for rp in data.rigidParticles]
+        particles = snapshot.particles
+        self.assertEqual(particles.N, nbodies + data.natoms)
+        self.assertTrue(np.array_equal(particles.body[:nbodies], np.arange(nbodies)))
+        self.assertTrue(
+            np.array_equal(
+                particles.body[nbodies:], np.repeat(np.arange(nbodies), bodySizes)
+            )
+        )
+        # Constituent particles take the image of their central particle
+        self.assertTrue(
+            np.array_equal(
+                particles.image[nbodies:],
+                np.repeat(particles.image[:nbodies], bodySizes, axis=0),
+            )
+        )
+        self.assertTrue(np.array_equal(snapshot.bonds.group, data.bonds + nbodies))
+        return
+
+    @unittest.skipUnless(
+        ab_util.HOOMDVERSION and ab_util.HOOMDVERSION[0] > 1,
+        "Need HOOMD-BLUE 2 to run",
+    )
+    def testOptimiseGeometrySession(self):
+        mycell = self.createTestCell(boxWidth=30)
+        mycell.setMdSession()
+        ok = mycell.optimiseGeometry(rigidBody=False, optCycles=1000, quiet=True)
+        self.assertTrue(ok)
+        mdEngine = mycell._mdEngine
+        sessionKey = mdEngine._sessionKey
+        # Adding blocks of the same types reuses the simulation
+        mycell.seed(1, fragmentType="A")
+        ok = mycell.optimiseGeometry(rigidBody=False, optCycles=1000, quiet=True)
+        self.assertTrue(ok)
+        self.assertIs(mycell._mdEngine, mdEngine)
+        self.assertEqual(mdEngine._sessionKey, sessionKey)
+        self.assertEqual(len(mdEngine.system.particles), mycell.numAtoms())
+        self.assertFalse(self.clashes(mycell))
+        return
+
+    @unittest.skipIf(
+        ab_util.HOOMDVERSION and ab_util.HOOMDVERSION[0] > 1,
+        "Only runs without HOOMD-BLUE 2",
+    )
+    def testMdSessionNeedsHoomd2(self):
+        mycell = Cell([30, 30, 30], paramsDir=PARAMS_DIR)
+        self.assertRaises(RuntimeError, mycell.setMdSession)
+        return
+
     @unittest.skipUnless(ab_util.HOOMDVERSION is not None, "Need HOOMD-BLUE to run")
     def testOptimiseGeometryRigid(self):
         mycell = self.createTestCell(boxWidth=30)
@@ -1356,6 +1675,36 @@ class Test(unittest.TestCase):
         self.assertFalse(self.clashes(mycell))
         return
 
+    def testSeedBatch(self):
+        """Seeding in batches must pick the same placement as trying them in turn and be reproducible"""
+
+        def seed(nblocks, batchSize=None, processes=None):
+            random.seed(1)
+            mycell = Cell([15, 15, 15], paramsDir=PARAMS_DIR)
+            mycell.libraryAddFragment(filename=self.ch4CarQ, fragmentType="A")
+            mycell.seed(80, fragmentType="A")
+            random.seed(2)
+            added = mycell.seed(
+                nblocks, fragmentType="A", batchSize=batchSize, processes=processes
+            )
+            coords = [np.array(list(b.iterCoord())) for b in mycell.blocks.values()]
+            return added, mycell, np.concatenate(coords)
+
+        added1, _, coords1 = seed(1)
+        added2, _, coords2 = seed(1, batchSize=25)
+        self.assertEqual(added1, 1)
+        self.assertEqual(added2, 1)
+        self.assertTrue(np.allclose(coords1, coords2))
+
+        nblocks = 5
+        added1, mycell, coords1 = seed(nblocks, batchSize=25)
+        added2, _, coords2 = seed(nblocks, batchSize=25, processes=2)
+        self.assertEqual(added1, nblocks)
+        self.assertEqual(added2, nblocks)
+        self.assertTrue(np.allclose(coords1, coords2))
+        self.assertFalse(self.clashes(mycell))
+        return
+
     def testSetBoxSize(self):
 
         boxDim = [10, 10, 10]
@@ -1697,6 +2046,68 @@ class Test(unittest.TestCase):
         self.assertFalse(self.clashes(mycell))
         return
 
+    def testZipMatch(self):
+        """zipBlocks picks the best bonds that keep within the maxBond limits"""
+        boxDim = [12.0, 12.0, 12.0]
+        mycell = Cell(boxDim, paramsDir=PARAMS_DIR)
+        mycell.libraryAddFragment(filename=self.ch4Car, fragmentType="A")
+        mycell.addBondType("A:a-A:a")
+        mycell.setMaxBond("A:a", 1)
+        b1 = mycell.getLibraryBlock("A")
+        b2 = mycell.getLibraryBlock("A")
+        b3 = mycell.getLibraryBlock("A")
+        b4 = mycell.getLibraryBlock("A")
+        # b1, b3 and b4 around b2, with only b4 positioned perfectly
+        b2.translateCentroid([mycell.dim[0] / 2, mycell.dim[1] / 2, mycell.dim[2] / 2])
+        for i, block in enumerate([b1, b3, b4]):
+            b2.positionGrowBlock(
+                b2.freeEndGroups()[i], block.freeEndGroups()[0], dihedral=math.pi
+            )
+            if block is not b4:
+                block.rotateT([0, 1, 0], math.radians(10))
+        fragments = [b.fragments[0] for b in [b1, b2, b3, b4]]
+        for block in [b1, b2, b3, b4]:
+            mycell.addBlock(block)
+        # All three bonds have an acceptable geometry, but b2 can only make one
+        made = mycell.zipBlocks(bondMargin=0.5, bondAngleMargin=16)
+        self.assertEqual(made, 1)
+        self.assertEqual([f.bondsAvailable("A:a") for f in fragments], [1, 0, 1, 0])
+        return
+
+    def testZipParallel(self):
+        """Zipping slabs of the cell in parallel makes the same bonds as zipping it in one go"""
+        random.seed(3)
+        mycell = Cell([20.0, 15.0, 15.0], paramsDir=PARAMS_DIR)
+        mycell.libraryAddFragment(filename=self.ch4Car, fragmentType="A")
+        mycell.addBondType("A:a-A:a")
+        mycell.setMaxBond("A:a", 2)
+        mycell.seed(80)
+        data = pickle.dumps(mycell)
+
+        def zipped(processes):
+            zcell = pickle.loads(data)
+            made = zcell.zipBlocks(
+                bondMargin=2.0,
+                bondAngleMargin=120,
+                clashCheck=True,
+                clashDist=1.0,
+                processes=processes,
+            )
+            bonds = sorted(
+                (len(b.blockBonds()), b.blockBonds()) for b in zcell.blocks.values()
+            )
+            coords = np.concatenate([b.coords() for b in zcell.blocks.values()])
+            return made, bonds, coords
+
+        made1, bonds1, coords1 = zipped(None)
+        self.assertGreater(made1, 0)
+        for processes in [2, 3]:
+            made2, bonds2, coords2 = zipped(processes)
+            self.assertEqual(made1, made2)
+            self.assertEqual(bonds1, bonds2)
+            self.assertTrue(np.array_equal(coords1, coords2))
+        return
+
     def testZipClash1(self):
         """Test no clashes"""
         boxDim = [25, 25, 25]
@@ -1769,6 +2180,55 @@ class Test(unittest.TestCase):
         self.assertFalse(self.clashes(mycell))
         return
 
+    def testBondClashes(self):
+        """Test the bond clashes against the distance of every atom from the bond"""
+        boxDim = [25, 25, 25]
+        mycell = Cell(boxDim, paramsDir=PARAMS_DIR)
+        mycell.libraryAddFragment(filename=self.benzeneCar, fragmentType="A")
+        mycell.addBondType("A:a-A:a")
+        b1 = ab_block.Block(filePath=self.benzeneCar, fragmentType="A")
+        b1.alignAtoms(0, 3, [1, 0, 0])
+        b2 = b1.copy()
+        b3 = b1.copy()
+        # b1 and b3 either side of the x boundary with b2 just off the bond axis
+        b1.translateCentroid([mycell.dim[0] - 3, 10, 10])
+        b2.translateCentroid([0.5, 12.5, 10])
+        b3.translateCentroid([3, 10, 10])
+        for b in [b1, b2, b3]:
+            mycell.addBlock(b)
+
+        def xCoord(block, sign):
+            return lambda eg: sign * block.coord(eg.endGroupIdx())[0]
+
+        eg1 = max(b1.freeEndGroups(), key=xCoord(b1, 1))
+        eg2 = max(b3.freeEndGroups(), key=xCoord(b3, -1))
+        bond = ab_bond.Bond(eg1, eg2)
+        ignore = [
+            (b1.id, eg1.endGroupIdx()),
+            (b1.id, eg1.capIdx()),
+            (b3.id, eg2.endGroupIdx()),
+            (b3.id, eg2.capIdx()),
+        ]
+        p1 = b1.coord(eg1.endGroupIdx())
+        p2p1 = mycell.vecDiff(b3.coord(eg2.endGroupIdx()), p1)
+        dists = []
+        for b in [b1, b2, b3]:
+            for i, coord in enumerate(b.coords()):
+                if (b.id, i) in ignore:
+                    continue
+                p3p1 = mycell.vecDiff(coord, p1)
+                t = np.dot(p3p1, p2p1) / np.dot(p2p1, p2p1)
+                if 0 < t < 1:
+                    dists.append(
+                        np.linalg.norm(np.cross(p3p1, p2p1)) / np.linalg.norm(p2p1)
+                    )
+        # Include a clashDist larger than the boxSize
+        for clashDist in [0.5, 1.0, 1.5, 2.0, 3.0, 4.0]:
+            ref = min(dists) < clashDist
+            self.assertEqual(mycell.bondClash(bond, clashDist), ref)
+        self.assertEqual(mycell.bondClashes([bond, bond], 4.0).tolist(), [True, True])
+        return
+
     def testZipClashPBC1(self):
         """Test clash for bond across PBC"""
         boxDim = [25, 25, 25]
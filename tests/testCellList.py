@@ -0,0 +1,379 @@
+"""
+Tests for the array-backed spatial hash
+"""
+import itertools
+import os
+import random
+import unittest
+import numpy as np
+
+import context
+from context import ab_block
+from context import ab_celllist
+from context import xyz_core
+from context import xyz_util
+
+
+class Test(unittest.TestCase):
+    def bruteForce(self, cl, coords, blocks, query, exclude=None):
+        """Return the set of (idxQuery, blockKey, idxAtom) within boxSize of each query coordinate"""
+        ref = set()
+        for iq, q in enumerate(query):
+            for key, bcoords in blocks.items():
+                if key == exclude:
+                    continue
+                d = xyz_core.distance(
+                    np.array([q] * len(bcoords)), bcoords, dim=cl.dim, pbc=cl.pbc
+                )
+                for idxAtom in np.flatnonzero(d < cl.boxSize):
+                    ref.add((iq, key, idxAtom))
+        return ref
+
+    def closeSet(self, cl, query, exclude=None):
+        idx, slots = cl.neighbours(query, exclude=exclude)
+        d = xyz_core.distance(query[idx], cl.coords[slots], dim=cl.dim, pbc=cl.pbc)
+        keep = d < cl.boxSize
+        return set(
+            zip(
+                idx[keep].tolist(),
+                cl.blockKeys(slots[keep]).tolist(),
+                cl.atomIdx[slots[keep]].tolist(),
+            )
+        )
+
+    def testNeighbours(self):
+        rng = np.random.RandomState(7)
+        for dim, pbc in [
+            ([10.0, 10.0, 10.0], [True, True, True]),
+            ([10.0, 4.0, 3.0], [True, True, True]),
+            ([10.0, 10.0, 10.0], [False, True, True]),
+            ([5.0, 5.0, 5.0], [False, False, False]),
+        ]:
+            cl = ab_celllist.CellList(2.1, dim, pbc)
+            blocks = {}
+            for key in range(20):
+                # Include coordinates outside the cell
+                blocks[key] = rng.uniform(-2.0, 12.0, size=(5, 3))
+                cl.add(key, blocks[key])
+            query = rng.uniform(-1.0, 11.0, size=(30, 3))
+            self.assertEqual(
+                self.bruteForce(cl, None, blocks, query, exclude=3),
+                self.closeSet(cl, query, exclude=3),
+            )
+
+    def testAddRemove(self):
+        rng = np.random.RandomState(11)
+        dim, pbc = [12.0, 12.0, 12.0], [True, True, True]
+        cl = ab_celllist.CellList(1.7, dim, pbc)
+        blocks = {}
+        for key in range(200):
+            blocks[key] = rng.uniform(0.0, 12.0, size=(4, 3))
+            cl.add(key, blocks[key])
+            # Remove blocks from the sorted and pending regions
+            if key % 3 == 0:
+                toGo = rng.choice(sorted(blocks.keys()))
+                cl.remove(toGo)
+                del blocks[toGo]
+        self.assertEqual(sum(len(c) for c in blocks.values()), len(cl))
+        query = rng.uniform(0.0, 12.0, size=(50, 3))
+        self.assertEqual(
+            self.bruteForce(cl, None, blocks, query), self.closeSet(cl, query)
+        )
+        cl.rebuild()
+        self.assertEqual(
+            self.bruteForce(cl, None, blocks, query), self.closeSet(cl, query)
+        )
+        self.assertRaises(RuntimeError, cl.add, list(blocks.keys())[0], query)
+
+    def testUpdateCoords(self):
+        rng = np.random.RandomState(13)
+        dim, pbc = [12.0, 12.0, 12.0], [True, True, False]
+        cl = ab_celllist.CellList(1.7, dim, pbc)
+        blocks = {}
+        for key in range(100):
+            blocks[key] = rng.uniform(0.0, 12.0, size=(4, 3))
+            cl.add(key, blocks[key])
+            if key == 80:
+                # Leave some blocks in the pending region
+                cl.rebuild()
+        cl.remove(10)
+        del blocks[10]
+        # Move most atoms a little and a few a long way
+        keys = sorted(blocks.keys())[::2]
+        for key in keys:
+            blocks[key] = blocks[key] + rng.normal(0.0, 0.5, size=(4, 3))
+        blocks[keys[0]] += 6.0
+        moved = cl.updateCoords(keys, np.concatenate([blocks[k] for k in keys]))
+        self.assertTrue(0 < moved < 4 * len(keys))
+        self.assertTrue(np.all(np.diff(cl.box[cl.order]) >= 0))
+        query = rng.uniform(0.0, 12.0, size=(50, 3))
+        self.assertEqual(
+            self.bruteForce(cl, None, blocks, query), self.closeSet(cl, query)
+        )
+        cl.rebuild()
+        self.assertEqual(
+            self.bruteForce(cl, None, blocks, query), self.closeSet(cl, query)
+        )
+        self.assertRaises(RuntimeError, cl.updateCoords, keys, query)
+
+    def testHaloSmallCell(self):
+        """Boxes must only be visited once when there are fewer than 3 along an axis"""
+        cl = ab_celllist.CellList(1.0, [2.0, 1.0, 5.0], [True, True, True])
+        halo = cl.halo(np.array([[0, 0, 2]]))
+        halo = halo[halo >= 0]
+        self.assertEqual(len(halo), len(set(halo.tolist())))
+        self.assertEqual(len(halo), 2 * 1 * 3)
+
+    def testEndGroupIndexPairs(self):
+        rng = np.random.RandomState(5)
+        dim, pbc = np.array([12.0, 12.0, 12.0]), [True, True, False]
+        xyz_util.setModuleBondLength(
+            os.path.join(context.PARAMS_DIR, "bond_params.csv")
+        )
+        index = ab_celllist.EndGroupIndex(1.5, dim, pbc)
+        ch4Car = os.path.join(context.BLOCKS_DIR, "ch4.car")
+        blocks = {}
+        for key in range(30):
+            block = ab_block.Block(filePath=ch4Car, fragmentType="A")
+            block.translateCentroid(rng.uniform(0.0, 12.0, size=3))
+            blocks[key] = block
+            index.add(key, block)
+            if key % 4 == 0:
+                # Remove blocks that are both queued and binned
+                toGo = rng.choice(sorted(blocks.keys()))
+                index.remove(toGo)
+                del blocks[toGo]
+        endGroups = [
+            (key, idxAtom, block.coord(idxAtom))
+            for key, block in blocks.items()
+            for idxAtom in sorted(set(e.endGroupIdx() for e in block.freeEndGroups()))
+        ]
+        self.assertEqual(len(index), len(endGroups))
+        # Cutoffs both within and beyond a single box
+        for cutoff in [1.4, 4.0]:
+            ref = set()
+            for (k1, a1, c1), (k2, a2, c2) in itertools.combinations(endGroups, 2):
+                if xyz_core.distance(c1, c2, dim=dim, pbc=pbc) < cutoff:
+                    ref.add((k1, a1, k2, a2))
+            keys1, atoms1, keys2, atoms2, distances = index.pairs(cutoff)
+            got = set(
+                zip(keys1.tolist(), atoms1.tolist(), keys2.tolist(), atoms2.tolist())
+            )
+            self.assertEqual(len(got), len(keys1))
+            self.assertEqual(ref, got)
+            self.assertTrue(np.all(distances < cutoff))
+
+    @unittest.skipIf(xyz_core.cKDTree is None, "scipy is not installed")
+    def testWithinBackends(self):
+        rng = np.random.RandomState(23)
+        dim, pbc = [12.0, 9.0, 10.0], [True, False, True]
+        cl = ab_celllist.CellList(1.7, dim, pbc)
+        blocks = {}
+        for key in range(120):
+            blocks[key] = rng.uniform(-1.0, 12.0, size=(4, 3))
+            cl.add(key, blocks[key])
+            if key == 100:
+                # Leave some blocks in the pending region
+                cl.rebuild()
+            if key % 7 == 0:
+                toGo = rng.choice(sorted(blocks.keys()))
+                cl.remove(toGo)
+                del blocks[toGo]
+        query = rng.uniform(0.0, 12.0, size=(40, 3))
+        # Cutoffs both within and beyond a single box
+        cutoff = rng.uniform(0.5, 4.0, size=len(query))
+        ref = set()
+        for iq, q in enumerate(query):
+            for key, bcoords in blocks.items():
+                d = xyz_core.distance(q, bcoords, dim=cl.dim, pbc=cl.pbc)
+                if key != 5:
+                    ref.update((iq, key, i) for i in np.flatnonzero(d <= cutoff[iq]))
+        results = []
+        for backend in ab_celllist.BACKENDS:
+            idx, slots, distances = cl.within(query, cutoff, exclude=5, backend=backend)
+            keys, atoms = cl.blockKeys(slots), cl.atomIdx[slots]
+            got = list(zip(idx.tolist(), keys.tolist(), atoms.tolist()))
+            self.assertEqual(ref, set(got))
+            self.assertEqual(len(ref), len(got))
+            results.append((idx, slots, distances))
+        self.assertTrue(np.array_equal(results[0][0], results[1][0]))
+        self.assertTrue(np.array_equal(results[0][1], results[1][1]))
+        self.assertTrue(np.allclose(results[0][2], results[1][2]))
+
+        ref = set()
+        atoms = [(k, i, c) for k in blocks for i, c in enumerate(blocks[k])]
+        for (k1, a1, c1), (k2, a2, c2) in itertools.combinations(atoms, 2):
+            if xyz_core.distance(c1, c2, dim=cl.dim, pbc=cl.pbc) < 2.5:
+                ref.add(tuple(sorted([(k1, a1), (k2, a2)])))
+        for backend in ab_celllist.BACKENDS:
+            slots1, slots2, distances = cl.pairs(2.5, backend=backend)
+            self.assertTrue(np.all(slots1 < slots2))
+            got = set(
+                tuple(sorted([(k1, a1), (k2, a2)]))
+                for k1, a1, k2, a2 in zip(
+                    cl.blockKeys(slots1).tolist(),
+                    cl.atomIdx[slots1].tolist(),
+                    cl.blockKeys(slots2).tolist(),
+                    cl.atomIdx[slots2].tolist(),
+                )
+            )
+            self.assertEqual(ref, got)
+        self.assertRaises(RuntimeError, cl.within, query, cutoff, backend="octree")
+
+    def testBlockSphereIndex(self):
+        rng = np.random.RandomState(19)
+        dim, pbc = np.array([30.0, 30.0, 30.0]), [True, True, False]
+        xyz_util.setModuleBondLength(
+            os.path.join(context.PARAMS_DIR, "bond_params.csv")
+        )
+        index = ab_celllist.BlockSphereIndex(3.0, dim, pbc)
+        ch4Car = os.path.join(context.BLOCKS_DIR, "ch4.car")
+        blocks = {}
+        for key in range(300):
+            block = ab_block.Block(filePath=ch4Car, fragmentType="A")
+            block.translateCentroid(rng.uniform(0.0, 30.0, size=3))
+            blocks[key] = block
+            index.add(key, block)
+            if key % 5 == 0:
+                toGo = rng.choice(sorted(blocks.keys()))
+                index.remove(toGo)
+                del blocks[toGo]
+        self.assertEqual(len(index), len(blocks))
+        centres = rng.uniform(0.0, 30.0, size=(20, 3))
+        radii = rng.uniform(0.5, 3.0, size=20)
+        # Margins that search the grid and that check every block
+        for margin in [0.5, 20.0]:
+            ref = set()
+            for i, (centre, radius) in enumerate(zip(centres, radii)):
+                for key, block in blocks.items():
+                    d = xyz_core.distance(centre, block.centroid(), dim=dim, pbc=pbc)
+                    if d <= radius + block.blockRadius() + margin and key != 7:
+                        ref.add((i, key))
+            idx, keys, centroids, blockRadii = index.overlapping(
+                centres, radii, margin, exclude=7
+            )
+            self.assertEqual(ref, set(zip(idx.tolist(), keys.tolist())))
+            self.assertEqual(len(ref), len(idx))
+
+    def testSlabDomains(self):
+        """Every coordinate is owned by one slab, which also holds everything close to it"""
+        rng = np.random.RandomState(23)
+        halo = 2.0
+        dim = np.array([20.0, 10.0, 10.0])
+        for pbc in [[True, True, True], [False, True, True]]:
+            # Include coordinates outside the cell
+            coords = rng.uniform(-2.0, 22.0, size=(400, 3))
+            close = np.array(
+                [xyz_core.distance(coords, c, dim=dim, pbc=pbc) < halo for c in coords]
+            )
+            for ndomains in [1, 3, 7, 30]:
+                domains = ab_celllist.slabDomains(coords, dim, pbc, ndomains, halo)
+                owners = np.concatenate([idx[owned] for idx, owned in domains])
+                self.assertEqual(sorted(owners.tolist()), list(range(len(coords))))
+                for idx, owned in domains:
+                    members = np.zeros(len(coords), dtype=bool)
+                    members[idx] = True
+                    self.assertTrue(np.all(members[np.any(close[idx[owned]], axis=0)]))
+        return
+
+    def testCellListPool(self):
+        """The pool's processes search an up to date copy of the CellList"""
+        rng = np.random.RandomState(29)
+        cl = ab_celllist.CellList(2.1, [15.0, 15.0, 15.0], [True, True, True])
+        pool = ab_celllist.CellListPool(2)
+        try:
+            for step in range(3):
+                # The later steps outgrow the shared buffers so the processes are restarted
+                start = len(cl._blockSlots) + step
+                for key in range(start, start + 50 + 250 * step):
+                    cl.add(key, rng.uniform(0.0, 15.0, size=(4, 3)), radii=0.5)
+                cl.remove(start + 7)
+                query = rng.uniform(0.0, 15.0, size=(40, 3))
+                cutoff = rng.uniform(1.0, 4.0, size=40)
+                for result, ref in zip(
+                    pool.within(cl, query, cutoff), cl.within(query, cutoff)
+                ):
+                    self.assertTrue(np.array_equal(result, ref))
+                for result, ref in zip(
+                    pool.clashes(cl, query, cutoff / 4, 0.1),
+                    cl.clashes(query, cutoff / 4, 0.1),
+                ):
+                    self.assertTrue(np.array_equal(result, ref))
+        finally:
+            pool.close()
+        return
+
+    def testEndGroupTypeRegistry(self):
+        random.seed(37)
+        registry = ab_celllist.EndGroupTypeRegistry()
+        ref = {}
+        for key in range(50):
+            types = ["A:a", "B:b", "C:c"][: key % 3 + 1]
+            registry.add(key, types)
+            ref[key] = types
+            if key % 4 == 0:
+                toGo = random.choice(sorted(ref.keys()))
+                registry.remove(toGo)
+                del ref[toGo]
+        self.assertEqual(len(registry), len(ref))
+        for endGroupType in ["A:a", "B:b", "C:c"]:
+            keys = set(k for k, types in ref.items() if endGroupType in types)
+            self.assertEqual(set(registry.keys(endGroupType)), keys)
+            self.assertEqual(registry.count(endGroupType), len(keys))
+            picked = set(registry.sample(endGroupType) for _ in range(2000))
+            self.assertEqual(picked, keys)
+            exclude = min(keys)
+            picked = set(
+                registry.sample(endGroupType, exclude=exclude) for _ in range(2000)
+            )
+            self.assertEqual(picked, keys - set([exclude]))
+        for key in list(ref.keys()):
+            if "C:c" in ref[key]:
+                registry.remove(key)
+        self.assertEqual(registry.types(), ["A:a", "B:b"])
+        self.assertFalse("C:c" in registry)
+        self.assertEqual(registry.sample("C:c"), None)
+        key = min(registry.keys("A:a"))
+        self.assertRaises(RuntimeError, registry.add, key, ["A:a"])
+
+    def testEndGroupTable(self):
+        rng = np.random.RandomState(11)
+        xyz_util.setModuleBondLength(
+            os.path.join(context.PARAMS_DIR, "bond_params.csv")
+        )
+        table = ab_celllist.EndGroupTable()
+        ch4Car = os.path.join(context.BLOCKS_DIR, "ch4.car")
+        blocks = {}
+        for key in range(300):
+            block = ab_block.Block(filePath=ch4Car, fragmentType="A")
+            # Block some of the endGroups
+            for endGroup in block.fragments[0].endGroups()[: key % 3]:
+                endGroup.blocked = True
+            block._update()
+            blocks[key] = block
+            table.add(key, block)
+            if key % 3 != 2:
+                # Remove blocks that are both queued and flattened, enough to compact the rows
+                toGo = rng.choice(sorted(blocks.keys()))
+                table.remove(toGo)
+                del blocks[toGo]
+            if key % 7 == 0:
+                self.assertEqual(len(table), 4 * len(blocks))
+        self.assertEqual(len(table), 4 * len(blocks))
+        free = [eg for block in blocks.values() for eg in block.freeEndGroups()]
+        self.assertEqual(table.numFree(), len(free))
+        rows = table.free()
+        self.assertEqual(set(table.endGroups[rows]), set(free))
+        self.assertTrue(np.all(table.state[rows] == 0))
+        for row in rows.tolist():
+            endGroup = table.endGroups[row]
+            self.assertIs(blocks[table.blockKey[row]], endGroup.block())
+            self.assertEqual(table.endGroupIdx[row], endGroup.endGroupIdx())
+            self.assertEqual(table.capIdx[row], endGroup.capIdx())
+        self.assertEqual(table.freeCounts(), {"A:a": len(free)})
+        self.assertEqual(len(table.free(endGroupTypes=["B:a"])), 0)
+        self.assertRaises(RuntimeError, table.add, min(blocks), blocks[min(blocks)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,5 @@
 # python imports
+import itertools
 import math
 import unittest
 
@@ -153,6 +154,54 @@ class Test(unittest.TestCase):
         coord = xyz_core.unWrapCoord3(cin, idxin, dim, centered=True)
         self.assertTrue(np.allclose(coord, np.array([101.0, 202.0, 303.0])))
 
+    def testAngles(self):
+        """angles matches angle, including across the periodic boundaries"""
+        rng = np.random.RandomState(3)
+        dim = np.array([10.0, 10.0, 10.0])
+        c1, c2, c3 = rng.uniform(0.0, 10.0, size=(3, 20, 3))
+        # Include straight and folded back angles
+        c3[0] = c2[0] + (c2[0] - c1[0])
+        c3[1] = c1[1]
+        pbc = [True, True, True]
+        for d in [None, dim]:
+            ref = [
+                xyz_core.angle(a, b, c, dim=d, pbc=pbc) for a, b, c in zip(c1, c2, c3)
+            ]
+            result = xyz_core.angles(c1, c2, c3, dim=d, pbc=pbc)
+            self.assertTrue(np.allclose(result, ref))
+        return
+
+    def testBondTopology(self):
+        """bondTopology matches enumerating the paths through the bond graph"""
+        # A four-membered ring with two branches, a chain and a repeated bond
+        bonds = [(0, 1), (1, 2), (2, 3), (3, 0), (1, 4), (5, 1), (4, 6), (6, 7), (1, 0)]
+        numAtoms = 9
+        indptr, neighbours = xyz_core.bondGraph(bonds, numAtoms)
+        bonded = [
+            neighbours[indptr[i] : indptr[i + 1]].tolist() for i in range(numAtoms)
+        ]
+        self.assertEqual(
+            bonded, [[1, 3], [0, 2, 4, 5], [1, 3], [0, 2], [1, 6], [1], [4, 7], [6], []]
+        )
+        angles = set()
+        propers = set()
+        impropers = []
+        for j in range(numAtoms):
+            for i, k in itertools.combinations(bonded[j], 2):
+                angles.add((i, j, k))
+            for i, k, l in itertools.combinations(bonded[j], 3):
+                impropers.append((j, i, k, l))
+            for k in bonded[j]:
+                for i in bonded[j]:
+                    for l in bonded[k]:
+                        if i != k and l != j:
+                            propers.add((i, j, k, l) if i < l else (l, k, j, i))
+        result = xyz_core.bondTopology(indptr, neighbours)
+        self.assertEqual([tuple(a) for a in result[0].tolist()], sorted(angles))
+        self.assertEqual([tuple(p) for p in result[1].tolist()], sorted(propers))
+        self.assertEqual([tuple(i) for i in result[2].tolist()], impropers)
+        return
+
     def testVectorAngle(self):
         """Test we can measure angles"""
         v1 = np.array([0, 0, 0])
@@ -5,6 +5,7 @@ import unittest
 # external imports
 import numpy as np
 
+from context import xyz_core
 from context import xyz_util
 from context import PARAMS_DIR
 
@@ -75,6 +76,37 @@ class Test(unittest.TestCase):
         # order of atoms doesn't 'matter
         self.assertEqual(set(close), set(ref_close))
 
+    @unittest.skipIf(xyz_core.cKDTree is None, "scipy is not installed")
+    def testCloseAtomsKDTree(self):
+        rng = np.random.RandomState(31)
+        coords = rng.uniform(0.0, 10.0, size=(200, 3))
+        symbols = ["c"] * len(coords)
+        for dim in [None, np.array([10.0, 10.0, 10.0])]:
+            close = xyz_util.closeAtoms(
+                coords, symbols, dim=dim, maxAtomRadius=0.8, backend="kdtree"
+            )
+            ref = [
+                (i, j)
+                for i in range(len(coords))
+                for j in range(i + 1, len(coords))
+                if xyz_core.distance(coords[i], coords[j], dim=dim) <= 2.6
+            ]
+            self.assertEqual(close, ref)
+            self.assertTrue(
+                set(close)
+                >= set(xyz_util.closeAtoms(coords, symbols, dim=dim, maxAtomRadius=0.8))
+                & set(ref)
+            )
+        bondLength = xyz_util.bondLength("c", "c")
+        ref = [
+            (i, j)
+            for i, j in ref
+            if abs(xyz_core.distance(coords[i], coords[j], dim=dim) - bondLength) < 0.2
+        ]
+        self.assertEqual(
+            xyz_util.calcBonds(coords, symbols, dim=dim, backend="kdtree"), ref
+        )
+
 
 if __name__ == "__main__":
     """